@@ -43,6 +43,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, to count the queries of the session and auth middlewares
+    'tracker.middleware.MetricsMiddleware',
+    'tracker.middleware.ProfilingMiddleware',
+    'tracker.middleware.QueryCountMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -56,7 +60,8 @@ ROOT_URLCONF = 'expense.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Django's, with the rendering time reported by the profiler
+        'BACKEND': 'tracker.profiling.DjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -80,11 +85,34 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file based test database (instead of the shared in-memory one)
+        # so that tests can exercise concurrent writers from several threads
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
 AUTH_USER_MODEL = 'tracker.User'
 
+# The sessions opened before tracker.auth.ModelBackend keep the backend
+# they were authenticated with
+AUTHENTICATION_BACKENDS = [
+    'tracker.auth.ModelBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+# Per-user read cache (tracker.cache). Its keys have the data version of
+# the user, kept in the database, so the workers never serve each other's
+# stale values; a shared backend (file based, memcached or redis) also
+# shares the cached values and the hit/miss counters between the workers
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tracker',
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
@@ -126,4 +154,32 @@ STATIC_URL = '/static/'
 MEDIA_ROOT = f'{os.path.dirname(os.path.dirname(os.path.abspath(__file__)))}/media'
 MEDIA_URL = '/media/'
 DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+# Share of the requests profiled by tracker.middleware.ProfilingMiddleware
+# (0 to 1, off by default)
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+
+# SQLite file of the metrics served at /metrics, shared by the processes of
+# the server, e.g. metrics.sqlite3 (off when unset or empty)
+METRICS_DB = os.environ.get('METRICS_DB', '')
+
+# Addresses allowed to scrape /metrics, comma separated in the environment.
+# REMOTE_ADDR is checked: behind a proxy, it is the address of the proxy
+METRICS_ALLOWED_IPS = os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+
+# Queries slower than this many milliseconds, e.g. 100, are logged with
+# their plan and counted per shape in METRICS_DB, see manage.py slow_queries
+# (off when unset or empty)
+SLOW_QUERY_MS = float(os.environ['SLOW_QUERY_MS']) if os.environ.get('SLOW_QUERY_MS') else None
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'tracker': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
 # USE_TZ = False
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Transaction, Balance, Category
+from .models import User, Transaction, Balance, Category, UserStats, DailySummary, AvatarJob
 
 
 # Register your models here.
@@ -7,3 +7,6 @@ admin.site.register(User)
 admin.site.register(Transaction)
 admin.site.register(Balance)
 admin.site.register(Category)
+admin.site.register(UserStats)
+admin.site.register(DailySummary)
+admin.site.register(AvatarJob)
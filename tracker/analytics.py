@@ -0,0 +1,169 @@
+import datetime
+import numpy as np
+from django.db import connections, models
+from django.db.models.functions import Cast
+from django.utils import timezone
+from .models import Category, Transaction
+
+PERCENTILES = (50, 90, 99)
+UNCATEGORIZED = 'Uncategorized'
+
+
+def to_datetime64(values):
+    '''Convert the raw created column to UTC datetime64, SQLite returns
+    strings which NumPy parses in C, other backends aware datetimes.'''
+    if values and isinstance(values[0], datetime.datetime):
+        values = [v.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+                  if timezone.is_aware(v) else v for v in values]
+    return np.array(values, dtype='datetime64[us]')
+
+
+def utc_offset(tz, value):
+    '''Offset in seconds of the time zone at a UTC datetime64'''
+    value = value.astype('datetime64[us]').astype(datetime.datetime)
+    return timezone.make_aware(value, datetime.timezone.utc).astimezone(tz).utcoffset() // datetime.timedelta(seconds=1)
+
+
+def to_local_dates(created):
+    '''Local dates of UTC datetime64 values. The time zone offset is computed
+    once per distinct day, and per distinct hour on the days it changes (DST
+    changes on the hour).'''
+    tz = timezone.get_current_timezone()
+    hours = created.astype('datetime64[h]')
+    days, inverse = np.unique(hours.astype(
+        'datetime64[D]'), return_inverse=True)
+    inverse = inverse.reshape(-1)
+    starts = np.array([utc_offset(tz, d) for d in days], dtype=np.int64)
+    ends = np.array([utc_offset(tz, d + 1) for d in days], dtype=np.int64)
+    offsets = starts[inverse]
+    for day in np.flatnonzero(starts != ends):
+        rows = np.flatnonzero(inverse == day)
+        day_hours, hour_inverse = np.unique(hours[rows], return_inverse=True)
+        offsets[rows] = np.array([utc_offset(tz, h) for h in day_hours])[
+            hour_inverse.reshape(-1)]
+    return (created + offsets.astype('timedelta64[s]')).astype('datetime64[D]')
+
+
+def money(cents):
+    return np.round(np.asarray(cents) / 100, 2).tolist()
+
+
+class Ledger:
+    '''The transactions of a user as NumPy columns: local dates, amounts in
+    cents and category ids (-1 without category).'''
+
+    def __init__(self, dates, amounts, categories):
+        self.dates = dates
+        self.amounts = amounts
+        self.categories = categories
+
+    def __len__(self):
+        return len(self.amounts)
+
+    @classmethod
+    def load(cls, user_id, using=None):
+        '''Read the three columns in one query, bypassing the model field
+        conversions (Decimal amounts, aware datetimes) which dominate the
+        cost on large ledgers.'''
+        queryset = Transaction.objects.using(using).filter(
+            user_id=user_id).order_by()
+        connection = connections[queryset.db]
+        created = 'created'
+        if connection.vendor == 'sqlite':
+            # Without the declared type, the sqlite3 module does not parse
+            # every datetime in Python
+            created = 'created_text'
+            queryset = queryset.annotate(
+                created_text=Cast('created', models.TextField()))
+        # The annotations come last in the SELECT
+        queryset = queryset.values_list('amount', 'category_id', created)
+        sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        if not rows:
+            return cls(np.array([], dtype='datetime64[D]'), np.array([], dtype=np.int64),
+                       np.array([], dtype=np.int64))
+        amounts, categories, created = zip(*rows)
+        return cls(to_local_dates(to_datetime64(created)), np.array(amounts, dtype=np.int64),
+                   np.array([-1 if c is None else c for c in categories], dtype=np.int64))
+
+    def select(self, source):
+        '''Sub-ledger of the income (positive) or expense (negative) amounts'''
+        mask = self.amounts > 0 if source == Transaction.INCOME else self.amounts < 0
+        return Ledger(self.dates[mask], self.amounts[mask], self.categories[mask])
+
+    def daily(self):
+        '''Dense daily sums from the first to the last day'''
+        first = self.dates.min()
+        days = (self.dates - first).astype(np.int64)
+        sums = np.bincount(days, weights=self.amounts)
+        return first + np.arange(len(sums)), sums
+
+    def rolling_average(self, window):
+        '''Average of the daily sums over the last `window` days, on the first
+        days of the ledger the average is over the days available.'''
+        dates, sums = self.daily()
+        totals = np.cumsum(sums)
+        totals[window:] = totals[window:] - totals[:-window]
+        return dates, totals / np.minimum(np.arange(1, len(sums) + 1), window)
+
+    def monthly(self):
+        '''Monthly sums, their change from the previous month (absolute and
+        relative, None for the first month or from zero)'''
+        months = self.dates.astype('datetime64[M]')
+        first = months.min()
+        sums = np.bincount((months - first).astype(np.int64),
+                           weights=self.amounts)
+        deltas = np.diff(sums, prepend=np.nan)
+        previous = np.concatenate(([np.nan], sums[:-1]))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            changes = np.where(previous != 0, deltas / np.abs(previous), np.nan)
+        return first + np.arange(len(sums)), sums, deltas, changes
+
+    def category_totals(self):
+        '''Category ids and their sums, largest (in absolute value) first'''
+        ids, inverse = np.unique(self.categories, return_inverse=True)
+        sums = np.bincount(inverse.reshape(-1), weights=self.amounts)
+        order = np.argsort(-np.abs(sums), kind='stable')
+        return ids[order], sums[order]
+
+    def percentiles(self, q=PERCENTILES):
+        '''Percentiles of the transaction sizes (absolute amounts)'''
+        return np.percentile(np.abs(self.amounts), q)
+
+
+def insights(user, source=Transaction.EXPENSE, window=7, using=None):
+    '''Rolling average of the daily sums, month over month changes, category
+    shares and amount percentiles of the income or expense transactions.'''
+    ledger = Ledger.load(user.id, using=using).select(source)
+    result = {
+        'source': source,
+        'rolling_average': {'window': window, 'time': [], 'amounts': []},
+        'monthly': {'time': [], 'amounts': [], 'deltas': [], 'changes': []},
+        'categories': {'titles': [], 'amounts': [], 'shares': []},
+        'percentiles': {},
+    }
+    if not len(ledger):
+        return result
+
+    dates, averages = ledger.rolling_average(window)
+    result['rolling_average'].update(
+        time=[str(d) for d in dates], amounts=money(averages))
+
+    months, sums, deltas, changes = ledger.monthly()
+    result['monthly'].update(
+        time=[str(m) for m in months], amounts=money(sums),
+        deltas=[None if np.isnan(d) else round(d / 100, 2) for d in deltas],
+        changes=[None if np.isnan(c) else round(c, 4) for c in changes])
+
+    ids, sums = ledger.category_totals()
+    titles = dict(Category.objects.using(using).filter(
+        user=user).values_list('id', 'title'))
+    result['categories'].update(
+        titles=[titles.get(i, UNCATEGORIZED) for i in ids.tolist()], amounts=money(sums),
+        shares=np.round(sums / sums.sum(), 4).tolist())
+
+    result['percentiles'] = dict(
+        zip(map(str, PERCENTILES), money(ledger.percentiles())))
+    return result
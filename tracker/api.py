@@ -1,81 +1,200 @@
-
 import json
-from datetime import timedelta
+import logging
+from datetime import date, timedelta
+from urllib.parse import urlsplit
+from django.core.handlers.asgi import ASGIRequest
 from django.utils import timezone
-from django.http import JsonResponse
-from django.db.models import Sum
-from .models import Category, Transaction
-from .utils import login_required_ajax
-from django.core.serializers import serialize
-from django.contrib.humanize.templatetags.humanize import naturaltime
+from django.http import HttpRequest, HttpResponse, JsonResponse, QueryDict, StreamingHttpResponse
+from django.urls import Resolver404, resolve
+from django.db.models import Q
+from django.core.exceptions import ValidationError
+from .models import AvatarJob, Category, Transaction, DailySummary
+from . import analytics, cache, importers, exporters
+from .utils import login_required_ajax, encode_cursor, decode_cursor, etag_from_data_version
+from .money import MoneyJSONEncoder
+from .queries import query_budget
+from .serializers import serialize_transactions, transaction_values
+
+logger = logging.getLogger('tracker.api')
+
 
+# The read views answer 304 while the data of the user is unchanged
+# (etag_from_data_version); not the transactions, whose human_time changes
+# with time, nor the avatar status.
 
+
+@ query_budget(8)
 @ login_required_ajax
 def transaction(request):
     if request.method == 'DELETE':
         data = json.loads(request.body)
         transaction = Transaction.objects.get(pk=data['transaction_id'])
-        if transaction.user == request.user:
+        if transaction.user_id == request.user.id:
             transaction.delete()
             return JsonResponse({'message': 'Your transaction is removed.'})
     return JsonResponse({'error': 'You are not authorized.'})
 
 
+@ query_budget(3)
 @ login_required_ajax
+@ etag_from_data_version
 def reports(request):
     if request.method == 'GET':
-        today = timezone.now()
-        days_ago = today - timedelta(days=7)
         params = dict(request.GET)
         source = 'expense'
         if 'source' in params:
             source = params['source'][0]
-        transactions = Transaction.objects.filter(
-            source=source, user=request.user, created__gte=days_ago, created__lte=today).values('created__date').order_by('created__date').annotate(sum_amount=Sum('amount'))
+        granularity = 'day'
+        if 'granularity' in params:
+            granularity = params['granularity'][0]
+        if granularity not in DailySummary.GRANULARITIES:
+            return JsonResponse({'error': 'Invalid granularity.'})
+        try:
+            end = timezone.localdate()
+            if 'to' in params:
+                end = date.fromisoformat(params['to'][0])
+            start = end - timedelta(days=7)
+            if 'from' in params:
+                start = date.fromisoformat(params['from'][0])
+        except ValueError:
+            return JsonResponse({'error': 'Invalid date.'})
+        report = request.user.get_report(source, start, end, granularity)
+        return JsonResponse(report, encoder=MoneyJSONEncoder)
+    return JsonResponse({'error': 'You are not authorized.'})
 
-        result = {'amounts': [], 'time': []}
 
-        if transactions.count() > 0:
-            for t in transactions:
-                result['amounts'].append(t['sum_amount'])
-                result['time'].append(t['created__date'])
-        return JsonResponse(result)
+@ query_budget(4)
+@ login_required_ajax
+@ etag_from_data_version
+def insights(request):
+    MAX_WINDOW = 365
+    if request.method == 'GET':
+        params = dict(request.GET)
+        source = 'expense'
+        if 'source' in params:
+            source = params['source'][0]
+        if source not in (Transaction.INCOME, Transaction.EXPENSE):
+            return JsonResponse({'error': 'Invalid source.'})
+        window = 7
+        if 'window' in params:
+            try:
+                window = int(params['window'][0])
+            except ValueError:
+                return JsonResponse({'error': 'Invalid window.'})
+            if not 1 <= window <= MAX_WINDOW:
+                return JsonResponse({'error': 'Invalid window.'})
+        return JsonResponse(cache.get_or_compute(request.user, 'insights', lambda: analytics.insights(
+            request.user, source, window), source, window))
     return JsonResponse({'error': 'You are not authorized.'})
 
 
+@ query_budget(3)
 @ login_required_ajax
 def transactions(request):
     TRANSACTIONS_PER_PAGE = 5
+    MAX_TRANSACTIONS_PER_PAGE = 100
     if request.method == 'GET':
         params = dict(request.GET)
+        if 'cursor' in params or 'limit' in params:
+            # Keyset pagination on (created, id), the cost does not depend on
+            # how deep the page is
+            try:
+                limit = min(int(params.get('limit', [TRANSACTIONS_PER_PAGE])[0]),
+                            MAX_TRANSACTIONS_PER_PAGE)
+                if limit < 1:
+                    raise ValueError
+            except ValueError:
+                return JsonResponse({'error': 'Invalid limit.'})
+            cursor = None
+            if 'cursor' in params:
+                try:
+                    cursor = decode_cursor(params['cursor'][0])
+                except ValueError as e:
+                    return JsonResponse({'error': str(e)})
+            transactions, next_cursor = transactions_after(request.user, cursor, limit)
+            return JsonResponse({'transactions': transactions, 'next_cursor': next_cursor})
+
+        # Legacy OFFSET pagination
         page = 1
         if 'page' in params:
             page = int(params['page'][0])
-        transactions = request.user.transactions.all()[
-            (page*TRANSACTIONS_PER_PAGE-TRANSACTIONS_PER_PAGE):((page+1)*TRANSACTIONS_PER_PAGE-TRANSACTIONS_PER_PAGE)]
-        if transactions.count() > 0:
-            result = []
-            for t in transactions:
-                # NOTE: need to figure out why cant delete _state attribute by using del t._state
-                temp = {**t.__dict__}
-                temp.pop('_state', None)
-                category_title = None
-                if t.category:
-                    category_title = t.category.title
-                result.append(
-                    {**temp, 'category_title': category_title, 'human_time': naturaltime(t.created)})
-            return JsonResponse(result, safe=False)
+        transactions = serialize_transactions(transaction_values(request.user.transactions.all())[
+            (page*TRANSACTIONS_PER_PAGE-TRANSACTIONS_PER_PAGE):((page+1)*TRANSACTIONS_PER_PAGE-TRANSACTIONS_PER_PAGE)])
+        if transactions:
+            return JsonResponse(transactions, safe=False)
         else:
             return JsonResponse({'error': 'End of transactions.'})
     return JsonResponse({'error': 'You are not authorized.'})
 
 
+def transactions_after(user, cursor, limit):
+    '''Serialized page of the transactions after the (created, id) cursor
+    and the cursor of the next page (None on the last page)'''
+    transactions = user.transactions.order_by('-created', '-id')
+    if cursor is not None:
+        created, pk = cursor
+        transactions = transactions.filter(
+            Q(created__lt=created) | Q(created=created, id__lt=pk))
+    # Fetch one more row to know if there is a next page
+    rows = list(transaction_values(transactions, named=True)[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1])
+    return serialize_transactions(rows), next_cursor
+
+
+# Per chunk of importers.CHUNK_SIZE rows: the INSERTs of the transactions
+# and of their new daily summaries (166 rows each on SQLite), the balance
+# and the stats of both sources
+@ query_budget(5, per_chunk=17)
+@ login_required_ajax
+def import_transactions(request):
+    if request.method == 'POST' and 'file' in request.FILES:
+        file = request.FILES['file']
+        format = request.POST.get('format') or importers.detect_format(file.name)
+        try:
+            rows = importers.parse(importers.text_stream(file), format)
+            imported = importers.import_transactions(request.user, rows)
+        except ValidationError as e:
+            return JsonResponse({'error': e.message})
+        except UnicodeDecodeError:
+            return JsonResponse({'error': 'The file should be UTF-8 encoded.'})
+        return JsonResponse({'message': f'{imported} transactions are imported.'})
+    return JsonResponse({'error': 'You are not authorized.'})
+
+
+@ query_budget(3)
+@ login_required_ajax
+def export_transactions(request):
+    if request.method == 'GET':
+        format = request.GET.get('format', 'csv')
+        if format not in exporters.FORMATS:
+            return JsonResponse({'error': 'Unsupported format.'})
+        # The whole history is never held in memory, except under ASGI:
+        # Django iterates the streaming content on the event loop, where the
+        # ORM can not run, so the rows are fetched here in the view thread,
+        # up to exporters.ASGI_MAX_ROWS
+        transactions = request.user.transactions.all()
+        content = exporters.export(transactions, format)
+        if isinstance(request, ASGIRequest):
+            if transactions.count() > exporters.ASGI_MAX_ROWS:
+                return JsonResponse({'error': 'Too many transactions to export, please contact the support.'})
+            content = list(content)
+        response = StreamingHttpResponse(content, content_type=exporters.FORMATS[format])
+        response['Content-Disposition'] = f'attachment; filename="transactions.{format}"'
+        return response
+    return JsonResponse({'error': 'You are not authorized.'})
+
+
+@ query_budget(10)
 @ login_required_ajax
+@ etag_from_data_version
 def category(request):
     if request.method == 'DELETE':
         data = json.loads(request.body)
         category = Category.objects.get(pk=data['category_id'])
-        if category.user == request.user:
+        if category.user_id == request.user.id:
             category.delete()
             return JsonResponse({'message': 'Your category is removed.'})
 
@@ -84,12 +203,111 @@ def category(request):
         source = 'expense'
         if 'source' in params:
             source = params['source'][0]
-        return JsonResponse(request.user.get_report_amount_from_category(source))
+        return JsonResponse(request.user.get_report_amount_from_category(source), encoder=MoneyJSONEncoder)
 
     return JsonResponse({'error': 'You are not authorized.'})
 
 
+@ query_budget(3)
 @ login_required_ajax
+def avatar(request):
+    if request.method == 'GET':
+        # Status of the last uploaded avatar, polled by the account page
+        job = request.user.avatar_jobs.first()
+        return JsonResponse({'status': job.status if job else AvatarJob.DONE,
+                             'error': job.error if job else '',
+                             'avatar': request.user.avatar.url})
+    return JsonResponse({'error': 'You are not authorized.'})
+
+
+@ query_budget(3)
+@ login_required_ajax
+@ etag_from_data_version
 def balance(request):
     if request.method == 'GET':
-        return JsonResponse({'balance': request.user.get_balance()})
+        return JsonResponse({'balance': request.user.get_balance()}, encoder=MoneyJSONEncoder)
+    return JsonResponse({'error': 'You are not authorized.'})
+
+
+@ query_budget(3)
+@ login_required_ajax
+@ etag_from_data_version
+def dashboard(request):
+    MAX_DAYS = 31
+    if request.method == 'GET':
+        days = 7
+        if 'days' in request.GET:
+            try:
+                days = int(request.GET['days'])
+            except ValueError:
+                return JsonResponse({'error': 'Invalid days.'})
+            if not 1 <= days <= MAX_DAYS:
+                return JsonResponse({'error': 'Invalid days.'})
+        return JsonResponse(request.user.get_dashboard(days), encoder=MoneyJSONEncoder)
+    return JsonResponse({'error': 'You are not authorized.'})
+
+
+MAX_BATCH_SIZE = 20
+
+
+# Each sub-request runs at most 2 queries besides the session and the user,
+# the same view may be run once per sub-request
+@ query_budget(2 + 2 * MAX_BATCH_SIZE, repeats=MAX_BATCH_SIZE)
+@ login_required_ajax
+def batch(request):
+    if request.method == 'POST':
+        return run_batch(request.user, request)
+    return JsonResponse({'error': 'You are not authorized.'})
+
+
+def run_batch(user, request):
+    '''Run the GET sub-requests of a batch ({"requests": [url, ...]}) with
+    the session and user of the batch request. A URL repeated in the batch
+    is only run once.'''
+    try:
+        urls = json.loads(request.body)['requests']
+        if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+            raise ValueError
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Invalid batch.'})
+    if len(urls) > MAX_BATCH_SIZE:
+        return JsonResponse({'error': f'At most {MAX_BATCH_SIZE} requests can be batched.'})
+    contents = {}
+    for url in urls:
+        if url not in contents:
+            try:
+                contents[url] = run_subrequest(user, request, url).content
+            except Exception:
+                # A failing part is an error entry, not a failed batch
+                logger.exception('Batched request failed: %s', url)
+                contents[url] = b'{"error": "The request failed."}'
+    # The responses are already JSON encoded
+    return HttpResponse(b'{"responses": [' + b', '.join(contents[url] for url in urls) + b']}',
+                        content_type='application/json')
+
+
+def run_subrequest(user, request, url):
+    url = urlsplit(url)
+    try:
+        match = resolve(url.path)
+    except Resolver404:
+        match = None
+    if match is None or match.func not in BATCH_VIEWS:
+        return JsonResponse({'error': 'Invalid request.'})
+    subrequest = HttpRequest()
+    subrequest.method = 'GET'
+    subrequest.path = subrequest.path_info = url.path
+    subrequest.META = {**request.META,
+                       'REQUEST_METHOD': 'GET', 'QUERY_STRING': url.query}
+    # The parts are always answered in full, a 304 has no content to batch
+    subrequest.META.pop('HTTP_IF_NONE_MATCH', None)
+    subrequest.GET = QueryDict(url.query)
+    subrequest.COOKIES = request.COOKIES
+    subrequest.session = request.session
+    subrequest.user = user
+    return match.func(subrequest, *match.args, **match.kwargs)
+
+
+# Read-only views which can be part of a batch
+BATCH_VIEWS = (reports, insights, transactions, category, avatar, balance,
+               dashboard)
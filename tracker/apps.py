@@ -1,5 +1,11 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class TrackerConfig(AppConfig):
     name = 'tracker'
+
+    def ready(self):
+        from . import queries, slow_queries
+        connection_created.connect(queries.install)
+        connection_created.connect(slow_queries.install)
@@ -0,0 +1,14 @@
+from django.contrib.auth import backends
+from .models import User
+
+
+class ModelBackend(backends.ModelBackend):
+    '''The model backend, the user of the session is loaded together with
+    its stats, whose data version is the ETag of the read APIs'''
+
+    def get_user(self, user_id):
+        try:
+            user = User._default_manager.select_related('stats').get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,83 @@
+import time
+from django.core.cache import cache
+from django.db import transaction
+
+PREFIX = 'tracker'
+# The entries of an old version are never read again, they only need to
+# live long enough to be useful
+TIMEOUT = 60 * 60
+MISSING = object()
+# Kinds of cached values, the hit/miss counters are per kind
+NAMES = ('balance', 'stats', 'report', 'categories', 'insights', 'dashboard')
+
+
+def version_key(user_id):
+    return f'{PREFIX}:user:{user_id}:version'
+
+
+def get_version(user_id):
+    version = cache.get(version_key(user_id))
+    if version is None:
+        # Never go back to a version which may still have entries, e.g. if
+        # the version was evicted
+        cache.add(version_key(user_id), time.time_ns(), None)
+        version = cache.get(version_key(user_id))
+    return version
+
+
+def bump(user_id):
+    try:
+        cache.incr(version_key(user_id))
+    except ValueError:
+        cache.add(version_key(user_id), time.time_ns(), None)
+
+
+def invalidate(user_id):
+    '''Make the cached values of the user stale. The version is bumped now,
+    for the reads in the same transaction, and again once committed, as
+    another request may have cached the previous values in between.'''
+    bump(user_id)
+    transaction.on_commit(lambda: bump(user_id))
+
+
+def count(name, outcome):
+    key = f'{PREFIX}:stats:{name}:{outcome}'
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def get_or_compute(user, name, compute, *params):
+    '''Return the cached value of compute() for the user, name and params,
+    computing and caching it on a miss. The key has the data version of the
+    stats of the user, bumped in the database by every write, so that a
+    process does not serve the values cached before the write of another
+    process (the local memory cache is not shared), and the version of the
+    cache, bumped by the writes made since the user was loaded.'''
+    key = ':'.join(map(str, (PREFIX, 'user', user.id, user.stats.data_version,
+                   get_version(user.id), name, *params)))
+    value = cache.get(key, MISSING)
+    if value is MISSING:
+        count(name, 'misses')
+        value = compute()
+        cache.set(key, value, TIMEOUT)
+    else:
+        count(name, 'hits')
+    return value
+
+
+def stats(names=NAMES):
+    '''{name: {'hits': ..., 'misses': ...}} of the counters, they are shared
+    by the processes using the same cache backend (but not with locmem).'''
+    keys = [f'{PREFIX}:stats:{name}:{outcome}' for name in names
+            for outcome in ('hits', 'misses')]
+    values = cache.get_many(keys)
+    return {name: {outcome: values.get(f'{PREFIX}:stats:{name}:{outcome}', 0)
+                   for outcome in ('hits', 'misses')} for name in names}
+
+
+def reset_stats(names=NAMES):
+    cache.delete_many([f'{PREFIX}:stats:{name}:{outcome}' for name in names
+                       for outcome in ('hits', 'misses')])
@@ -0,0 +1,50 @@
+import csv
+import json
+from .money import MoneyJSONEncoder
+
+FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+FIELDS = ('date', 'text', 'amount', 'category', 'source')
+CHUNK_SIZE = 2000
+# The rows an export holds in memory under ASGI, see api.export_transactions
+ASGI_MAX_ROWS = 20000
+
+
+class Echo:
+    '''File-like object returning what is written, for csv.writer'''
+
+    def write(self, value):
+        return value
+
+
+def rows(transactions):
+    '''Iterate the transactions server side, CHUNK_SIZE rows at a time'''
+    for t in transactions.select_related('category').iterator(chunk_size=CHUNK_SIZE):
+        yield {
+            'date': t.created.isoformat(),
+            'text': t.text,
+            'amount': t.amount,
+            'category': t.category.title if t.category else '',
+            'source': t.source,
+        }
+
+
+def export_csv(transactions):
+    # The columns can be imported back with tracker.importers
+    writer = csv.writer(Echo())
+    yield writer.writerow(FIELDS)
+    for row in rows(transactions):
+        yield writer.writerow([row[f] for f in FIELDS])
+
+
+def export_jsonl(transactions):
+    for row in rows(transactions):
+        yield json.dumps(row, cls=MoneyJSONEncoder) + '\n'
+
+
+def export(transactions, format):
+    if format == 'csv':
+        return export_csv(transactions)
+    return export_jsonl(transactions)
@@ -18,7 +18,7 @@ class NewTransactionForm(ModelForm):
 
     text = forms.CharField(label='Description', widget=forms.TextInput(
         attrs={'class': 'form-control'}), required=True, max_length=255)
-    amount = forms.FloatField(widget=forms.TextInput(
+    amount = forms.DecimalField(decimal_places=2, widget=forms.TextInput(
         attrs={'class': 'form-control'}), required=True)
 
 
@@ -49,7 +49,9 @@ class UserForm(ModelForm):
         attrs={'class': 'form-control mb-2'}))
     email = forms.EmailField(widget=forms.EmailInput(
         attrs={'class': 'form-control mb-2'}), disabled=True)
-    avatar = forms.ImageField(widget=CustomFileInput(), required=False)
+    # Not an ImageField, which would read the whole image to verify it,
+    # validate_image_size only reads the header
+    avatar = forms.FileField(widget=CustomFileInput(), required=False)
 
     # def clean_avatar(self):
     #     print(self.cleaned_data['avatar'])
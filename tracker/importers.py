@@ -0,0 +1,186 @@
+import csv
+import io
+import re
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import timezone
+from .models import Balance, Category, DailySummary, Transaction, UserStats
+from .money import to_decimal
+from .queries import count_chunk
+from . import cache
+
+FORMATS = ('csv', 'ofx')
+CHUNK_SIZE = 1000
+
+
+def parse_date(value):
+    '''Parse an ISO date/datetime into an aware datetime'''
+    parsed = datetime.fromisoformat(value)
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def parse_csv(stream):
+    '''Yield the rows of a CSV file with text (or description), amount and
+    optional category, source (of the category) and date columns.'''
+    for line, row in enumerate(csv.DictReader(stream), start=2):
+        try:
+            parsed = {
+                'text': row.get('text') or row.get('description') or '',
+                'amount': to_decimal(row['amount']),
+                'category': row.get('category') or None,
+                'source': row.get('source') or None,
+                'created': parse_date(row['date']) if row.get('date') else None,
+            }
+            if parsed['source'] not in (None, Transaction.INCOME, Transaction.EXPENSE):
+                raise ValueError
+        except (KeyError, TypeError, ValueError, InvalidOperation):
+            raise ValidationError(f'Invalid transaction on line {line}.')
+        if not parsed['amount']:
+            raise ValidationError(f'The amount on line {line} should be at least a cent.')
+        yield parsed
+
+
+OFX_TRANSACTION = re.compile(r'<STMTTRN>(.*?)</STMTTRN>', re.S | re.I)
+OFX_FIELD = re.compile(r'<(\w+)>([^<\r\n]*)')
+
+
+def parse_ofx_date(value):
+    # YYYYMMDD[HHMMSS[.XXX]][[gmt offset:tz name]]
+    value = value.split('[')[0].split('.')[0]
+    parsed = datetime.strptime(value, '%Y%m%d%H%M%S' if len(
+        value) > 8 else '%Y%m%d')
+    return timezone.make_aware(parsed, timezone.utc)
+
+
+def parse_ofx(stream, block_size=64 * 1024):
+    '''Yield the STMTTRN records of an OFX (SGML or XML) statement, reading
+    the file block by block.'''
+    buffer = ''
+    number = 0
+    while True:
+        block = stream.read(block_size)
+        buffer += block
+        end = 0
+        for match in OFX_TRANSACTION.finditer(buffer):
+            number += 1
+            fields = {name.upper(): value.strip()
+                      for name, value in OFX_FIELD.findall(match.group(1))}
+            try:
+                parsed = {
+                    'text': fields.get('NAME') or fields.get('MEMO') or '',
+                    'amount': to_decimal(fields['TRNAMT']),
+                    'category': None,
+                    'source': None,
+                    'created': parse_ofx_date(fields['DTPOSTED']) if fields.get('DTPOSTED') else None,
+                }
+            except (KeyError, ValueError, InvalidOperation):
+                raise ValidationError(f'Invalid transaction #{number}.')
+            if not parsed['amount']:
+                raise ValidationError(f'The amount of transaction #{number} should be at least a cent.')
+            yield parsed
+            end = match.end()
+        buffer = buffer[end:]
+        if not block:
+            return
+
+
+def parse(stream, format):
+    if format == 'csv':
+        return parse_csv(stream)
+    if format == 'ofx':
+        return parse_ofx(stream)
+    raise ValidationError(f'Unsupported format: {format}.')
+
+
+def detect_format(filename):
+    extension = filename.rsplit('.', 1)[-1].lower()
+    return extension if extension in FORMATS else None
+
+
+def text_stream(file):
+    '''Decode a binary file (e.g. an UploadedFile) without reading it at once'''
+    if isinstance(file, io.TextIOBase):
+        return file
+    return io.TextIOWrapper(getattr(file, 'file', file), encoding='utf-8-sig', newline='')
+
+
+def import_transactions(user, rows, chunk_size=CHUNK_SIZE):
+    '''Insert the parsed rows for the user in chunks with bulk_create. The
+    balance and stats are adjusted once per chunk, the daily summaries once
+    at the end, and the whole import is rolled back if the balance would
+    become negative. Return the number of imported transactions.'''
+    categories = {(c.title, c.source): c for c in Category.objects.filter(user=user)}
+    now = timezone.now()
+    rows = iter(rows)
+    imported = 0
+    daily = defaultdict(lambda: [Decimal(0), 0])
+    with transaction.atomic():
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            count_chunk()
+            transactions = []
+            for row in chunk:
+                category = None
+                if row['category']:
+                    category = find_category(categories, row)
+                    if category is None:
+                        raise ValidationError(
+                            f'Unknown category: {row["category"]}.')
+                # Rounded like the stored amount, the balance and the stats
+                # are adjusted by the sum of what is stored
+                t = Transaction(text=row['text'][:255], amount=to_decimal(row['amount']), category=category,
+                                user_id=user.id, created=row['created'] or now)
+                t.normalize()
+                if t.amount == 0:
+                    raise ValidationError(
+                        'The ammount should be different from 0.')
+                transactions.append(t)
+            Transaction.objects.bulk_create(transactions)
+            apply_chunk(user, transactions, daily)
+            imported += len(transactions)
+        if daily:
+            DailySummary.record_many(user.id, daily)
+        # bulk_create does not send the post_save signals
+        cache.invalidate(user.id)
+    return imported
+
+
+def find_category(categories, row):
+    '''The category of the row among the {(title, source): category} of the
+    user. Without a source column, the title is enough unless both an
+    income and an expense category have it, then the sign of the amount
+    decides.'''
+    title, source = row['category'], row.get('source')
+    if source is None:
+        matches = [categories[key] for key in ((title, Transaction.INCOME), (title, Transaction.EXPENSE))
+                   if key in categories]
+        if len(matches) < 2:
+            return matches[0] if matches else None
+        source = Transaction.INCOME if row['amount'] > 0 else Transaction.EXPENSE
+    return categories.get((title, source))
+
+
+def apply_chunk(user, transactions, daily):
+    totals = {Transaction.INCOME: [Decimal(0), 0],
+              Transaction.EXPENSE: [Decimal(0), 0]}
+    tz = timezone.get_current_timezone()
+    for t in transactions:
+        totals[t.source][0] += t.amount
+        totals[t.source][1] += 1
+        key = (t.created.astimezone(tz).date(), t.source, t.category_id)
+        daily[key][0] += t.amount
+        daily[key][1] += 1
+    delta = totals[Transaction.INCOME][0] + totals[Transaction.EXPENSE][0]
+    if not Balance.adjust(user.id, delta):
+        raise ValidationError('Your balance is insufficient.')
+    for source, (amount, count) in totals.items():
+        if count:
+            UserStats.record(user.id, source, amount, count=count)
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from tracker.money import backfill_cents
+
+
+class Command(BaseCommand):
+    help = ('Convert the transaction amounts to integer cents in small batches, between '
+            'the migrations 0010_money_cents and 0011_money_swap, while the application '
+            'is running. Can be run again, only the missing rows are converted.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Number of rows updated per statement.')
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            columns = [column.name for column in connection.introspection.get_table_description(
+                cursor, 'tracker_transaction')]
+        if 'amount_cents' not in columns:
+            self.stdout.write(
+                'Nothing to backfill, the amounts are already stored in cents.')
+            return
+        updated = backfill_cents(connection, 'tracker_transaction', 'amount',
+                                 'amount_cents', batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Backfilled {updated} transaction(s).'))
@@ -0,0 +1,128 @@
+import json
+import statistics
+import subprocess
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from tracker import cache
+from tracker.models import Transaction
+from tracker.queries import capture_queries
+from .loadtest import percentile
+from .seed_bench import PREFIX, seeded_users
+
+
+def write_transaction(user):
+    # The update_balance write path: balance, stats and daily summary
+    Transaction(text='bench', amount=-1, user=user).save()
+
+
+def delete_transaction(user):
+    # The latest transaction is fetched, then deleted
+    Transaction.objects.filter(user=user).first().delete()
+
+
+def report(user):
+    today = timezone.localdate()
+    return user.get_report(Transaction.EXPENSE, today - timedelta(days=365), today, 'month')
+
+
+# The hot model methods, called with a seeded user. The reads go to the
+# database as the cache of the user is made stale before each call
+BENCHMARKS = {
+    'get_balance': lambda user: user.get_balance(),
+    'get_total_income': lambda user: user.get_total_income(),
+    'get_report_amount_from_category': lambda user: user.get_report_amount_from_category(Transaction.EXPENSE),
+    'get_categories_with_balance': lambda user: list(user.get_categories_with_balance()),
+    'get_report': report,
+    'get_dashboard': lambda user: user.get_dashboard(),
+    'update_balance': write_transaction,
+    'delete_transaction': delete_transaction,
+}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Time the hot model methods against the users seeded by manage.py seed_bench '
+            'and print the p50/p95 latencies and the queries per call as JSON. The writes '
+            'are rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=100,
+                            help='Number of calls per benchmark, spread over the users.')
+        parser.add_argument('--prefix', default=PREFIX,
+                            help='Prefix of the seeded usernames.')
+        parser.add_argument('--only', action='append', choices=sorted(BENCHMARKS),
+                            help='Only run this benchmark, may be repeated.')
+        parser.add_argument('--output', help='Also write the JSON results to this file.')
+        parser.add_argument('--compare', help='JSON results of a previous run to compare the p50 with.')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('The number of calls should be positive.')
+        # Loaded with their stats, like the user of a request
+        users = list(seeded_users(options['prefix']).select_related('stats'))
+        if not users:
+            raise CommandError('There is no seeded user, run manage.py seed_bench first.')
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)['benchmarks']
+            except (OSError, ValueError, KeyError):
+                raise CommandError(f'Invalid results file: {options["compare"]}.')
+
+        results = {
+            'revision': git_revision(),
+            'database': connection.vendor,
+            'users': len(users),
+            'repeat': options['repeat'],
+            'benchmarks': {name: self.measure(BENCHMARKS[name], users, options['repeat'])
+                           for name in options['only'] or BENCHMARKS},
+        }
+        output = json.dumps(results, indent=2)
+        self.stdout.write(output)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        if baseline is not None:
+            self.compare(baseline, results['benchmarks'])
+
+    def measure(self, benchmark, users, repeat):
+        timings, queries = [], []
+        for i in range(repeat):
+            user = users[i % len(users)]
+            cache.bump(user.id)
+            with transaction.atomic():
+                with capture_queries() as log:
+                    begin = time.perf_counter()
+                    benchmark(user)
+                    timings.append((time.perf_counter() - begin) * 1000)
+                transaction.set_rollback(True)
+            queries.append(len(log))
+        timings.sort()
+        return {
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'mean_ms': round(statistics.mean(timings), 3),
+            'queries': max(queries),
+        }
+
+    def compare(self, baseline, benchmarks):
+        # On stderr, the JSON on stdout stays parsable
+        for name, result in benchmarks.items():
+            if name not in baseline:
+                continue
+            before, after = baseline[name]['p50_ms'], result['p50_ms']
+            change = f'{(after - before) / before:+.0%}' if before else '-'
+            self.stderr.write(f'{name}: p50 {before:.3f} ms -> {after:.3f} ms ({change}), '
+                              f'queries {baseline[name]["queries"]} -> {result["queries"]}')
@@ -0,0 +1,65 @@
+import statistics
+import time
+from django.db import models
+from django.db.models.functions import TruncDate, TruncMonth
+from tracker import analytics
+from tracker.models import User, Category, Transaction
+from . import bench_indexes
+
+
+class Command(bench_indexes.Command):
+    help = ('Build a throw-away SQLite database with many transactions and compare '
+            'the NumPy insights (one load of the ledger) with the same figures '
+            'computed by ORM aggregates (one query per category).')
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        # All the transactions belong to one user by default
+        parser.set_defaults(users=1, repeat=5)
+
+    def run(self, bench, options):
+        db = bench.connection
+        tables, indexes = self.schema(bench)
+        for sql in tables + indexes:
+            db.execute(sql)
+        self.populate(db, options['rows'], options['users'])
+        db.execute('ANALYZE')
+
+        user = User(id=1)
+        timings = {}
+        for name, compute in (('numpy', self.numpy), ('orm', self.orm)):
+            runs = []
+            for _ in range(options['repeat']):
+                begin = time.perf_counter()
+                compute(user, 'bench')
+                runs.append((time.perf_counter() - begin) * 1000)
+            timings[name] = statistics.median(runs)
+            self.stdout.write(f'{name}: {timings[name]:.1f} ms')
+        self.stdout.write(self.style.SUCCESS(
+            f'NumPy is {timings["orm"] / timings["numpy"]:.1f}x faster than the ORM aggregates.'))
+
+    @staticmethod
+    def numpy(user, using):
+        return analytics.insights(user, Transaction.EXPENSE, using=using)
+
+    @staticmethod
+    def orm(user, using, window=7):
+        '''The insights of analytics.insights with an aggregate per figure,
+        the percentiles are read with one OFFSET query each.'''
+        transactions = Transaction.objects.using(using).filter(
+            user=user, source=Transaction.EXPENSE).order_by()
+        daily = list(transactions.annotate(day=TruncDate('created')).values(
+            'day').order_by('day').annotate(amount=models.Sum('amount')))
+        amounts = [d['amount'] for d in daily]
+        averages = [sum(amounts[max(0, i - window + 1):i + 1]) / min(i + 1, window)
+                    for i in range(len(amounts))]
+        monthly = list(transactions.annotate(month=TruncMonth('created')).values(
+            'month').order_by('month').annotate(amount=models.Sum('amount')))
+        deltas = [b['amount'] - a['amount']
+                  for a, b in zip(monthly, monthly[1:])]
+        categories = {c.title: transactions.filter(category=c).aggregate(models.Sum('amount'))['amount__sum']
+                      for c in Category.objects.using(using).filter(user=user)}
+        count = transactions.count()
+        percentiles = [transactions.order_by('-amount').values_list('amount', flat=True)[
+            min(count - 1, count * q // 100)] for q in analytics.PERCENTILES] if count else []
+        return averages, deltas, categories, percentiles
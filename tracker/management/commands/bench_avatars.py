@@ -0,0 +1,79 @@
+import glob
+import multiprocessing
+import os
+import resource
+import statistics
+import tempfile
+import time
+from PIL import Image
+from django.core.management.base import BaseCommand
+from smartcrop import SmartCrop
+from tracker.models import AvatarJob
+from tracker.utils import render_avatar
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))), 'tests', 'fixtures', 'media', 'test')
+
+
+def legacy(path, directory):
+    '''The former pipeline: SmartCrop on the full resolution image and one
+    128x128 avatar at quality 100'''
+    image = Image.open(path)
+    crop = SmartCrop().crop(image, width=100, height=100)['top_crop']
+    cropped = image.crop((crop['x'], crop['y'], crop['x'] +
+                          crop['width'], crop['y'] + crop['height']))
+    cropped.thumbnail((128, 128), Image.ANTIALIAS)
+    cropped.save(f'{directory}/md.jpg', quality=100)
+
+
+def pipeline(path, directory):
+    render_avatar(path, {f'{directory}/{name}.jpg': size for name,
+                  size in AvatarJob.RENDITIONS.items()}, webp=AvatarJob.WEBP)
+
+
+PIPELINES = {'legacy': legacy, 'pipeline': pipeline}
+
+
+def measure(name, path):
+    '''Run in a fresh process: return the time (ms) and the peak memory
+    growth (MB) of one run'''
+    with tempfile.TemporaryDirectory() as directory:
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        begin = time.perf_counter()
+        PIPELINES[name](path, directory)
+        elapsed = (time.perf_counter() - begin) * 1000
+        # Kilobytes on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    return elapsed, peak / 1024
+
+
+class Command(BaseCommand):
+    help = ('Compare the time and peak memory of the former avatar crop with the '
+            'current pipeline (reduced decode, sm/md/lg renditions) on the test images.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*',
+                            help='Images to process (default: the test fixtures).')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Number of runs per image, the median time is shown.')
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or sorted(glob.glob(f'{FIXTURES}/*'))
+        context = multiprocessing.get_context('fork')
+        for path in paths:
+            try:
+                with Image.open(path) as image:
+                    size = f'{image.width}x{image.height}'
+            except OSError:
+                continue
+            results = []
+            for name in PIPELINES:
+                runs = []
+                for _ in range(options['repeat']):
+                    # A new process per run, the peak memory is per process
+                    with context.Pool(1) as pool:
+                        runs.append(pool.apply(measure, (name, path)))
+                results.append(
+                    f'{name} {statistics.median(r[0] for r in runs):.1f} ms / {max(r[1] for r in runs):.1f} MB')
+            self.stdout.write(
+                f'{os.path.basename(path)} ({size}): {", ".join(results)}')
@@ -0,0 +1,174 @@
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.db.models import Sum
+from tracker.models import User, Category, Transaction
+
+
+class Command(BaseCommand):
+    help = ('Build a throw-away SQLite database with many transactions and compare '
+            'the query plans and latencies of the hot queries with the former single '
+            'column foreign key indexes and with the composite indexes.')
+
+    CATEGORIES_PER_USER = 20
+    # Indexes created by the ForeignKey fields before the composite indexes
+    FOREIGN_KEY_INDEXES = {
+        'bench_transaction_user_idx': ('tracker_transaction', 'user_id'),
+        'bench_transaction_category_idx': ('tracker_transaction', 'category_id'),
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000,
+                            help='Number of transactions to generate.')
+        parser.add_argument('--users', type=int, default=1000,
+                            help='Number of users owning the transactions.')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Number of runs per query.')
+        parser.add_argument('--db', help='Path of the benchmark database '
+                            '(default: a temporary file removed afterwards).')
+
+    def handle(self, *args, **options):
+        path = options['db']
+        if path is None:
+            fd, path = tempfile.mkstemp(suffix='.sqlite3')
+            os.close(fd)
+        # Go through Django's SQLite backend so that its SQL functions
+        # (e.g. django_datetime_cast_date) are registered on the connection
+        bench = DatabaseWrapper(
+            {**connection.settings_dict, 'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}, alias='bench')
+        connections['bench'] = bench
+        bench.ensure_connection()
+        try:
+            self.run(bench, options)
+        finally:
+            bench.close()
+            del connections['bench']
+            if options['db'] is None:
+                os.remove(path)
+
+    def run(self, bench, options):
+        db = bench.connection
+        tables, indexes = self.schema(bench)
+        for sql in tables:
+            db.execute(sql)
+        self.populate(db, options['rows'], options['users'])
+        for name, (table, column) in self.FOREIGN_KEY_INDEXES.items():
+            db.execute(f'CREATE INDEX "{name}" ON "{table}" ("{column}")')
+        db.execute('ANALYZE')
+
+        queries = self.queries(bench)
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            'Foreign key indexes'))
+        before = self.measure(bench, queries, options['repeat'], options['users'])
+        for name in self.FOREIGN_KEY_INDEXES:
+            db.execute(f'DROP INDEX "{name}"')
+        for sql in indexes:
+            db.execute(sql)
+        db.execute('ANALYZE')
+        self.stdout.write(self.style.MIGRATE_HEADING('With composite indexes'))
+        after = self.measure(bench, queries, options['repeat'], options['users'])
+
+        self.stdout.write(self.style.MIGRATE_HEADING('Summary (median)'))
+        for name in queries:
+            self.stdout.write(
+                f'{name}: {before[name]:.3f} ms -> {after[name]:.3f} ms')
+
+    @staticmethod
+    def schema(bench):
+        '''Return the CREATE TABLE statements and the composite CREATE INDEX
+        statements of the Category and Transaction models.'''
+        names = [index.name for model in (Category, Transaction)
+                 for index in model._meta.indexes]
+        with bench.schema_editor(collect_sql=True) as editor:
+            editor.create_model(Category)
+            editor.create_model(Transaction)
+        tables, indexes = [], []
+        for sql in editor.collected_sql:
+            sql = sql.rstrip(';')
+            if any(f'"{name}"' in sql for name in names):
+                indexes.append(sql)
+            else:
+                tables.append(sql)
+        return tables, indexes
+
+    def populate(self, db, rows, users):
+        # There is no user table in the benchmark database
+        db.execute('PRAGMA foreign_keys = OFF')
+        # The backend connection is in autocommit mode, insert everything in
+        # one transaction instead of committing each row
+        db.execute('BEGIN')
+        categories = []
+        for user_id in range(1, users + 1):
+            for i in range(self.CATEGORIES_PER_USER):
+                source = Category.INCOME if i % 2 else Category.EXPENSE
+                categories.append((f'category {i}', source, user_id))
+        db.executemany('INSERT INTO tracker_category (title, source, user_id, created) '
+                       'VALUES (?, ?, ?, datetime("now"))', categories)
+
+        start = datetime(2019, 1, 1, tzinfo=timezone.utc)
+        span = int(timedelta(days=3 * 365).total_seconds())
+
+        def generate():
+            for _ in range(rows):
+                user_id = random.randint(1, users)
+                index = random.randrange(self.CATEGORIES_PER_USER)
+                category_id = (user_id - 1) * \
+                    self.CATEGORIES_PER_USER + index + 1
+                source = Category.INCOME if index % 2 else Category.EXPENSE
+                # In cents, as stored by MoneyField
+                amount = random.randint(100, 50000)
+                if source == Category.EXPENSE:
+                    amount = -amount
+                created = start + timedelta(seconds=random.randrange(span))
+                yield ('transaction', source, category_id, amount, user_id,
+                       created.strftime('%Y-%m-%d %H:%M:%S.%f'))
+
+        db.executemany('INSERT INTO tracker_transaction (text, source, category_id, amount, user_id, created) '
+                       'VALUES (?, ?, ?, ?, ?, ?)', generate())
+        db.commit()
+        self.stdout.write(
+            f'Generated {rows} transactions for {users} users.')
+
+    @staticmethod
+    def queries(bench):
+        '''Compile the hot ORM queries to SQL, the user is picked per run.'''
+        def compile(queryset):
+            return queryset.query.get_compiler(connection=bench).as_sql()
+
+        today = datetime(2021, 6, 1, tzinfo=timezone.utc)
+        return {
+            'latest transactions': lambda user: compile(
+                user.transactions.all()[:5]),
+            'transactions per source and period': lambda user: compile(
+                Transaction.objects.filter(user=user, source=Transaction.EXPENSE, created__gte=today - timedelta(days=7),
+                                           created__lte=today).values('created__date').order_by('created__date').annotate(
+                    sum_amount=Sum('amount'))),
+            'category report': lambda user: compile(
+                user.get_categories_with_balance().filter(source=Category.EXPENSE)),
+        }
+
+    def measure(self, bench, queries, repeat, users):
+        medians = {}
+        cursor = bench.cursor()
+        for name, query in queries.items():
+            sql, params = query(User(id=1))
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = cursor.fetchall()
+            self.stdout.write(f'{name}:')
+            for row in plan:
+                self.stdout.write(f'    {row[-1]}')
+            timings = []
+            for i in range(repeat):
+                sql, params = query(User(id=i % users + 1))
+                begin = time.perf_counter()
+                cursor.execute(sql, params)
+                cursor.fetchall()
+                timings.append((time.perf_counter() - begin) * 1000)
+            medians[name] = statistics.median(timings)
+        return medians
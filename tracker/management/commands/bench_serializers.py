@@ -0,0 +1,67 @@
+import json
+import statistics
+import time
+from django.contrib.humanize.templatetags.humanize import naturaltime
+from django.core.management.base import CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from tracker.models import User, Transaction
+from tracker.money import MoneyJSONEncoder
+from tracker.serializers import serialize_transactions, transaction_values
+from . import bench_indexes
+
+
+class Command(bench_indexes.Command):
+    help = ('Build a throw-away SQLite database with many transactions and compare '
+            'the throughput (rows/s, query and JSON encoding included) of the former '
+            'model instance serializer of /api/transactions and of tracker.serializers '
+            'per page size.')
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--page-sizes', default='5,100,10000',
+                            help='Comma separated page sizes.')
+        # All the transactions belong to one user by default
+        parser.set_defaults(rows=20000, users=1, repeat=5)
+
+    def run(self, bench, options):
+        try:
+            sizes = [int(size) for size in options['page_sizes'].split(',')]
+        except ValueError:
+            raise CommandError('The page sizes should be integers.')
+        db = bench.connection
+        tables, indexes = self.schema(bench)
+        for sql in tables + indexes:
+            db.execute(sql)
+        self.populate(db, options['rows'], options['users'])
+        db.execute('ANALYZE')
+
+        transactions = Transaction.objects.using('bench').filter(
+            user=User(id=1)).order_by('-created', '-id')
+        if json.loads(self.models(transactions[:100])) != json.loads(self.values(transactions[:100])):
+            raise CommandError('The serializers do not give the same output.')
+        for size in sizes:
+            rates = {}
+            for name, serialize in (('models', self.models), ('values', self.values)):
+                runs = []
+                for _ in range(options['repeat']):
+                    begin = time.perf_counter()
+                    serialize(transactions[:size])
+                    runs.append(time.perf_counter() - begin)
+                rates[name] = size / statistics.median(runs)
+            self.stdout.write(f'{size} rows: models {rates["models"]:,.0f} rows/s, values {rates["values"]:,.0f} rows/s '
+                              f'({rates["values"] / rates["models"]:.1f}x)')
+
+    @staticmethod
+    def models(transactions):
+        '''The former serializer, from the __dict__ of the model instances'''
+        def serialize(t):
+            temp = {**t.__dict__}
+            temp.pop('_state', None)
+            category_title = t.category.title if t.category else None
+            return {**temp, 'category_title': category_title, 'human_time': naturaltime(t.created)}
+        return json.dumps([serialize(t) for t in transactions.select_related('category')], cls=MoneyJSONEncoder)
+
+    @staticmethod
+    def values(transactions):
+        # The encoder of JsonResponse
+        return json.dumps(serialize_transactions(transaction_values(transactions)), cls=DjangoJSONEncoder)
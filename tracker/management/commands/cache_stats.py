@@ -0,0 +1,27 @@
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+from tracker import cache
+
+
+class Command(BaseCommand):
+    help = ('Show the hit/miss counters of the per-user read cache. The counters '
+            'live in the cache backend, with the local memory cache they are only '
+            'visible to the process serving the requests.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='Reset the counters after showing them.')
+
+    def handle(self, *args, **options):
+        if isinstance(caches['default'], LocMemCache):
+            self.stderr.write('The cache is the local memory of each process, these are the counters of this '
+                              'command: see tracker_cache_requests_total at /metrics for the ones of a worker.')
+        for name, counters in cache.stats().items():
+            total = counters['hits'] + counters['misses']
+            ratio = f'{counters["hits"] / total:.0%}' if total else '-'
+            self.stdout.write(
+                f'{name}: {counters["hits"]} hits, {counters["misses"]} misses (hit rate {ratio})')
+        if options['reset']:
+            cache.reset_stats()
+            self.stdout.write(self.style.SUCCESS('The counters are reset.'))
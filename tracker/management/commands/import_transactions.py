@@ -0,0 +1,31 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from tracker import importers
+from tracker.models import User
+
+
+class Command(BaseCommand):
+    help = 'Import the transactions of a CSV or OFX file for a user.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=importers.FORMATS,
+                            help='File format (default: from the file extension).')
+        parser.add_argument('--chunk-size', type=int, default=importers.CHUNK_SIZE,
+                            help='Number of transactions inserted at once.')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'Unknown user: {options["username"]}.')
+        format = options['format'] or importers.detect_format(options['path'])
+        try:
+            with open(options['path'], encoding='utf-8-sig', newline='') as stream:
+                imported = importers.import_transactions(
+                    user, importers.parse(stream, format), options['chunk_size'])
+        except ValidationError as e:
+            raise CommandError(e.message)
+        self.stdout.write(self.style.SUCCESS(
+            f'{imported} transactions are imported.'))
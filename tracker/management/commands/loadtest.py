@@ -0,0 +1,310 @@
+import asyncio
+import importlib.util
+import itertools
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import timedelta
+from functools import lru_cache
+from urllib.parse import quote, urlencode, urlsplit
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.http import HttpRequest
+from django.middleware.csrf import get_token
+from django.test import Client
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+from .seed_bench import PREFIX, seeded_users
+
+# Command lines of the servers, they are optional dependencies
+SERVERS = {
+    'wsgi': ('gunicorn', ['expense.wsgi:application', '--worker-class', 'gthread', '--threads', '{threads}',
+                          '--workers', '{workers}', '--bind', '127.0.0.1:{port}', '--log-level', 'warning']),
+    'asgi': ('uvicorn', ['expense.asgi:application', '--workers', '{workers}', '--host', '127.0.0.1',
+                         '--port', '{port}', '--no-access-log', '--log-level', 'warning']),
+}
+PAGES = 3
+PAGE_SIZE = 20
+
+
+class Done(Exception):
+    '''All the requests of the run are sent'''
+
+
+def percentile(values, q):
+    '''Nearest-rank percentile of sorted values'''
+    return values[max(0, min(len(values) - 1, math.ceil(q / 100 * len(values)) - 1))]
+
+
+@lru_cache(maxsize=None)
+def url_name(path):
+    try:
+        return resolve(urlsplit(path).path).url_name
+    except Resolver404:
+        return path
+
+
+async def fetch(reader, writer, request):
+    '''Send a request on a keep-alive connection, return the status, the
+    body and whether the server keeps the connection open.'''
+    writer.write(request)
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = dict(line.lower().split(': ', 1) for line in lines[1:] if line)
+    keep_alive = headers.get('connection') != 'close'
+    if status in (204, 304) or status < 200:
+        return status, b'', keep_alive
+    if headers.get('transfer-encoding', '').endswith('chunked'):
+        return status, await read_chunked(reader), keep_alive
+    if 'content-length' in headers:
+        return status, await reader.readexactly(int(headers['content-length'])), keep_alive
+    # The body ends with the connection
+    return status, await reader.read(), False
+
+
+async def read_chunked(reader):
+    '''Body of a response with Transfer-Encoding: chunked'''
+    body = b''
+    while True:
+        # The size in hexadecimal, maybe followed by extensions
+        size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+        if not size:
+            break
+        body += (await reader.readexactly(size + 2))[:-2]
+    # Trailers until an empty line
+    while await reader.readuntil(b'\r\n') != b'\r\n':
+        pass
+    return body
+
+
+class Session:
+    '''A logged in user on a keep-alive connection. The latency and the
+    errors are recorded per method and URL name.'''
+
+    def __init__(self, host, port, login, stats, remaining):
+        self.host = host
+        self.port = port
+        self.session_key, self.csrf_token, self.csrf_cookie = login
+        self.stats = stats
+        self.remaining = remaining
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=b'', content_type=None, expect=200):
+        if self.remaining[0] <= 0:
+            raise Done
+        self.remaining[0] -= 1
+        head = (f'{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n'
+                f'Cookie: {settings.SESSION_COOKIE_NAME}={self.session_key}; '
+                f'{settings.CSRF_COOKIE_NAME}={self.csrf_cookie}\r\n')
+        if method not in ('GET', 'HEAD'):
+            head += f'X-CSRFToken: {self.csrf_token}\r\nContent-Length: {len(body)}\r\n'
+            if content_type:
+                head += f'Content-Type: {content_type}\r\n'
+        started = time.perf_counter()
+        try:
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            status, content, keep_alive = await fetch(self.reader, self.writer, (head + '\r\n').encode() + body)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            status, content, keep_alive = None, b'', False
+        stats = self.stats[f'{method} {url_name(path)}']
+        stats['latencies'].append(time.perf_counter() - started)
+        if status != expect:
+            stats['errors'] += 1
+        if not keep_alive:
+            self.close()
+        return status, content
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+async def browse(session, visit):
+    '''A visit of the user: the index page, a few pages of the infinite
+    scroll, the reports, then a transaction is added and deleted.'''
+    await session.request('GET', '/')
+    path = f'/api/transactions?limit={PAGE_SIZE}'
+    for _ in range(PAGES):
+        status, content = await session.request('GET', path)
+        cursor = json.loads(content).get('next_cursor') if status == 200 else None
+        if not cursor:
+            break
+        path = f'/api/transactions?limit={PAGE_SIZE}&cursor={quote(cursor)}'
+    await session.request('GET', '/api/reports')
+    start = timezone.localdate() - timedelta(days=365)
+    await session.request('GET', f'/api/reports?granularity=month&from={start}')
+
+    # The text tells apart the transactions of the sessions of a same user
+    text = f'loadtest {visit}'
+    await session.request('POST', '/', urlencode({'text': text, 'amount': '-0.01', 'category': ''}).encode(),
+                          'application/x-www-form-urlencoded', expect=302)
+    status, content = await session.request('GET', '/api/transactions?limit=5')
+    if status == 200:
+        for transaction in json.loads(content)['transactions']:
+            if transaction['text'] == text:
+                await session.request('DELETE', '/api/transaction',
+                                      json.dumps({'transaction_id': transaction['id']}).encode())
+                break
+
+
+async def client(session, scenario, visits):
+    try:
+        while True:
+            await scenario(session, next(visits))
+    except Done:
+        pass
+    finally:
+        session.close()
+
+
+async def load(host, port, logins, scenario, concurrency, total):
+    '''Run total requests from concurrency sessions, spread over the logged
+    in users. Return the stats per URL name and the elapsed time.'''
+    stats = defaultdict(lambda: {'latencies': [], 'errors': 0})
+    remaining, visits = [total], itertools.count()
+    started = time.perf_counter()
+    await asyncio.gather(*(client(Session(host, port, logins[i % len(logins)], stats, remaining), scenario, visits)
+                           for i in range(concurrency)))
+    return stats, time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = ('Load test the site under WSGI (gunicorn, threaded workers) and ASGI (uvicorn) '
+            'with many concurrent keep-alive clients logged in as the users seeded by '
+            'manage.py seed_bench. Each client browses like a user: index page, scrolling '
+            'of /api/transactions, reports, a transaction added then deleted. The '
+            'requests/s, the errors and the latency percentiles per URL name are reported. '
+            'With --url, an already running server using the same database is load tested '
+            'instead.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--server', choices=('wsgi', 'asgi', 'both'), default='both')
+        parser.add_argument('--url',
+                            help='Load test the server running at this http:// URL instead of starting one.')
+        parser.add_argument('--concurrency', type=int, default=200,
+                            help='Number of concurrent clients.')
+        parser.add_argument('--requests', type=int, default=5000,
+                            help='Number of requests per server.')
+        parser.add_argument('--users', type=int, default=100,
+                            help='Maximum number of seeded users to log in.')
+        parser.add_argument('--prefix', default=PREFIX,
+                            help='Prefix of the seeded usernames.')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Replay GET requests of this path instead of browsing, may be repeated.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of server processes.')
+        parser.add_argument('--threads', type=int, default=32,
+                            help='Number of threads per WSGI worker.')
+        parser.add_argument('--warmup', type=int, default=200,
+                            help='Number of requests sent before the measured ones.')
+        parser.add_argument('--port', type=int, default=8765)
+
+    def handle(self, *args, **options):
+        if min(options['concurrency'], options['requests']) < 1 or options['warmup'] < 0:
+            raise CommandError('The concurrency and the number of requests should be positive.')
+        names = ('wsgi', 'asgi') if options['server'] == 'both' else (
+            options['server'],)
+        url = None
+        if options['url']:
+            url = urlsplit(options['url'])
+            if url.scheme != 'http' or not url.hostname:
+                raise CommandError(f'Invalid URL: {options["url"]}, only http:// URLs are supported.')
+        else:
+            for name in names:
+                module = SERVERS[name][0]
+                if importlib.util.find_spec(module) is None:
+                    raise CommandError(
+                        f'{module} is not installed, it is needed to run the {name.upper()} server.')
+        users = list(seeded_users(options['prefix'])[:options['users']])
+        if not users:
+            raise CommandError('There is no seeded user, run manage.py seed_bench first.')
+
+        scenario = browse
+        if options['paths']:
+            paths = options['paths']
+
+            async def scenario(session, visit):
+                for path in random.sample(paths, len(paths)):
+                    await session.request('GET', path)
+        logins = [self.login(user) for user in users]
+        try:
+            if url is not None:
+                self.report(options['url'], *self.measure(url.hostname, url.port or 80, logins, scenario, options))
+            else:
+                for name in names:
+                    self.run(name, logins, scenario, options)
+        finally:
+            for session_key, _, _ in logins:
+                SessionStore(session_key).delete()
+
+    @staticmethod
+    def login(user):
+        '''Session key and CSRF token (and cookie) of a new session of the
+        user, without going through the password hasher of the login form'''
+        client = Client()
+        client.force_login(user)
+        request = HttpRequest()
+        token = get_token(request)
+        return client.cookies[settings.SESSION_COOKIE_NAME].value, token, request.META['CSRF_COOKIE']
+
+    def run(self, name, logins, scenario, options):
+        module, arguments = SERVERS[name]
+        arguments = [a.format(**options) for a in arguments]
+        server = subprocess.Popen([sys.executable, '-m', module, *arguments],
+                                  cwd=settings.BASE_DIR, env=os.environ.copy())
+        try:
+            self.wait_for(server, options['port'])
+            stats, elapsed = self.measure('127.0.0.1', options['port'], logins, scenario, options)
+        finally:
+            server.terminate()
+            server.wait()
+        self.report(name.upper(), stats, elapsed)
+
+    @staticmethod
+    def measure(host, port, logins, scenario, options):
+        if options['warmup']:
+            # Warm up the workers (imports, caches, connections)
+            asyncio.run(load(host, port, logins, scenario, min(
+                options['concurrency'], 20), options['warmup']))
+        return asyncio.run(load(host, port, logins, scenario, options['concurrency'], options['requests']))
+
+    def report(self, name, stats, elapsed):
+        latencies = sorted(latency for s in stats.values() for latency in s['latencies'])
+        errors = sum(s['errors'] for s in stats.values())
+        if not latencies:
+            self.stdout.write(f'{name}: no request completed in {elapsed:.1f}s.')
+            return
+        self.stdout.write(
+            f'{name}: {len(latencies)} requests in {elapsed:.1f}s, {len(latencies) / elapsed:.0f} requests/s, '
+            f'{errors} errors ({errors / len(latencies):.1%})')
+        for key, s in sorted(stats.items()):
+            self.stdout.write('    ' + self.line(key, sorted(s['latencies']), s['errors'], elapsed))
+        self.stdout.write('    ' + self.line('all', latencies, errors, elapsed))
+
+    @staticmethod
+    def line(key, latencies, errors, elapsed):
+        return (f'{key}: {len(latencies)} requests, {len(latencies) / elapsed:.0f} requests/s, '
+                f'p50 {percentile(latencies, 50) * 1000:.1f} ms, p95 {percentile(latencies, 95) * 1000:.1f} ms, '
+                f'p99 {percentile(latencies, 99) * 1000:.1f} ms, {errors} errors')
+
+    def wait_for(self, server, port, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError('The server exited before accepting connections.')
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f'The server did not accept connections within {timeout}s.')
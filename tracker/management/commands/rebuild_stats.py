@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from tracker.models import User, UserStats, DailySummary
+
+
+class Command(BaseCommand):
+    help = 'Rebuild (or verify) the per-user statistics and daily summaries from the transactions ledger.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*',
+                            help='Only process these users (default: all users).')
+        parser.add_argument('--verify', action='store_true',
+                            help='Compare the stored stats with the ledger without writing.')
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('id')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+
+        mismatches = 0
+        for user in users.iterator():
+            if options['verify']:
+                expected = UserStats.compute(user)
+                stored = UserStats.objects.filter(user=user).values(
+                    *expected.keys()).first()
+                consistent = self.matches(stored, expected)
+                if not consistent:
+                    self.stdout.write(self.style.WARNING(
+                        f'{user.username}: stored {stored}, expected {expected}'))
+                expected = self.summaries(DailySummary.compute(user))
+                stored = self.summaries(DailySummary.objects.filter(user=user).values(
+                    'date', 'source', 'category_id', 'amount', 'count'))
+                if stored != expected:
+                    consistent = False
+                    self.stdout.write(self.style.WARNING(
+                        f'{user.username}: daily summaries differ from the ledger'))
+                mismatches += not consistent
+            else:
+                with transaction.atomic():
+                    # The writes of the user wait on the stats row, so that
+                    # none lands between the read of the ledger and the
+                    # rewrite of the stats and summaries
+                    list(UserStats.objects.select_for_update().filter(user=user))
+                    UserStats.rebuild(user)
+                    DailySummary.rebuild(user)
+
+        if options['verify']:
+            if mismatches:
+                raise CommandError(
+                    f'{mismatches} user(s) with inconsistent stats.')
+            self.stdout.write(self.style.SUCCESS('All stats are consistent.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Rebuilt stats for {users.count()} user(s).'))
+
+    @staticmethod
+    def summaries(rows):
+        return {(r['date'], r['source'], r['category_id']): (r['amount'], r['count']) for r in rows}
+
+    @staticmethod
+    def matches(stored, expected):
+        # last_activity also moves on deletes, so it is not part of the check
+        if stored is None:
+            return False
+        return (stored['count'] == expected['count']
+                and stored['income'] == expected['income']
+                and stored['expense'] == expected['expense'])
@@ -0,0 +1,46 @@
+import multiprocessing
+import time
+from django.core.management.base import BaseCommand
+from django.db import connections
+from tracker.models import AvatarJob
+
+
+def work(once, poll_interval):
+    '''Run the queued jobs one after the other, return the number of jobs
+    run when the queue is empty in once mode.'''
+    processed = 0
+    while True:
+        job = AvatarJob.claim()
+        if job is None:
+            if once:
+                return processed
+            time.sleep(poll_interval)
+            continue
+        job.run()
+        processed += 1
+
+
+class Command(BaseCommand):
+    help = 'Process the queued avatar uploads with a pool of worker processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=multiprocessing.cpu_count(),
+                            help='Number of worker processes (default: the number of CPUs), '
+                            'with 1 the jobs are run by the command itself.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty instead of waiting for new jobs.')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait before looking for new jobs when the queue is empty.')
+
+    def handle(self, *args, **options):
+        arguments = (options['once'], options['poll_interval'])
+        if options['processes'] <= 1:
+            processed = work(*arguments)
+        else:
+            # The forked workers must open their own database connection
+            connections.close_all()
+            with multiprocessing.get_context('fork').Pool(options['processes']) as pool:
+                processed = sum(pool.starmap(
+                    work, [arguments] * options['processes']))
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed} job(s).'))
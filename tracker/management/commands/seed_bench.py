@@ -0,0 +1,101 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from tracker import importers
+from tracker.models import Balance, Category, User, UserStats
+
+PREFIX = 'bench'
+PASSWORD = 'bench'
+OPENING_MARGIN = Decimal(1000)
+
+
+def seeded_users(prefix=PREFIX):
+    '''The seeded users, in the order they were created'''
+    return User.objects.filter(username__startswith=prefix, email__endswith='@bench.invalid').order_by('id')
+
+
+class Command(BaseCommand):
+    help = ('Seed the configured database with users, categories and transactions spread '
+            'over the past years, inserted with bulk_create through the importer (the '
+            'balance, stats and daily summaries are maintained). The users are named '
+            f'{PREFIX}1, {PREFIX}2... with the password "{PASSWORD}".')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100,
+                            help='Number of users to create.')
+        parser.add_argument('--categories', type=int, default=10,
+                            help='Number of categories per user, a quarter of them for income.')
+        parser.add_argument('--transactions', type=int, default=1000,
+                            help='Number of transactions per user.')
+        parser.add_argument('--years', type=int, default=3,
+                            help='The transactions are spread over this many past years.')
+        parser.add_argument('--prefix', default=PREFIX,
+                            help='Prefix of the usernames.')
+        parser.add_argument('--seed', type=int,
+                            help='Seed of the random generator, for reproducible data.')
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['categories'], options['transactions'], options['years']) < 1:
+            raise CommandError('The numbers of users, categories, transactions and years should be positive.')
+        prefix = options['prefix']
+        if seeded_users(prefix).exists():
+            raise CommandError(f'Users named {prefix}* are already seeded.')
+        generator = random.Random(options['seed'])
+        users = self.create_users(prefix, options['users'])
+        titles = self.create_categories(users, options['categories'])
+        now = timezone.now()
+        for user in users:
+            importers.import_transactions(user, self.generate(
+                generator, titles, options['transactions'], now, options['years']))
+        self.stdout.write(
+            f'Seeded {len(users)} users with {options["categories"]} categories and '
+            f'{options["transactions"]} transactions each.')
+
+    @transaction.atomic
+    def create_users(self, prefix, count):
+        # bulk_create does not send the post_save signal which creates the
+        # balance and the stats, and the password is only hashed once
+        password = make_password(PASSWORD)
+        User.objects.bulk_create([User(username=f'{prefix}{i}', email=f'{prefix}{i}@bench.invalid', password=password)
+                                  for i in range(1, count + 1)])
+        users = list(seeded_users(prefix))
+        Balance.objects.bulk_create([Balance(user=user) for user in users])
+        UserStats.objects.bulk_create([UserStats(user=user) for user in users])
+        return users
+
+    @transaction.atomic
+    def create_categories(self, users, count):
+        incomes = max(1, count // 4)
+        titles = {Category.INCOME: [f'Income {i}' for i in range(incomes)],
+                  Category.EXPENSE: [f'Expense {i}' for i in range(count - incomes)]}
+        Category.objects.bulk_create([Category(user=user, title=title, source=source)
+                                      for user in users for source, names in titles.items() for title in names])
+        return titles
+
+    @staticmethod
+    def generate(generator, titles, count, now, years):
+        '''Rows for importers.import_transactions, oldest first: an opening
+        balance, then about one income for five expenses.'''
+        span = int(timedelta(days=365 * years).total_seconds())
+        rows = []
+        for _ in range(count - 1):
+            created = now - timedelta(seconds=generator.randrange(span))
+            if generator.random() < 0.2:
+                amount = Decimal(generator.randint(50000, 500000)) / 100
+                title = generator.choice(titles[Category.INCOME])
+            else:
+                amount = -Decimal(generator.randint(100, 20000)) / 100
+                title = generator.choice(titles[Category.EXPENSE]) if titles[Category.EXPENSE] else None
+            rows.append({'text': title or 'Expense', 'amount': amount,
+                         'category': title, 'created': created})
+        rows.sort(key=lambda row: row['created'])
+        # The balance may not become negative at any chunk of the import,
+        # and ends at least at OPENING_MARGIN for the writes of manage.py bench
+        opening = sum(-row['amount'] for row in rows if row['amount'] < 0) + OPENING_MARGIN
+        rows.insert(0, {'text': 'Opening balance', 'amount': opening, 'category': None,
+                        'created': now - timedelta(seconds=span)})
+        return rows
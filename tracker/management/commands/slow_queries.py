@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from tracker import slow_queries
+
+
+class Command(BaseCommand):
+    help = ('Summarize the query shapes which ran slower than settings.SLOW_QUERY_MS, '
+            'the worst first: how many times, the total, mean and max durations, the '
+            'caller, an example of the SQL and its parameters, and the query plan.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=10,
+                            help='Number of query shapes to report.')
+        parser.add_argument('--order', choices=sorted(slow_queries.ORDERINGS), default='total',
+                            help='Rank the shapes by total, count, mean or max duration.')
+        parser.add_argument('--reset', action='store_true',
+                            help='Forget the slow queries recorded so far.')
+
+    def handle(self, *args, **options):
+        if not settings.METRICS_DB:
+            raise CommandError('The slow queries are recorded in settings.METRICS_DB, which is empty.')
+        if options['reset']:
+            slow_queries.clear()
+            self.stdout.write('The slow queries are reset.')
+            return
+        if options['limit'] < 1:
+            raise CommandError('The limit should be positive.')
+        if settings.SLOW_QUERY_MS is None:
+            self.stderr.write('settings.SLOW_QUERY_MS is not set, the slow queries are not recorded.')
+        worst = slow_queries.worst(options['order'], options['limit'])
+        if not worst:
+            self.stdout.write('There is no slow query.')
+            return
+        for rank, query in enumerate(worst, 1):
+            self.stdout.write(
+                f'{rank}. {query["count"]} times, total {query["total_ms"]:.1f} ms, '
+                f'mean {query["total_ms"] / query["count"]:.1f} ms, max {query["max_ms"]:.1f} ms, '
+                f'from {query["caller"]}')
+            self.stdout.write(f'    {query["sql"]}')
+            self.stdout.write(f'    Parameters: {query["params"]}')
+            for line in (query['plan'] or 'No plan').splitlines():
+                self.stdout.write(f'    | {line}')
@@ -0,0 +1,190 @@
+import math
+import os
+import sqlite3
+import threading
+from django.conf import settings
+from . import cache
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+def format_labels(labels):
+    return ','.join(f'{name}="{escape(value)}"' for name, value in sorted(labels.items()))
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Registry:
+    '''The samples of the metrics, summed in a SQLite file shared by the
+    processes of the server (e.g. pre-forked workers). A sample which can
+    not be written in time is dropped rather than slowing the request.'''
+
+    def __init__(self):
+        self.local = threading.local()
+
+    @property
+    def path(self):
+        return settings.METRICS_DB
+
+    def connection(self):
+        # One connection per thread, and per process after a fork
+        key = (os.getpid(), self.path)
+        if getattr(self.local, 'key', None) != key:
+            connection = sqlite3.connect(self.path, timeout=0.1, isolation_level=None)
+            connection.execute('PRAGMA journal_mode = WAL')
+            # Losing the last samples on a crash is fine
+            connection.execute('PRAGMA synchronous = OFF')
+            connection.execute('CREATE TABLE IF NOT EXISTS samples (name TEXT, labels TEXT, le REAL, value REAL, '
+                               'PRIMARY KEY (name, labels, le))')
+            self.local.key, self.local.connection = key, connection
+        return self.local.connection
+
+    def add(self, samples):
+        '''Add the (name, labels, le, value) samples, le is the bucket of a
+        histogram, 0 otherwise'''
+        if not self.path:
+            return
+        try:
+            connection = self.connection()
+            with connection:
+                connection.executemany('INSERT INTO samples VALUES (?, ?, ?, ?) ON CONFLICT (name, labels, le) '
+                                       'DO UPDATE SET value = value + excluded.value', samples)
+        except sqlite3.Error:
+            pass
+
+    def samples(self):
+        if not self.path:
+            return []
+        return self.connection().execute('SELECT name, labels, le, value FROM samples ORDER BY name, labels, le').fetchall()
+
+    def clear(self):
+        if self.path:
+            self.connection().execute('DELETE FROM samples')
+
+
+REGISTRY = Registry()
+METRICS = []
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        METRICS.append(self)
+
+    def format_labels(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f'{self.name} has the labels {", ".join(self.labels)}.')
+        return format_labels(labels)
+
+    def expose(self, samples):
+        '''Lines of the text exposition format for the samples of the metric'''
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.type}'
+        for name, labels, _, value in samples:
+            yield f'{name}{{{labels}}} {format_value(value)}' if labels else f'{name} {format_value(value)}'
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        REGISTRY.add(self.samples(amount, **labels))
+
+    def samples(self, amount=1, **labels):
+        '''The samples of inc(), to add them together with others'''
+        return [(self.name, self.format_labels(labels), 0, amount)]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = (*buckets, math.inf)
+
+    def observe(self, value, **labels):
+        REGISTRY.add(self.samples(value, **labels))
+
+    def samples(self, value, **labels):
+        '''The samples of observe(), to add them together with others'''
+        labels = self.format_labels(labels)
+        # Only the first bucket of the value is stored, they are cumulated
+        # when exposed
+        le = next(le for le in self.buckets if value <= le)
+        return [(f'{self.name}_bucket', labels, le, 1), (f'{self.name}_sum', labels, 0, value),
+                (f'{self.name}_count', labels, 0, 1)]
+
+    def expose(self, samples):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.type}'
+        buckets, totals = {}, []
+        for name, labels, le, value in samples:
+            if name.endswith('_bucket'):
+                buckets.setdefault(labels, {})[le] = value
+            else:
+                totals.append((name, labels, value))
+        for labels, counts in buckets.items():
+            cumulative = 0
+            for le in self.buckets:
+                cumulative += counts.get(le, 0)
+                bucket_labels = ','.join(filter(None, (labels, f'le="{format_value(le)}"')))
+                yield f'{self.name}_bucket{{{bucket_labels}}} {format_value(cumulative)}'
+        for name, labels, value in totals:
+            yield f'{name}{{{labels}}} {format_value(value)}' if labels else f'{name} {format_value(value)}'
+
+
+REQUEST_DURATION = Histogram('tracker_request_duration_seconds',
+                             'Duration of the requests per method and URL name.', ('method', 'url_name'))
+REQUEST_QUERIES = Counter('tracker_request_queries_total',
+                          'Database queries of the requests per method and URL name.', ('method', 'url_name'))
+BALANCE_REFUSALS = Counter('tracker_balance_refusals_total',
+                           'Balance updates refused as the balance would have become negative, '
+                           'most often insufficient funds.')
+DAILY_SUMMARY_CONFLICTS = Counter('tracker_daily_summary_conflicts_total',
+                                  'Daily summaries inserted concurrently by another request.')
+AVATAR_DURATION = Histogram('tracker_avatar_processing_seconds', 'Duration of the avatar jobs per status.',
+                            ('status',), buckets=(.1, .25, .5, 1, 2.5, 5, 10, 30, 60))
+
+
+def expose_cache():
+    '''The hit/miss counters of tracker.cache, read from the cache backend
+    when scraped'''
+    stats = cache.stats()
+    yield '# HELP tracker_cache_requests_total Reads of the per-user cache per kind and outcome.'
+    yield '# TYPE tracker_cache_requests_total counter'
+    for name, counters in stats.items():
+        for outcome, value in counters.items():
+            yield f'tracker_cache_requests_total{{name="{name}",outcome="{outcome}"}} {value}'
+    yield '# HELP tracker_cache_hit_ratio Share of the reads of the per-user cache which are hits, per kind.'
+    yield '# TYPE tracker_cache_hit_ratio gauge'
+    for name, counters in stats.items():
+        total = counters['hits'] + counters['misses']
+        if total:
+            yield f'tracker_cache_hit_ratio{{name="{name}"}} {format_value(counters["hits"] / total)}'
+
+
+def expose():
+    '''All the metrics in the Prometheus text exposition format'''
+    families = {}
+    for sample in REGISTRY.samples():
+        families.setdefault(sample[0], []).append(sample)
+    lines = []
+    for metric in METRICS:
+        names = (metric.name,) if metric.type != 'histogram' else (
+            f'{metric.name}_bucket', f'{metric.name}_sum', f'{metric.name}_count')
+        lines.extend(metric.expose([sample for name in names for sample in families.get(name, [])]))
+    lines.extend(expose_cache())
+    return '\n'.join(lines) + '\n'
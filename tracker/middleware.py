@@ -0,0 +1,117 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.utils.decorators import sync_and_async_middleware
+from . import metrics
+from .profiling import profile
+from .queries import MAX_REPEATS, capture_queries, get_budget
+
+logger = logging.getLogger('tracker.queries')
+profiling_logger = logging.getLogger('tracker.profiling')
+
+
+def report_queries(request, response, log):
+    '''Add the number of queries to the response and log the N+1 queries
+    and the views over their budget'''
+    response['X-Query-Count'] = len(log)
+    queries, repeats = None, MAX_REPEATS
+    if request.resolver_match is not None:
+        queries, repeats = get_budget(request.resolver_match.func, log.chunks)
+    for sql, count in log.repeated(repeats).items():
+        logger.warning('N+1 queries on %s: %d times %s',
+                       request.path, count, sql)
+    if queries is not None and len(log) > queries:
+        logger.warning('%s ran %d queries, over its budget of %d',
+                       request.path, len(log), queries)
+
+
+@sync_and_async_middleware
+def QueryCountMiddleware(get_response):
+    '''Record the queries of each request, in DEBUG only'''
+    if not settings.DEBUG:
+        raise MiddlewareNotUsed
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            with capture_queries() as log:
+                response = await get_response(request)
+            report_queries(request, response, log)
+            return response
+    else:
+        def middleware(request):
+            with capture_queries() as log:
+                response = get_response(request)
+            report_queries(request, response, log)
+            return response
+    return middleware
+
+
+def report_profile(request, response, current):
+    response['Server-Timing'] = current.server_timing()
+    url_name = request.resolver_match.url_name if request.resolver_match else None
+    profiling_logger.info(json.dumps({'method': request.method, 'path': request.path, 'url_name': url_name,
+                                      'status': response.status_code, **current.as_dict()}))
+
+
+@sync_and_async_middleware
+def ProfilingMiddleware(get_response):
+    '''Profile a sample of the requests (PROFILING_SAMPLE_RATE, off when 0):
+    the database, template and view times are sent in a Server-Timing
+    header and logged as JSON to tracker.profiling.'''
+    rate = settings.PROFILING_SAMPLE_RATE
+    if not rate:
+        raise MiddlewareNotUsed
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            if random.random() >= rate:
+                return await get_response(request)
+            with profile() as current:
+                response = await get_response(request)
+            report_profile(request, response, current)
+            return response
+    else:
+        def middleware(request):
+            if random.random() >= rate:
+                return get_response(request)
+            with profile() as current:
+                response = get_response(request)
+            report_profile(request, response, current)
+            return response
+    return middleware
+
+
+def record_metrics(request, started, log):
+    url_name = request.resolver_match.url_name if request.resolver_match else ''
+    # In one write of the SQLite file
+    metrics.REGISTRY.add([
+        *metrics.REQUEST_DURATION.samples(time.perf_counter() - started, method=request.method, url_name=url_name),
+        *metrics.REQUEST_QUERIES.samples(len(log), method=request.method, url_name=url_name)])
+
+
+@sync_and_async_middleware
+def MetricsMiddleware(get_response):
+    '''Record the duration and the number of queries of the requests in the
+    metrics (METRICS_DB, off when empty)'''
+    if not settings.METRICS_DB:
+        raise MiddlewareNotUsed
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            started = time.perf_counter()
+            with capture_queries() as log:
+                response = await get_response(request)
+            record_metrics(request, started, log)
+            return response
+    else:
+        def middleware(request):
+            started = time.perf_counter()
+            with capture_queries() as log:
+                response = get_response(request)
+            record_metrics(request, started, log)
+            return response
+    return middleware
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.2 on 2026-10-18 18:47
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0004_auto_20210507_0930'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='balance',
+            name='user',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='balance', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.2 on 2026-10-18 18:48
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+import django.db.models.deletion
+
+
+def build_stats(apps, schema_editor):
+    User = apps.get_model('tracker', 'User')
+    UserStats = apps.get_model('tracker', 'UserStats')
+    users = User.objects.annotate(
+        income=Sum('transactions__amount', filter=Q(
+            transactions__source='income')),
+        expense=Sum('transactions__amount', filter=Q(
+            transactions__source='expense')),
+        count=Count('transactions'),
+        last_activity=Max('transactions__created'))
+    UserStats.objects.bulk_create([UserStats(
+        user_id=u.id, income=u.income or 0.0, expense=u.expense or 0.0,
+        count=u.count, last_activity=u.last_activity) for u in users])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0005_balance_one_to_one'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('income', models.FloatField(default=0.0)),
+                ('expense', models.FloatField(default=0.0)),
+                ('count', models.IntegerField(default=0)),
+                ('last_activity', models.DateTimeField(blank=True, null=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'user stats',
+            },
+        ),
+        migrations.RunPython(build_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.2.2 on 2026-10-18 18:51
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def build_summaries(apps, schema_editor):
+    Transaction = apps.get_model('tracker', 'Transaction')
+    DailySummary = apps.get_model('tracker', 'DailySummary')
+    summaries = Transaction.objects.annotate(date=TruncDate('created')).values(
+        'user_id', 'date', 'source', 'category_id').order_by().annotate(
+        amount=Sum('amount'), count=Count('id'))
+    DailySummary.objects.bulk_create(
+        [DailySummary(**s) for s in summaries.iterator()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0006_userstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('source', models.CharField(choices=[('income', 'income'), ('expense', 'expense')], max_length=255)),
+                ('amount', models.FloatField(default=0.0)),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='daily_summaries', to='tracker.category')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_summaries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'daily summaries',
+                'ordering': ('-date',),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailysummary',
+            constraint=models.UniqueConstraint(fields=('user', 'date', 'source', 'category'), name='unique_daily_summary'),
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.2.2 on 2026-10-18 20:02
+
+from django.db import migrations, models
+
+# First step of the switch to integer cents: only add nullable columns, which
+# does not rewrite the tables. The transactions can then be backfilled with
+# `manage.py backfill_money` while the application keeps serving requests,
+# before 0011 swaps the columns.
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0009_transaction_created_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='amount_cents',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='balance',
+            name='amount_cents',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='userstats',
+            name='income_cents',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='userstats',
+            name='expense_cents',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='dailysummary',
+            name='amount_cents',
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 3.2.2 on 2026-10-18 20:05
+
+from django.db import migrations, models
+import tracker.money
+
+# (table, float column, cents column, only the rows not backfilled yet)
+COLUMNS = [
+    # The transactions are never updated, the rows backfilled beforehand by
+    # `manage.py backfill_money` are still correct
+    ('tracker_transaction', 'amount', 'amount_cents', True),
+    # The running totals are updated in place, convert them all (one row per
+    # user or per day, cheap)
+    ('tracker_balance', 'amount', 'amount_cents', False),
+    ('tracker_userstats', 'income', 'income_cents', False),
+    ('tracker_userstats', 'expense', 'expense_cents', False),
+    ('tracker_dailysummary', 'amount', 'amount_cents', False),
+]
+
+# (model, field) converted to MoneyField
+FIELDS = [
+    ('transaction', 'amount'),
+    ('balance', 'amount'),
+    ('userstats', 'income'),
+    ('userstats', 'expense'),
+    ('dailysummary', 'amount'),
+]
+
+
+def backfill(apps, schema_editor):
+    for table, column, cents_column, only_missing in COLUMNS:
+        tracker.money.backfill_cents(
+            schema_editor.connection, table, column, cents_column, only_missing=only_missing)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0010_money_cents'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='transaction',
+            name='transaction_category_user_idx',
+        ),
+        *[migrations.RemoveField(model_name=model, name=name) for model, name in FIELDS],
+        *[migrations.RenameField(model_name=model, old_name=f'{name}_cents', new_name=name) for model, name in FIELDS],
+        migrations.AlterField(
+            model_name='transaction',
+            name='amount',
+            field=tracker.money.MoneyField(),
+        ),
+        migrations.AlterField(
+            model_name='balance',
+            name='amount',
+            field=tracker.money.MoneyField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='userstats',
+            name='income',
+            field=tracker.money.MoneyField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='userstats',
+            name='expense',
+            field=tracker.money.MoneyField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='dailysummary',
+            name='amount',
+            field=tracker.money.MoneyField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['category', 'user', 'amount'], name='transaction_category_user_idx'),
+        ),
+    ]
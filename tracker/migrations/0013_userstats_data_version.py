@@ -0,0 +1,18 @@
+# Generated by Django 3.2.2 on 2026-10-18 21:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0012_avatarjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='data_version',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
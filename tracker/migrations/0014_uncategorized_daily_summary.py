@@ -0,0 +1,32 @@
+# Generated by Django 3.2.2 on 2026-10-18 21:08
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicates(apps, schema_editor):
+    # The days without category could be inserted twice concurrently
+    DailySummary = apps.get_model('tracker', 'DailySummary')
+    uncategorized = DailySummary.objects.filter(category__isnull=True)
+    duplicates = uncategorized.values('user_id', 'date', 'source').order_by().annotate(
+        rows=Count('id'), total=Sum('amount'), transactions=Sum('count')).filter(rows__gt=1)
+    for day in duplicates:
+        ids = list(uncategorized.filter(user_id=day['user_id'], date=day['date'], source=day['source'])
+                   .order_by('id').values_list('id', flat=True))
+        DailySummary.objects.filter(pk=ids[0]).update(amount=day['total'], count=day['transactions'])
+        DailySummary.objects.filter(pk__in=ids[1:]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tracker', '0013_userstats_data_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='dailysummary',
+            constraint=models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('user', 'date', 'source'), name='unique_uncategorized_daily_summary'),
+        ),
+    ]
@@ -1,20 +1,49 @@
 import os
 import json
-from PIL import Image
+import time
+import uuid
+import warnings
+from datetime import timedelta
+from PIL import Image, UnidentifiedImageError
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, router, transaction, IntegrityError
+from django.db.models import Exists, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, TruncDate, TruncWeek, TruncMonth, TruncYear
+from django.utils import timezone
 from django.core.exceptions import ValidationError
 from django.dispatch import receiver
-from django.db.models.signals import pre_save, pre_delete, post_save
+from .money import MoneyField, money, to_decimal
+from .uploads import MAX_UPLOAD_SIZE
+from . import cache, metrics
+from django.db.models.signals import pre_save, pre_delete, post_save, post_delete
 
 
-# Custom validator for minimum size of images
+AVATAR_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+
+# Custom validator for minimum size of images, only the header of the image
+# is read, the pixels are decoded by the avatar worker once validated
 def validate_image_size(image):
-    img = Image.open(image)
-    fw, fh = img.size
-    if image.file.size > 2 * 1024 * 1024:
+    if image.size > MAX_UPLOAD_SIZE:
         raise ValidationError(
             'Image size is larger than what is allowed (2048 KBs)')
+    try:
+        with warnings.catch_warnings():
+            # Decompression bombs are rejected before any decoding
+            warnings.simplefilter('error', Image.DecompressionBombWarning)
+            img = Image.open(image)
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning):
+        raise ValidationError(
+            'Height or Width is larger than what is allowed (1920x1920)')
+    except UnidentifiedImageError:
+        img = None
+    finally:
+        image.seek(0)
+    if img is None or img.format not in AVATAR_FORMATS:
+        raise ValidationError(
+            'Upload a valid image. The file you uploaded was either not an image or a corrupted image.')
+    fw, fh = img.size
     if fw < 128 or fh < 128:
         raise ValidationError(
             'Height or Width is smaller than what is allowed (128x128)')
@@ -29,6 +58,12 @@ def user_avatar_path(instance, filename):
     return f'user_{instance.id}/avatar/md{file_ext}'
 
 
+# Uploaded avatars wait here until a worker processes them
+def avatar_upload_path(instance, filename):
+    _, file_ext = os.path.splitext(filename)
+    return f'user_{instance.user_id}/avatar/uploads/{uuid.uuid4().hex}{file_ext}'
+
+
 class User(AbstractUser):
     avatar = models.ImageField(
         upload_to=user_avatar_path, default='avatar.jpg', validators=[validate_image_size])
@@ -44,35 +79,98 @@ class User(AbstractUser):
     #     return False
 
     def get_total_transactions(self):
-        return self.transactions.count()
+        return self.get_stats()['count']
 
     def get_balance(self):
-        return self.balance.first().amount
+        # Read the committed value rather than the related object, which may
+        # be stale as the balance is only ever updated in place by SQL. It is
+        # cached until the next write of the user
+        return cache.get_or_compute(self, 'balance', lambda: Balance.objects.filter(
+            user=self).values_list('amount', flat=True).get())
 
     def get_total_income(self):
-        income = self.transactions.filter(
-            source='income').aggregate(models.Sum('amount'))
-        if income['amount__sum'] == None:
-            return 0.0
-        else:
-            return income['amount__sum']
+        return self.get_stats()['income']
 
     def get_total_expense(self):
-        income = self.transactions.filter(
-            source='expense').aggregate(models.Sum('amount'))
-        if income['amount__sum'] == None:
-            return 0.0
-        else:
-            return income['amount__sum']
+        return self.get_stats()['expense']
+
+    def get_stats(self):
+        # Read from the denormalized row instead of aggregating the ledger
+        return cache.get_or_compute(self, 'stats', lambda: UserStats.objects.filter(user=self).values(
+            'income', 'expense', 'count', 'last_activity').get())
+
+    def get_dashboard(self, days=7):
+        '''Income, expense, number of transactions, balance and the daily
+        income and expense of the last days (today included).'''
+        today = timezone.localdate()
+        return cache.get_or_compute(self, 'dashboard', lambda: self.compute_dashboard(today, days), today, days)
+
+    def compute_dashboard(self, today, days):
+        # A single aggregate over the daily rollup, each total and each day
+        # of the series is a conditional Sum
+        dates = [today - timedelta(days=days - 1 - i) for i in range(days)]
+
+        def total(**filters):
+            return Coalesce(models.Sum('amount', filter=Q(**filters)), models.Value(0, output_field=MoneyField()))
+        # The balance row, as served by /api/balance, in the same query. An
+        # aggregate query may only select aggregates: Max() of the same value
+        # on every row, and the subquery alone without any daily summary
+        balance = Subquery(Balance.objects.filter(user=self).values('amount')[:1], output_field=MoneyField())
+        aggregates = {'income': total(source=Transaction.INCOME), 'expense': total(source=Transaction.EXPENSE),
+                      'count': Coalesce(models.Sum('count'), 0),
+                      'balance': Coalesce(models.Max(balance), balance)}
+        for i, date in enumerate(dates):
+            aggregates[f'income_{i}'] = total(
+                source=Transaction.INCOME, date=date)
+            aggregates[f'expense_{i}'] = total(
+                source=Transaction.EXPENSE, date=date)
+        totals = DailySummary.objects.filter(
+            user=self).aggregate(**aggregates)
+        return {
+            'balance': totals['balance'],
+            'income': totals['income'],
+            'expense': totals['expense'],
+            'count': totals['count'],
+            'daily': {
+                'time': dates,
+                'income': [totals[f'income_{i}'] for i in range(days)],
+                'expense': [totals[f'expense_{i}'] for i in range(days)],
+            },
+        }
+
+    def get_categories_with_balance(self):
+        # Sum the transactions of every category in a single GROUP BY query
+        return Category.objects.filter(user=self).annotate(balance=Coalesce(
+            models.Sum('category__amount', filter=Q(category__user=self)), models.Value(0, output_field=MoneyField()))).order_by('title')
+
+    def get_report(self, source, start, end, granularity='day'):
+        '''Sum the amounts of the source per period (day, week, month or year)
+        between the start and end dates, from the daily rollup table.'''
+        return cache.get_or_compute(self, 'report', lambda: self.compute_report(source, start, end, granularity),
+                                    source, start, end, granularity)
+
+    def compute_report(self, source, start, end, granularity):
+        summaries = DailySummary.objects.filter(
+            user=self, source=source, date__gte=start, date__lte=end)
+        periods = summaries.annotate(period=DailySummary.GRANULARITIES[granularity]('date')).values(
+            'period').order_by('period').annotate(sum_amount=models.Sum('amount'))
+        report = {'amounts': [], 'time': []}
+        for p in periods:
+            report['amounts'].append(p['sum_amount'])
+            report['time'].append(p['period'])
+        return report
 
     def get_report_amount_from_category(self, source):
-        categories = Category.objects.filter(user=self, source=source).all()
+        return cache.get_or_compute(self, 'categories', lambda: self.compute_report_amount_from_category(source), source)
+
+    def compute_report_amount_from_category(self, source):
+        categories = self.get_categories_with_balance().filter(source=source)
         categories_titles = []
         categories_amounts = []
         category_report = {}
         for c in categories:
             categories_titles.append(c.title)
-            categories_amounts.append(c.get_balance_from_category())
+            categories_amounts.append(c.balance)
         category_report['titles'] = categories_titles
         category_report['amounts'] = categories_amounts
         return category_report
@@ -90,6 +188,10 @@ class Category(models.Model):
     class Meta:
         ordering = ['title']
         verbose_name_plural = "categories"
+        indexes = [
+            models.Index(fields=['user', 'source', 'title'],
+                         name='category_user_source_idx'),
+        ]
 
     title = models.CharField(max_length=128)
     source = models.CharField(max_length=255, choices=TYPES, default=INCOME)
@@ -103,13 +205,38 @@ class Category(models.Model):
         if self.source == 'expense':
             return f'(-) {self.title}'
 
+    def delete(self, using=None, keep_parents=False):
+        '''Delete the category and its transactions. The balance and stats
+        are adjusted once per source instead of once per transaction by the
+        Transaction signals, the daily summaries go with the category.'''
+        using = using or router.db_for_write(Category, instance=self)
+        with transaction.atomic(using=using):
+            transactions = Transaction.objects.using(using).filter(category=self)
+            totals = list(transactions.order_by().values('source').annotate(
+                amount=models.Sum('amount'), count=models.Count('id')))
+            if not Balance.adjust(self.user_id, -sum((t['amount'] for t in totals), to_decimal(0)), using=using):
+                raise ValidationError(
+                    'Your balance is insufficient.')
+            for t in totals:
+                UserStats.record(self.user_id, t['source'], -t['amount'], count=-t['count'],
+                                 using=using)
+            if not totals:
+                UserStats.touch(self.user_id, using=using)
+            # One DELETE without the collector and the signals of the
+            # transactions: nothing references a transaction, and what the
+            # signals would do is done above at once (the daily summaries go
+            # with the category), so the query count does not grow with the
+            # number of transactions
+            transactions._raw_delete(using)
+            return super().delete(using=using, keep_parents=keep_parents)
+
     def get_balance_from_category(self):
         amount = Transaction.objects.filter(category=self, user=self.user).aggregate(
             models.Sum('amount'))['amount__sum']
         if amount:
             return amount
         else:
-            return 0.0
+            return to_decimal(0)
 
 
 class Transaction(models.Model):
@@ -122,15 +249,51 @@ class Transaction(models.Model):
     )
     text = models.CharField(max_length=255)
     source = models.CharField(max_length=255, choices=TYPES, default=INCOME)
+    # The single column FK indexes are covered by the composite indexes below
     category = models.ForeignKey(
-        Category, related_name='category', blank=True, null=True, on_delete=models.CASCADE)
-    amount = models.FloatField()
+        Category, related_name='category', blank=True, null=True, on_delete=models.CASCADE, db_index=False)
+    amount = MoneyField()
     user = models.ForeignKey(
-        User, related_name='transactions', on_delete=models.CASCADE)
-    created = models.DateTimeField(auto_now_add=True)
+        User, related_name='transactions', on_delete=models.CASCADE, db_index=False)
+    # Not auto_now_add, so that imported transactions keep their date
+    created = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         ordering = ('-created',)
+        indexes = [
+            # Latest transactions of a user (Meta.ordering)
+            models.Index(fields=['user', '-created'],
+                         name='transaction_user_created_idx'),
+            # Transactions of a user per source over a period of time
+            models.Index(fields=['user', 'source', 'created'],
+                         name='transaction_user_source_idx'),
+            # Transactions of a category, covering the amount for the
+            # category report
+            models.Index(fields=['category', 'user', 'amount'],
+                         name='transaction_category_user_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Keep the balance update (pre_save) and the insert in one transaction
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def normalize(self):
+        '''Auto convert minus/plus in conjunction with category'''
+        if self.category:
+            if self.category.source == 'income':
+                self.source = 'income'
+                if self.amount < 0:
+                    self.amount = -self.amount
+            elif self.category.source == 'expense':
+                self.source = 'expense'
+                if self.amount > 0:
+                    self.amount = -self.amount
+        else:
+            if self.amount > 0:
+                self.source = 'income'
+            elif self.amount < 0:
+                self.source = 'expense'
 
     # def __str__(self):
     #     words = self.text.split(' ')
@@ -142,57 +305,353 @@ class Transaction(models.Model):
 
 @receiver(pre_save, sender=Transaction)
 def update_balance(sender, instance, **kwargs):
-    #  Auto convert minus/plus in conjunction with category
-    if instance.category:
-        if instance.category.source == 'income':
-            instance.source = 'income'
-            if instance.amount < 0:
-                instance.amount = -instance.amount
-        elif instance.category.source == 'expense':
-            instance.source = 'expense'
-            if instance.amount > 0:
-                instance.amount = -instance.amount
-    else:
-        if instance.amount > 0:
-            instance.source = 'income'
-        elif instance.amount < 0:
-            instance.source = 'expense'
-
-    balance = instance.user.balance.first()
-    balance.amount = balance.amount + instance.amount
-
-    if balance.amount == 0:
+    instance.normalize()
+
+    if instance.amount == 0:
         raise ValidationError(
             'The ammount should be different from 0.')
-    if balance.amount < 0:
+
+    # UPDATE ... SET amount = amount + delta WHERE amount + delta > 0
+    # No row updated means the balance would not stay positive
+    if not Balance.adjust(instance.user_id, instance.amount, allow_zero=False):
         raise ValidationError(
             'Your balance is insufficient.')
-    balance.save()
+    UserStats.record(instance.user_id, instance.source, instance.amount)
+    DailySummary.record(instance.user_id, timezone.localdate(instance.created),
+                        instance.source, instance.category_id, instance.amount)
 
 
 @receiver(pre_delete, sender=Transaction)
 def pre_deleted_transaction(sender, instance, using, **kwargs):
-    balance = instance.user.balance.first()
-    balance.amount = balance.amount - instance.amount
-    if balance.amount < 0:
+    if not Balance.adjust(instance.user_id, -instance.amount, using=using):
         raise ValidationError(
             'Your balance is insufficient.')
-    balance.save()
+    UserStats.record(instance.user_id, instance.source,
+                     -instance.amount, count=-1, using=using)
+    DailySummary.record(instance.user_id, timezone.localdate(instance.created), instance.source,
+                        instance.category_id, -instance.amount, count=-1, using=using)
 
 
 class Balance(models.Model):
-    amount = models.FloatField(default=0.0)
+    amount = MoneyField(default=0)
     created = models.DateTimeField(auto_now_add=True)
-    user = models.ForeignKey(
+    user = models.OneToOneField(
         User, related_name='balance', on_delete=models.CASCADE)
     updated = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f'$ {self.amount}'
 
+    @classmethod
+    def adjust(cls, user_id, delta, allow_zero=True, using=None):
+        '''Atomically add delta to the user balance in a single conditional UPDATE.
+        Return False (nothing is written) if the balance would become negative,
+        or zero when allow_zero is False.'''
+        delta = to_decimal(delta)
+        queryset = cls.objects.using(using).filter(user_id=user_id)
+        if allow_zero:
+            queryset = queryset.filter(amount__gte=-delta)
+        else:
+            queryset = queryset.filter(amount__gt=-delta)
+        if queryset.update(amount=F('amount') + money(delta), updated=timezone.now()) != 1:
+            metrics.BALANCE_REFUSALS.inc()
+            return False
+        return True
+
+
+class UserStats(models.Model):
+    '''Running totals of the user transactions, maintained by the Transaction
+    signals in the same database transaction as the insert/delete.'''
+    user = models.OneToOneField(
+        User, related_name='stats', on_delete=models.CASCADE)
+    income = MoneyField(default=0)
+    expense = MoneyField(default=0)
+    count = models.IntegerField(default=0)
+    last_activity = models.DateTimeField(null=True, blank=True)
+    # Bumped by every write of the data of the user, in the same database
+    # transaction, see utils.data_etag
+    data_version = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "user stats"
+
+    def __str__(self):
+        return f'{self.count} transactions, + {self.income} / {self.expense}'
+
+    @classmethod
+    def record(cls, user_id, source, amount, count=1, using=None):
+        fields = {'count': F('count') + count,
+                  'last_activity': timezone.now(),
+                  'data_version': F('data_version') + 1}
+        if source == Transaction.INCOME:
+            fields['income'] = F('income') + money(amount)
+        elif source == Transaction.EXPENSE:
+            fields['expense'] = F('expense') + money(amount)
+        cls.objects.using(using).filter(user_id=user_id).update(**fields)
+
+    @classmethod
+    def touch(cls, user_id, using=None):
+        '''Bump the data version after a write which records no stats'''
+        cls.objects.using(using).filter(user_id=user_id).update(data_version=F('data_version') + 1)
+
+    @staticmethod
+    def compute(user):
+        '''Aggregate the stats from the ledger in one query.'''
+        stats = user.transactions.aggregate(
+            income=models.Sum('amount', filter=Q(source=Transaction.INCOME)),
+            expense=models.Sum('amount', filter=Q(
+                source=Transaction.EXPENSE)),
+            count=models.Count('id'),
+            last_activity=models.Max('created'))
+        stats['income'] = stats['income'] or to_decimal(0)
+        stats['expense'] = stats['expense'] or to_decimal(0)
+        return stats
+
+    @classmethod
+    def rebuild(cls, user):
+        stats = cls.compute(user)
+        cls.objects.update_or_create(user=user, defaults=stats)
+        cls.touch(user.id)
+        cache.invalidate(user.id)
+        return stats
+
+
+class DailySummary(models.Model):
+    '''Daily rollup of the transactions per user, source and category,
+    maintained by the Transaction signals like the balance.'''
+    GRANULARITIES = {
+        'day': F,
+        'week': TruncWeek,
+        'month': TruncMonth,
+        'year': TruncYear,
+    }
+
+    user = models.ForeignKey(
+        User, related_name='daily_summaries', on_delete=models.CASCADE)
+    date = models.DateField()
+    source = models.CharField(max_length=255, choices=Transaction.TYPES)
+    category = models.ForeignKey(
+        Category, related_name='daily_summaries', blank=True, null=True, on_delete=models.CASCADE)
+    amount = MoneyField(default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ('-date',)
+        verbose_name_plural = "daily summaries"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'date', 'source', 'category'], name='unique_daily_summary'),
+            # NULLs are distinct in a unique constraint, the days without
+            # category need their own
+            models.UniqueConstraint(
+                fields=['user', 'date', 'source'], condition=Q(category__isnull=True),
+                name='unique_uncategorized_daily_summary'),
+        ]
+
+    def __str__(self):
+        return f'{self.date} {self.source}: {self.amount} ({self.count})'
+
+    @classmethod
+    def record(cls, user_id, date, source, category_id, amount, count=1, using=None):
+        summary = cls.objects.using(using).filter(
+            user_id=user_id, date=date, source=source, category_id=category_id)
+        if summary.update(amount=F('amount') + money(amount), count=F('count') + count):
+            if count < 0:
+                # Drop the days without any transaction left
+                summary.filter(count__lte=0).delete()
+            return
+        try:
+            # Savepoint, so a concurrent insert of the same day does not
+            # break the outer transaction
+            with transaction.atomic(using=using):
+                cls.objects.using(using).create(user_id=user_id, date=date, source=source,
+                                                category_id=category_id, amount=amount, count=count)
+        except IntegrityError:
+            metrics.DAILY_SUMMARY_CONFLICTS.inc()
+            summary.update(amount=F('amount') + money(amount),
+                           count=F('count') + count)
+
+    @classmethod
+    def record_many(cls, user_id, totals):
+        '''Add {(date, source, category_id): (amount, count)} totals, the
+        existing days are updated in one UPDATE and the missing days are
+        inserted at once with bulk_create.'''
+        totals = dict(totals)
+        dates = [date for date, _, _ in totals]
+        existing = cls.objects.filter(
+            user_id=user_id, date__gte=min(dates), date__lte=max(dates)).values_list('id', 'date', 'source', 'category_id')
+        updates = {pk: totals.pop(tuple(key))
+                   for pk, *key in existing if tuple(key) in totals}
+        if updates:
+            amounts = [models.When(pk=pk, then=money(amount))
+                       for pk, (amount, _) in updates.items()]
+            counts = [models.When(pk=pk, then=models.Value(count))
+                      for pk, (_, count) in updates.items()]
+            cls.objects.filter(pk__in=updates).update(
+                amount=F('amount') + models.Case(*amounts, output_field=MoneyField()),
+                count=F('count') + models.Case(*counts, output_field=models.IntegerField()))
+        cls.objects.bulk_create([cls(user_id=user_id, date=date, source=source, category_id=category_id, amount=amount, count=count)
+                                 for (date, source, category_id), (amount, count) in totals.items()])
+
+    @staticmethod
+    def compute(user):
+        '''Aggregate the daily summaries of the user from the ledger.'''
+        return list(user.transactions.annotate(date=TruncDate('created')).values(
+            'date', 'source', 'category_id').order_by().annotate(
+            amount=models.Sum('amount'), count=models.Count('id')))
+
+    @classmethod
+    def rebuild(cls, user):
+        summaries = cls.compute(user)
+        cls.objects.filter(user=user).delete()
+        cls.objects.bulk_create([cls(user=user, **s) for s in summaries])
+        UserStats.touch(user.id)
+        cache.invalidate(user.id)
+        return summaries
+
+
+class AvatarJob(models.Model):
+    '''Uploaded avatar waiting to be cropped, the jobs are drained by
+    `manage.py run_workers` and the user keeps the previous avatar until
+    the job is done.'''
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    STATUSES = (
+        (PENDING, PENDING),
+        (RUNNING, RUNNING),
+        (DONE, DONE),
+        (FAILED, FAILED),
+    )
+    # A running job older than this is considered abandoned by a dead worker
+    TIMEOUT = timedelta(minutes=10)
+    # The user avatar is the md rendition
+    RENDITIONS = {'sm': (64, 64), 'md': (128, 128), 'lg': (256, 256)}
+    WEBP = True
+
+    user = models.ForeignKey(
+        User, related_name='avatar_jobs', on_delete=models.CASCADE)
+    upload = models.FileField(upload_to=avatar_upload_path)
+    status = models.CharField(
+        max_length=16, choices=STATUSES, default=PENDING)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('-created',)
+        indexes = [
+            models.Index(fields=['status', 'created'],
+                         name='avatarjob_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} {self.status}'
+
+    @classmethod
+    def claim(cls):
+        '''Mark the oldest pending (or abandoned) job as running and return
+        it, None if there is nothing to do. The conditional UPDATE makes sure
+        only one worker gets a job, and that a user has one running job at
+        a time. The pending or abandoned jobs of a user older than their
+        latest upload are superseded, they fail without being run.'''
+        now = timezone.now()
+        idle = cls.objects.filter(Q(status=cls.PENDING) | Q(
+            status=cls.RUNNING, started__lt=now - cls.TIMEOUT))
+        same_user = cls.objects.filter(user=OuterRef('user')).exclude(pk=OuterRef('pk'))
+        newer = Exists(same_user.filter(created__gt=OuterRef('created')))
+        for job in idle.filter(newer):
+            if idle.filter(pk=job.pk).update(status=cls.FAILED, error='Superseded by a newer upload.',
+                                             finished=now):
+                job.upload.delete(save=False)
+        running = Exists(same_user.filter(status=cls.RUNNING, started__gte=now - cls.TIMEOUT))
+        available = idle.filter(~newer, ~running)
+        while True:
+            pk = available.order_by(
+                'created').values_list('pk', flat=True).first()
+            if pk is None:
+                return None
+            if available.filter(pk=pk).update(status=cls.RUNNING, started=now):
+                return cls.objects.get(pk=pk)
+
+    def run(self):
+        '''Crop the upload into the user avatar (md) and keep the original
+        (full), the previous avatar files are removed once the new one is
+        in place.'''
+        from .utils import render_avatar
+        started = time.perf_counter()
+        _, ext = os.path.splitext(self.upload.name)
+        directory = f'{settings.MEDIA_ROOT}/user_{self.user_id}/avatar'
+        # Temporary names of this run only, an abandoned run of the same
+        # user may still be writing its own
+        suffix = f'.{uuid.uuid4().hex}.tmp'
+        written, swapped = [], []
+        try:
+            # Write next to the served files and swap them in at once
+            written = render_avatar(self.upload.path, {
+                f'{directory}/{name}{suffix}{ext}': size for name, size in self.RENDITIONS.items()}, webp=self.WEBP)
+            written.append(f'{directory}/full{suffix}{ext}')
+            os.replace(self.upload.path, written[-1])
+            for path in written:
+                target = path.replace(f'{suffix}.', '.')
+                # A link to the served file to put it back if a later swap
+                # fails, the file is never missing meanwhile
+                backup = f'{path}.old'
+                if os.path.exists(target):
+                    os.link(target, backup)
+                os.replace(path, target)
+                swapped.append((target, backup))
+            User.objects.filter(pk=self.user_id).update(
+                avatar=f'user_{self.user_id}/avatar/md{ext}')
+            current = {os.path.basename(target) for target, _ in swapped}
+            for name in os.listdir(directory):
+                if name.count('.') == 1 and name.split('.')[0] in (*self.RENDITIONS, 'full') and \
+                        name not in current:
+                    os.remove(f'{directory}/{name}')
+            self.status = self.DONE
+        except Exception as e:
+            self.status = self.FAILED
+            self.error = str(e)
+            self.upload.delete(save=False)
+            # The previous avatar stays whole
+            for target, backup in reversed(swapped):
+                if os.path.exists(backup):
+                    os.replace(backup, target)
+                else:
+                    os.remove(target)
+        for path in written:
+            for leftover in (path, f'{path}.old'):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+        self.finished = timezone.now()
+        self.save(update_fields=['status', 'error', 'finished'])
+        metrics.AVATAR_DURATION.observe(
+            time.perf_counter() - started, status=self.status)
+
+
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_cache(sender, instance, **kwargs):
+    cache.invalidate(instance.user_id)
+
+
+@receiver(post_save, sender=Category)
+def touch_data_version(sender, instance, using, **kwargs):
+    # The transactions bump it when they record their stats, Category.delete
+    # when it has none
+    UserStats.touch(instance.user_id, using=using)
+
 
 @receiver(post_save, sender=User)
 def initialize_balance(sender, instance, created, **kwargs):
     if created:
+        # The cache may still hold values of a deleted user with the same id
+        cache.invalidate(instance.id)
         balance = Balance(user=instance)
         balance.save()
+        UserStats.objects.create(user=instance)
@@ -0,0 +1,101 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from django import forms
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+CENT = Decimal('0.01')
+
+
+def to_decimal(value):
+    '''Convert an amount (int, float, str or Decimal) to a Decimal rounded to
+    the cent, floats go through str() so that 0.1 stays 0.1'''
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value) if isinstance(value, float) else value)
+    if not value.is_finite():
+        raise InvalidOperation(f'Invalid amount: {value}')
+    return value.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def to_cents(value):
+    return int(to_decimal(value).scaleb(2))
+
+
+class MoneyDescriptor(DeferredAttribute):
+    # Amounts are always Decimal on the instance, whatever was assigned
+    def __set__(self, instance, value):
+        if value is not None and not isinstance(value, Decimal):
+            value = self.field.to_python(value)
+        instance.__dict__[self.field.attname] = value
+
+
+class MoneyField(models.BigIntegerField):
+    '''Amount stored as an integer number of cents and exposed as Decimal,
+    so that sums are exact and cheap for the database.'''
+    descriptor_class = MoneyDescriptor
+
+    def to_python(self, value):
+        if value is None or isinstance(value, Decimal):
+            return value
+        try:
+            return to_decimal(value)
+        except (InvalidOperation, TypeError, ValueError):
+            raise ValidationError(
+                self.error_messages['invalid'], code='invalid', params={'value': value})
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return Decimal(value).scaleb(-2)
+
+    def get_prep_value(self, value):
+        if value is None or hasattr(value, 'resolve_expression'):
+            return value
+        return to_cents(value)
+
+    def formfield(self, **kwargs):
+        return super(models.IntegerField, self).formfield(**{
+            'form_class': forms.DecimalField,
+            'decimal_places': 2,
+            **kwargs,
+        })
+
+
+def money(amount):
+    '''Amount as an SQL value (in cents), e.g. to add to a MoneyField with F()'''
+    return models.Value(to_decimal(amount), output_field=MoneyField())
+
+
+class MoneyJSONEncoder(DjangoJSONEncoder):
+    '''Encode the amounts as JSON numbers instead of strings'''
+
+    def default(self, o):
+        if isinstance(o, Decimal):
+            return float(o)
+        return super().default(o)
+
+
+def backfill_cents(connection, table, column, cents_column, batch_size=5000, only_missing=True):
+    '''Fill cents_column from the float column in small batches, each batch
+    committed on its own (when not in a transaction) so that writers are not
+    blocked for long. The amounts are rounded by to_cents, like the amounts
+    written by the application: ROUND() in SQL rounds the binary float, e.g.
+    10.005 * 100 is 1000.4999... Return the number of updated rows.'''
+    quote = connection.ops.quote_name
+    table, column, cents_column = quote(
+        table), quote(column), quote(cents_column)
+    missing = f'AND {cents_column} IS NULL' if only_missing else ''
+    updated = 0
+    last_id = 0
+    with connection.cursor() as cursor:
+        while True:
+            cursor.execute(f'SELECT id, {column} FROM {table} WHERE id > %s {missing} ORDER BY id LIMIT %s',
+                           [last_id, batch_size])
+            rows = cursor.fetchall()
+            if not rows:
+                return updated
+            cursor.executemany(f'UPDATE {table} SET {cents_column} = %s WHERE id = %s',
+                               [(to_cents(amount), pk) for pk, amount in rows])
+            updated += len(rows)
+            last_id = rows[-1][0]
@@ -0,0 +1,80 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.template import TemplateDoesNotExist
+from django.template.backends import django as backend
+from .queries import capture_queries
+
+_profile = ContextVar('tracker_profile', default=None)
+
+
+class Profile:
+    '''Where the time of a request goes, in seconds: the database, the
+    template rendering (its queries excluded) and the rest, the Python code
+    of the view and the middlewares.'''
+
+    def __init__(self, queries):
+        self.queries = queries
+        self.template = 0
+        self.total = 0
+
+    @property
+    def database(self):
+        return self.queries.duration
+
+    @property
+    def view(self):
+        return max(0, self.total - self.database - self.template)
+
+    def as_dict(self):
+        return {'total_ms': round(self.total * 1000, 3), 'db_ms': round(self.database * 1000, 3),
+                'queries': len(self.queries), 'template_ms': round(self.template * 1000, 3),
+                'view_ms': round(self.view * 1000, 3)}
+
+    def server_timing(self):
+        return (f'db;dur={self.database * 1000:.1f};desc="{len(self.queries)} queries", '
+                f'tpl;dur={self.template * 1000:.1f}, view;dur={self.view * 1000:.1f}, '
+                f'total;dur={self.total * 1000:.1f}')
+
+
+@contextmanager
+def profile():
+    '''Profile the code run in the current context (and the threads it is
+    copied to)'''
+    started = time.perf_counter()
+    with capture_queries() as queries:
+        current = Profile(queries)
+        token = _profile.set(current)
+        try:
+            yield current
+        finally:
+            _profile.reset(token)
+            current.total = time.perf_counter() - started
+
+
+class Template(backend.Template):
+    def render(self, context=None, request=None):
+        current = _profile.get()
+        if current is None:
+            return super().render(context, request)
+        started, database = time.perf_counter(), current.database
+        try:
+            return super().render(context, request)
+        finally:
+            # The lazy querysets evaluated by the template count as database
+            current.template += time.perf_counter() - started - \
+                (current.database - database)
+
+
+class DjangoTemplates(backend.DjangoTemplates):
+    '''The Django template backend, with the rendering time of the
+    templates added to the profile of the request'''
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            backend.reraise(exc, self)
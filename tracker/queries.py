@@ -0,0 +1,107 @@
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# A view may run the same SQL shape this many times, more is reported as
+# N+1 queries (one query per row of a previous query)
+MAX_REPEATS = 2
+
+# The logs being recorded, captures may be nested (e.g. the query counter
+# and the profiler)
+_recorders = ContextVar('tracker_queries', default=())
+
+# Not counted: whether they run depends on the code being in a transaction
+# already, as in the tests
+TRANSACTION_CONTROL = ('BEGIN', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+PLACEHOLDERS = re.compile(r'\(%s(?:, %s)*\)')
+SPACES = re.compile(r'\s+')
+
+
+def shape(sql):
+    '''The SQL without what changes from a row to another: the parameters
+    are already placeholders, the IN lists are collapsed.'''
+    return SPACES.sub(' ', PLACEHOLDERS.sub('(...)', sql)).strip()
+
+
+class QueryLog:
+    def __init__(self):
+        self.queries = []
+        # Seconds spent in the database
+        self.duration = 0
+        # Chunks of the unbounded writes, see count_chunk
+        self.chunks = 0
+
+    def __len__(self):
+        return len(self.queries)
+
+    def __iter__(self):
+        return iter(self.queries)
+
+    def repeated(self, max_repeats=MAX_REPEATS):
+        '''{shape: count} of the shapes run more than max_repeats times'''
+        counts = Counter(shape(sql) for sql in self.queries)
+        return {sql: count for sql, count in counts.items() if count > max_repeats}
+
+
+def record(execute, sql, params, many, context):
+    logs = _recorders.get()
+    if not logs or sql.startswith(TRANSACTION_CONTROL):
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        for log in logs:
+            log.queries.append(sql)
+            log.duration += duration
+
+
+def install(sender, connection, **kwargs):
+    '''connection_created receiver, every connection records the queries,
+    including the ones of the threads of sync_to_async()'''
+    if record not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record)
+
+
+@contextmanager
+def capture_queries():
+    '''Record the queries run in the current context (and the threads it is
+    copied to) into a QueryLog'''
+    log = QueryLog()
+    token = _recorders.set(_recorders.get() + (log,))
+    try:
+        yield log
+    finally:
+        _recorders.reset(token)
+
+
+def count_chunk():
+    '''Count a chunk of rows of an unbounded write (e.g. an import) in the
+    logs being recorded, the budget of the view grows by its per_chunk
+    queries for each chunk.'''
+    for log in _recorders.get():
+        log.chunks += 1
+
+
+def query_budget(queries, repeats=MAX_REPEATS, per_chunk=0):
+    '''Declare the maximum number of queries of a view (session and user
+    included) and how many times a query shape may be repeated. A view
+    writing rows in chunks may run per_chunk more queries per chunk, and
+    repeat a shape per_chunk more times. It is checked by
+    QueryCountMiddleware in DEBUG and by the tests.'''
+    def decorator(view_func):
+        view_func.query_budget = (queries, repeats)
+        view_func.query_budget_per_chunk = per_chunk
+        return view_func
+    return decorator
+
+
+def get_budget(view_func, chunks=0):
+    '''(queries, repeats) of the view for a request which wrote that many
+    chunks, queries is None without a budget'''
+    queries, repeats = getattr(view_func, 'query_budget', (None, MAX_REPEATS))
+    extra = getattr(view_func, 'query_budget_per_chunk', 0) * chunks
+    return (None if queries is None else queries + extra), repeats + extra
@@ -0,0 +1,65 @@
+from django.contrib.humanize.templatetags.humanize import naturaltime
+from django.db import models
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+# Columns of a serialized transaction, the category title is joined and the
+# amount read in cents
+TRANSACTION_COLUMNS = ('id', 'text', 'source', 'category_id', 'amount_cents', 'user_id', 'created',
+                       'category__title')
+
+
+def json_datetime(value):
+    '''The datetime format of DjangoJSONEncoder (milliseconds, Z for UTC)'''
+    text = value.isoformat()
+    if value.microsecond:
+        text = text[:23] + text[26:]
+    if text.endswith('+00:00'):
+        text = text[:-6] + 'Z'
+    return text
+
+
+def human_times():
+    '''naturaltime() with a memo. Two days or more ago, the text shows two
+    adjacent units of timesince from the days: it only changes with the
+    hour, and with the day from a week. The year is part of the key as
+    timesince subtracts the leap days.'''
+    now = timezone.now()
+    texts = {}
+
+    def human_time(value):
+        delta = now - value
+        if delta.days < 2:
+            return naturaltime(value)
+        key = (delta.days, value.year) if delta.days >= 8 else (
+            delta.days, delta.seconds // 3600, value.year)
+        if key not in texts:
+            texts[key] = naturaltime(value)
+        return texts[key]
+    return human_time
+
+
+def transaction_values(queryset, named=False):
+    '''Tuples of TRANSACTION_COLUMNS for the transactions of the queryset, in
+    one query and without model instances.'''
+    return queryset.annotate(amount_cents=Cast('amount', models.BigIntegerField())).values_list(
+        *TRANSACTION_COLUMNS, named=named)
+
+
+def serialize_transactions(rows):
+    '''Serialize transaction_values() tuples. The values are only made of
+    JSON types, so that they are encoded by the C encoder of the json module
+    without going through a default() hook.'''
+    human_time = human_times()
+    return [{
+        'id': pk,
+        'text': text,
+        'source': source,
+        'category_id': category_id,
+        # Same float as float(Decimal) of the amount
+        'amount': cents / 100,
+        'user_id': user_id,
+        'created': json_datetime(created),
+        'category_title': category_title,
+        'human_time': human_time(created),
+    } for pk, text, source, category_id, cents, user_id, created, category_title in rows]
@@ -0,0 +1,148 @@
+import inspect
+import json
+import logging
+import os
+import sqlite3
+import time
+from django.conf import settings
+from django.db import DatabaseError
+from . import metrics
+from .queries import TRANSACTION_CONTROL, shape
+
+logger = logging.getLogger('tracker.slow_queries')
+
+# The code between the caller and the database is not the caller
+INTERNALS = ('tracker.queries', 'tracker.slow_queries', 'tracker.profiling', 'tracker.middleware',
+             'tracker.metrics', 'tracker.cache', 'tracker.utils')
+EXPLAINED = ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH')
+SCHEMA = ('CREATE TABLE IF NOT EXISTS slow_queries (shape TEXT PRIMARY KEY, sql TEXT, params TEXT, '
+          'caller TEXT, plan TEXT, count INTEGER, total_ms REAL, max_ms REAL, last_seen REAL)')
+ORDERINGS = {'total': 'total_ms', 'count': 'count', 'max': 'max_ms', 'mean': 'total_ms / count'}
+
+# The shapes logged and explained by this process, the next ones are only
+# counted
+_seen = set()
+
+
+def qualname(frame):
+    code = frame.f_code
+    if hasattr(code, 'co_qualname'):
+        return code.co_qualname
+    # Before Python 3.11: the class of self or cls, or its base, which
+    # defines the method
+    owner = frame.f_locals.get('self', frame.f_locals.get('cls'))
+    if owner is not None:
+        for klass in (owner if isinstance(owner, type) else type(owner)).__mro__:
+            # The function of a method, classmethod or staticmethod
+            function = getattr(klass.__dict__.get(code.co_name), '__func__', klass.__dict__.get(code.co_name))
+            defined = getattr(inspect.unwrap(function), '__code__', None) if callable(function) else None
+            if defined is not None and (defined.co_filename, defined.co_firstlineno) == (
+                    code.co_filename, code.co_firstlineno):
+                return f'{klass.__qualname__}.{code.co_name}'
+    return code.co_name
+
+
+def find_caller():
+    '''Qualified name and location of the innermost function of the app
+    which ran the query, e.g. Category.get_balance_from_category'''
+    frame = inspect.currentframe()
+    try:
+        while frame is not None:
+            module = frame.f_globals.get('__name__', '')
+            if module.startswith('tracker.') and module not in INTERNALS:
+                code = frame.f_code
+                path = os.path.relpath(code.co_filename, settings.BASE_DIR)
+                return f'{qualname(frame)} ({path}:{frame.f_lineno})'
+            frame = frame.f_back
+        return None
+    finally:
+        del frame
+
+
+def explain(connection, sql, params):
+    '''The query plan of the backend, with a cursor which bypasses the
+    execute wrappers'''
+    if not sql.lstrip().upper().startswith(EXPLAINED):
+        return None
+    try:
+        cursor = connection.create_cursor()
+        try:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            return '\n'.join(' '.join(str(value) for value in row) for row in cursor.fetchall())
+        finally:
+            cursor.close()
+    except (DatabaseError, NotImplementedError) as exc:
+        return f'{type(exc).__name__}: {exc}'
+
+
+def log_slow_queries(execute, sql, params, many, context):
+    threshold = settings.SLOW_QUERY_MS
+    if threshold is None or sql.startswith(TRANSACTION_CONTROL):
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    result = execute(sql, params, many, context)
+    duration = (time.perf_counter() - started) * 1000
+    if duration >= threshold:
+        # executemany() is explained with its first parameters
+        if many:
+            params = next(iter(params), None)
+        record(context['connection'], sql, params, duration)
+    return result
+
+
+def record(connection, sql, params, duration):
+    key, plan = shape(sql), None
+    caller = find_caller()
+    if key not in _seen:
+        _seen.add(key)
+        plan = explain(connection, sql, params)
+        logger.warning('Slow query (%.1f ms) from %s: %s\nParameters: %r\nPlan:\n%s',
+                       duration, caller, sql, params, plan)
+    store(key, sql, params, caller, plan, duration)
+
+
+def store(key, sql, params, caller, plan, duration):
+    '''Count the query in the SQLite file of the metrics, the first SQL,
+    parameters and plan of a shape are kept'''
+    if not metrics.REGISTRY.path:
+        return
+    try:
+        connection = metrics.REGISTRY.connection()
+        with connection:
+            connection.execute(SCHEMA)
+            connection.execute(
+                'INSERT INTO slow_queries VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?) ON CONFLICT (shape) DO UPDATE SET '
+                'count = count + 1, total_ms = total_ms + excluded.total_ms, '
+                'max_ms = max(max_ms, excluded.max_ms), last_seen = excluded.last_seen, '
+                'plan = coalesce(plan, excluded.plan)',
+                (key, sql, json.dumps(params, default=str), caller, plan, duration, duration, time.time()))
+    except sqlite3.Error:
+        pass
+
+
+def worst(order='total', limit=10):
+    '''The slow query shapes as dicts, the worst first'''
+    if not metrics.REGISTRY.path:
+        return []
+    connection = metrics.REGISTRY.connection()
+    connection.execute(SCHEMA)
+    cursor = connection.execute(
+        f'SELECT shape, sql, params, caller, plan, count, total_ms, max_ms, last_seen FROM slow_queries '
+        f'ORDER BY {ORDERINGS[order]} DESC LIMIT ?', (limit,))
+    columns = [column[0] for column in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def clear():
+    _seen.clear()
+    if metrics.REGISTRY.path:
+        connection = metrics.REGISTRY.connection()
+        connection.execute(SCHEMA)
+        connection.execute('DELETE FROM slow_queries')
+
+
+def install(sender, connection, **kwargs):
+    '''connection_created receiver, the queries slower than
+    settings.SLOW_QUERY_MS are logged with their plan'''
+    if log_slow_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(log_slow_queries)
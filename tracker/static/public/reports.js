@@ -7,7 +7,7 @@ const dateLocaleOptions = {
 };
 ready(() => {
 	let dailyExpenseCtx = document.getElementById("daily-expense-chart");
-	djangoCall("/api/reports", {}, "GET").then((result) => {
+	const drawDailyExpense = (result) => {
 		let amounts = result.amounts.map((a) => Math.abs(a));
 		let time = result.time.map((t) => new Date(t).toLocaleDateString("en", dateLocaleOptions));
 		let maxAmount = Math.max(...amounts);
@@ -40,10 +40,10 @@ ready(() => {
 				},
 			},
 		});
-	});
+	};
 
 	let dailyIncomeCtx = document.getElementById("daily-income-chart");
-	djangoCall("/api/reports?source=income", {}, "GET").then((result) => {
+	const drawDailyIncome = (result) => {
 		let amounts = result.amounts.map((a) => Math.abs(a));
 		let time = result.time.map((t) => new Date(t).toLocaleDateString("en", dateLocaleOptions));
 		let maxAmount = Math.max(...amounts);
@@ -76,10 +76,10 @@ ready(() => {
 				},
 			},
 		});
-	});
+	};
 
 	let expenseCtx = document.getElementById("expense-chart");
-	djangoCall("/api/category", {}, "GET").then((result) => {
+	const drawExpense = (result) => {
 		let expenseChart = new Chart(expenseCtx, {
 			type: "pie",
 			data: {
@@ -100,10 +100,10 @@ ready(() => {
 				},
 			},
 		});
-	});
+	};
 
 	let incomeCtx = document.getElementById("income-chart");
-	djangoCall("/api/category?source=income", {}, "GET").then((result) => {
+	const drawIncome = (result) => {
 		let incomeChart = new Chart(incomeCtx, {
 			type: "pie",
 			data: {
@@ -124,5 +124,19 @@ ready(() => {
 				},
 			},
 		});
+	};
+
+	// The four charts are fetched with one request, the daily series come
+	// from the dashboard
+	djangoCall(
+		"/api/batch",
+		{ requests: ["/api/dashboard", "/api/category", "/api/category?source=income"] },
+		"POST"
+	).then((result) => {
+		let [dashboard, expense, income] = result.responses;
+		drawDailyExpense({ time: dashboard.daily.time, amounts: dashboard.daily.expense });
+		drawDailyIncome({ time: dashboard.daily.time, amounts: dashboard.daily.income });
+		drawExpense(expense);
+		drawIncome(income);
 	});
 });
@@ -1,13 +1,21 @@
 /** @jsx createElement */
 /*** @jsxFrag createFragment */
 const { fadeIn, notify, ready, djangoCall, createElement, appendChild, createFragment } = vanjs;
-const updateBalance = () => {
-	djangoCall("/api/balance", {}, "GET").then((data) => {
+const updateDashboard = () => {
+	djangoCall("/api/dashboard", {}, "GET").then((data) => {
 		if (!data.error) {
-			let balanceValueElm = document.querySelector("#balance-value");
-			balanceValueElm.textContent = `$${data.balance}`;
-			balanceValueElm.classList.add("animate__animated", "animate__fadeIn");
-			balanceValueElm.addEventListener("animationend", () => balanceValueElm.classList.remove("animate__animated", "animate__fadeIn"));
+			[
+				["#balance-value", data.balance],
+				["#income-value", data.income],
+				["#expense-value", data.expense],
+			].forEach(([selector, value]) => {
+				let valueElm = document.querySelector(selector);
+				let text = `$${value.toFixed(2)}`;
+				if (valueElm.textContent !== text) {
+					valueElm.textContent = text;
+					fadeIn(valueElm);
+				}
+			});
 		} else notify(data.error, "danger");
 	});
 };
@@ -20,24 +28,11 @@ const bindRevemoveTransactions = (elms) => {
 				djangoCall("/api/transaction", { transaction_id: transactionID }, "DELETE").then((data) => {
 					if (!data.error) {
 						let transactionElm = document.querySelector(`#transaction-${transactionID}`);
-						let expenseValueElm = document.querySelector("#expense-value");
-						let incomeValueElm = document.querySelector("#income-value");
 						/*
 						 ** As the transactions.js would be used across pages, so there is a mechnism to check if it should update balance on index page as it should.
 						 ** The solution is to test if div IDs on index page available or not.
 						 */
-						if (expenseValueElm && incomeValueElm) {
-							let transactionValueElm = document.querySelector(`#transaction-${transactionID} .transaction-value`);
-							let transactionValue = parseFloat(transactionValueElm.textContent.replace("$", "").trim());
-							if (transactionValue > 0) {
-								incomeValueElm.textContent = `$${parseFloat(incomeValueElm.textContent.replace("$", "").trim()) - transactionValue}`;
-								fadeIn(incomeValueElm);
-							} else if (transactionValue < 0) {
-								expenseValueElm.textContent = `$${parseFloat(expenseValueElm.textContent.replace("$", "").trim()) - transactionValue}`;
-								fadeIn(incomeValueElm);
-							}
-							updateBalance();
-						}
+						if (document.querySelector("#balance-value")) updateDashboard();
 						transactionElm.classList.add("animate__animated", "animate__fadeOut");
 						transactionElm.addEventListener("animationend", () => transactionElm.remove());
 						notify(data.message);
@@ -49,14 +44,15 @@ const bindRevemoveTransactions = (elms) => {
 };
 
 let isFetching = false;
-let nextPage = 2;
-const loadMoreTransactions = (page) => {
+let nextCursor = null;
+const TRANSACTIONS_PER_PAGE = 5;
+const loadMoreTransactions = (cursor) => {
 	isFetching = true;
-	djangoCall(`/api/transactions?page=${page}`, {}, "GET").then((data) => {
+	djangoCall(`/api/transactions?cursor=${encodeURIComponent(cursor)}&limit=${TRANSACTIONS_PER_PAGE}`, {}, "GET").then((data) => {
 		if (!data.error) {
 			const UsingFragment = (
 				<div>
-					{data.map((t) => (
+					{data.transactions.map((t) => (
 						<div id={`transaction-${t.id}`} class={`bg-white p-0 my-1 p-1 ${t.source == "income" ? "transaction-income" : "transaction-expense"}`}>
 							<div class='d-flex'>
 								<div class='p-1 w-75 bd-highlight'>{t.text}</div>
@@ -79,13 +75,17 @@ const loadMoreTransactions = (page) => {
 				</div>
 			);
 			document.querySelector("#transactions").appendChild(UsingFragment);
+			bindRevemoveTransactions(UsingFragment.querySelectorAll(".remove-transaction"));
+			nextCursor = data.next_cursor;
 		} else {
-			// notify(data.error, "danger");
+			notify(data.error, "danger");
+			nextCursor = null;
+		}
+		if (!nextCursor) {
 			let elmMore = document.querySelector("#more");
 			elmMore && elmMore.remove();
 			document.querySelector("#more-container").textContent = "The End !";
 		}
-		nextPage++;
 		isFetching = false;
 	});
 };
@@ -94,12 +94,10 @@ ready(() => {
 	bindRevemoveTransactions(document.querySelectorAll(".remove-transaction"));
 	let moreElm = document.querySelector("#more");
 	if (moreElm) {
-		moreElm.addEventListener("click", () => loadMoreTransactions(nextPage));
+		nextCursor = moreElm.dataset.cursor;
+		moreElm.addEventListener("click", () => nextCursor && !isFetching && loadMoreTransactions(nextCursor));
 		window.onscroll = () => {
-			window.innerHeight + window.scrollY >= document.body.offsetHeight &&
-				document.querySelector("#more-container").textContent != "The End !" &&
-				!isFetching &&
-				loadMoreTransactions(nextPage);
+			window.innerHeight + window.scrollY >= document.body.offsetHeight && nextCursor && !isFetching && loadMoreTransactions(nextCursor);
 		};
 	}
 });
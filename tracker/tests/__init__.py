@@ -2,3 +2,12 @@ from tracker.tests.models import *
 from tracker.tests.views import *
 from tracker.tests.forms import *
 from tracker.tests.api import *
+from tracker.tests.commands import *
+from tracker.tests.importers import *
+from tracker.tests.analytics import *
+from tracker.tests.cache import *
+from tracker.tests.serializers import *
+from tracker.tests.queries import *
+from tracker.tests.profiling import *
+from tracker.tests.metrics import *
+from tracker.tests.slow_queries import *
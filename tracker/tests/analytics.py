@@ -0,0 +1,77 @@
+import datetime
+import numpy as np
+from django.test import override_settings
+from tracker import analytics, importers
+from tracker.models import Category
+from tracker.tests.base import BaseTestCase
+
+
+def day(month, day):
+    return datetime.datetime(2021, month, day, 12, tzinfo=datetime.timezone.utc)
+
+
+class AnalyticsTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        Category(title='Jobs', user=self.user).save()
+        Category(title='Utilities', source='expense', user=self.user).save()
+        importers.import_transactions(self.user, [
+            {'text': 'Salary', 'amount': 1000,
+                'category': 'Jobs', 'created': day(4, 1)},
+            {'text': 'Gas', 'amount': 10,
+                'category': 'Utilities', 'created': day(4, 1)},
+            {'text': 'Coffee', 'amount': -20,
+                'category': None, 'created': day(4, 3)},
+            {'text': 'Water', 'amount': 30,
+                'category': 'Utilities', 'created': day(5, 1)},
+            {'text': 'Power', 'amount': 40,
+                'category': 'Utilities', 'created': day(5, 2)},
+        ])
+
+    def test_ledger(self):
+        ledger = analytics.Ledger.load(self.user.id)
+        self.assertEqual(len(ledger), 5)
+        self.assertEqual(sorted(ledger.amounts.tolist()),
+                         [-4000, -3000, -2000, -1000, 100000])
+        expenses = ledger.select('expense')
+        dates, averages = expenses.rolling_average(2)
+        self.assertEqual(str(dates[0]), '2021-04-01')
+        self.assertEqual(len(dates), 32)
+        self.assertEqual(averages[:4].tolist(), [-1000, -500, -1000, -1000])
+        self.assertEqual(averages[-2:].tolist(), [-1500, -3500])
+        self.assertEqual(analytics.Ledger.load(self.user2.id).amounts.size, 0)
+
+    @override_settings(TIME_ZONE='America/New_York')
+    def test_local_dates(self):
+        # The offset changes during the UTC day of 2021-11-07 (end of DST)
+        created = np.array(['2021-05-01T02:00', '2021-05-01T12:00', '2021-01-01T04:59',
+                            '2021-11-07T03:30', '2021-11-07T04:30', '2021-11-07T05:30'], dtype='datetime64[us]')
+        self.assertEqual([str(d) for d in analytics.to_local_dates(created)],
+                         ['2021-04-30', '2021-05-01', '2020-12-31', '2021-11-06', '2021-11-07', '2021-11-07'])
+
+    def test_insights(self):
+        insights = analytics.insights(self.user, window=2)
+        self.assertEqual(insights['monthly'], {
+            'time': ['2021-04', '2021-05'], 'amounts': [-30.0, -70.0],
+            'deltas': [None, -40.0], 'changes': [None, -1.3333]})
+        self.assertEqual(insights['categories'], {
+            'titles': ['Utilities', 'Uncategorized'], 'amounts': [-80.0, -20.0], 'shares': [0.8, 0.2]})
+        self.assertEqual(insights['percentiles'], {
+                         '50': 25.0, '90': 37.0, '99': 39.7})
+        self.assertEqual(insights['rolling_average']['amounts'][-1], -35.0)
+        insights = analytics.insights(self.user, source='income')
+        self.assertEqual(insights['categories']['titles'], ['Jobs'])
+        self.assertEqual(insights['percentiles']['50'], 1000.0)
+
+    def test_api_insights(self):
+        response = self.client.get('/api/insights?window=30')
+        data = response.json()
+        self.assertEqual(data['rolling_average']['window'], 30)
+        self.assertEqual(data['categories']['amounts'], [-80.0, -20.0])
+        self.assertEqual(self.client.get('/api/insights?window=0').json(),
+                         {'error': 'Invalid window.'})
+        self.assertEqual(self.client.get('/api/insights?source=gifts').json(),
+                         {'error': 'Invalid source.'})
+        self.client.force_login(self.user2)
+        self.assertEqual(self.client.get('/api/insights').json()['monthly'],
+                         {'time': [], 'amounts': [], 'deltas': [], 'changes': []})
@@ -1,6 +1,11 @@
 import json
 import datetime
-from tracker.models import Transaction, Category
+from unittest import mock
+from asgiref.sync import sync_to_async
+from tracker.models import Transaction, Category, DailySummary
+from django.core.cache import cache as django_cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
 from tracker.tests.base import BaseTestCase
 
 
@@ -121,6 +126,49 @@ class ApiTestCase(BaseTestCase):
             {'amounts': [700], 'time': [today.strftime("%Y-%m-%d")]}
         )
 
+    def test_api_report_with_window_and_granularity(self):
+        transaction1 = Transaction(
+            text='income_1', amount=500, user=self.user)
+        transaction2 = Transaction(
+            text='income_2', amount=200, user=self.user)
+        transaction1.save()
+        transaction2.save()
+        Transaction.objects.filter(pk=transaction1.pk).update(
+            created=datetime.datetime(2021, 5, 3, tzinfo=datetime.timezone.utc))
+        Transaction.objects.filter(pk=transaction2.pk).update(
+            created=datetime.datetime(2021, 5, 20, tzinfo=datetime.timezone.utc))
+        DailySummary.rebuild(self.user)
+        response = self.client.get(
+            '/api/reports?source=income&from=2021-01-01&to=2021-12-31&granularity=month')
+        self.assertJSONEqual(
+            str(response.content, encoding='utf8'),
+            {'amounts': [700], 'time': ['2021-05-01']}
+        )
+        response = self.client.get(
+            '/api/reports?source=income&from=2021-05-01&to=2021-05-10')
+        self.assertJSONEqual(
+            str(response.content, encoding='utf8'),
+            {'amounts': [500], 'time': ['2021-05-03']}
+        )
+        # Default window is the last 7 days
+        response = self.client.get('/api/reports?source=income')
+        self.assertJSONEqual(
+            str(response.content, encoding='utf8'),
+            {'amounts': [], 'time': []}
+        )
+
+    def test_api_report_with_invalid_parameters(self):
+        response = self.client.get('/api/reports?granularity=decade')
+        self.assertJSONEqual(
+            str(response.content, encoding='utf8'),
+            {'error': 'Invalid granularity.'}
+        )
+        response = self.client.get('/api/reports?from=yesterday')
+        self.assertJSONEqual(
+            str(response.content, encoding='utf8'),
+            {'error': 'Invalid date.'}
+        )
+
     def test_api_remove_transaction(self):
         cat_income = Category(title='Interest', user=self.user)
         cat_expense = Category(
@@ -293,3 +341,292 @@ class ApiTestCase(BaseTestCase):
         self.assertEqual(json.loads(response.content)[0]['text'], 'income10')
         self.assertEqual(json.loads(response.content)
                          [0]['category_title'], 'Interest')
+
+    def test_get_transactions_with_cursor(self):
+        for i in range(1, 12):
+            Transaction(text=f'income{i}', amount=50*i, user=self.user).save()
+        # Transactions created at the same time are ordered by id
+        Transaction.objects.filter(text__in=['income5', 'income6']).update(
+            created=datetime.datetime(2021, 5, 3, tzinfo=datetime.timezone.utc))
+        response = self.client.get('/api/transactions', {'limit': 4})
+        data = json.loads(response.content)
+        self.assertEqual([t['text'] for t in data['transactions']], [
+                         'income11', 'income10', 'income9', 'income8'])
+        self.assertEqual(data['transactions'][0]['amount'], 50 * 11)
+        texts = []
+        while data['next_cursor']:
+            with self.assertNumQueries(3):
+                response = self.client.get(
+                    '/api/transactions', {'cursor': data['next_cursor'], 'limit': 4})
+            data = json.loads(response.content)
+            texts += [t['text'] for t in data['transactions']]
+        self.assertEqual(texts, ['income7', 'income4', 'income3',
+                                 'income2', 'income1', 'income6', 'income5'])
+
+    def test_get_transactions_with_invalid_cursor(self):
+        response = self.client.get('/api/transactions', {'cursor': 'abc'})
+        self.assertJSONEqual(
+            str(response.content, encoding='utf8'),
+            {'error': 'Invalid cursor.'}
+        )
+        response = self.client.get('/api/transactions', {'limit': 0})
+        self.assertJSONEqual(
+            str(response.content, encoding='utf8'),
+            {'error': 'Invalid limit.'}
+        )
+        response = self.client.get('/api/transactions', {'limit': 10})
+        self.assertJSONEqual(
+            str(response.content, encoding='utf8'),
+            {'transactions': [], 'next_cursor': None}
+        )
+
+    def test_api_import_transactions(self):
+        Category(title='Jobs', user=self.user).save()
+        csv_file = SimpleUploadedFile(
+            'statement.csv', b'date,text,amount,category\n2021-05-03,Salary,1000,Jobs\n2021-05-04,Coffee,-3.5,\n')
+        response = self.client.post(
+            '/api/transactions/import', {'file': csv_file})
+        self.assertJSONEqual(
+            str(response.content, encoding='utf8'),
+            {'message': '2 transactions are imported.'}
+        )
+        self.assertEqual(self.user.get_balance(), 996.5)
+        ofx_file = SimpleUploadedFile(
+            'statement.txt', b'<STMTTRN><DTPOSTED>20210505<TRNAMT>-5000<NAME>Car</STMTTRN>')
+        response = self.client.post(
+            '/api/transactions/import', {'file': ofx_file, 'format': 'ofx'})
+        self.assertJSONEqual(
+            str(response.content, encoding='utf8'),
+            {'error': 'Your balance is insufficient.'}
+        )
+        response = self.client.post('/api/transactions/import', {'file': SimpleUploadedFile(
+            'statement.csv', 'text,amount\nCafé,3\n'.encode('latin-1'))})
+        self.assertJSONEqual(
+            str(response.content, encoding='utf8'),
+            {'error': 'The file should be UTF-8 encoded.'}
+        )
+        response = self.client.get('/api/transactions/import')
+        self.assertJSONEqual(
+            str(response.content, encoding='utf8'),
+            {'error': 'You are not authorized.'}
+        )
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=10)
+    def test_api_import_large_file(self):
+        # Uploads over FILE_UPLOAD_MAX_MEMORY_SIZE are streamed from a temporary file
+        rows = ''.join(f'income{i},{i}\n' for i in range(1, 101))
+        response = self.client.post('/api/transactions/import', {'file': SimpleUploadedFile(
+            'statement.csv', f'text,amount\n{rows}'.encode())})
+        self.assertJSONEqual(
+            str(response.content, encoding='utf8'),
+            {'message': '100 transactions are imported.'}
+        )
+
+    def test_api_export_transactions(self):
+        cat_expense = Category(
+            title='Utilities', source='expense', user=self.user)
+        cat_expense.save()
+        Transaction(text='income_1', amount=500, user=self.user,
+                    created=datetime.datetime(2021, 5, 3, tzinfo=datetime.timezone.utc)).save()
+        Transaction(text='expense, with comma', amount=100, category=cat_expense, user=self.user,
+                    created=datetime.datetime(2021, 5, 4, tzinfo=datetime.timezone.utc)).save()
+        Transaction(text='other user', amount=100, user=self.user2).save()
+        response = self.client.get('/api/transactions/export')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(
+            response['Content-Disposition'], 'attachment; filename="transactions.csv"')
+        # The header is sent before the transactions are queried
+        with self.assertNumQueries(0):
+            header = next(response.streaming_content)
+        self.assertEqual(header, b'date,text,amount,category,source\r\n')
+        with self.assertNumQueries(1):
+            content = b''.join(response.streaming_content).decode()
+        self.assertEqual(content,
+                         '2021-05-04T00:00:00+00:00,"expense, with comma",-100.00,Utilities,expense\r\n'
+                         '2021-05-03T00:00:00+00:00,income_1,500.00,,income\r\n')
+
+        response = self.client.get('/api/transactions/export?format=jsonl')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(json.loads(lines[1]), {'date': '2021-05-03T00:00:00+00:00', 'text': 'income_1',
+                                                'amount': 500.0, 'category': '', 'source': 'income'})
+
+        response = self.client.get('/api/transactions/export?format=xml')
+        self.assertJSONEqual(
+            str(response.content, encoding='utf8'),
+            {'error': 'Unsupported format.'}
+        )
+        response = self.client.post('/api/transactions/export')
+        self.assertJSONEqual(
+            str(response.content, encoding='utf8'),
+            {'error': 'You are not authorized.'}
+        )
+
+
+class AsyncApiTestCase(BaseTestCase):
+    async def test_async_client_export(self):
+        # The streaming content is iterated on the event loop, where the
+        # rows can not be fetched
+        await sync_to_async(Transaction.objects.create)(text='Salary', amount=500, user=self.user)
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get('/api/transactions/export')
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('Salary,500.00', lines[1])
+
+    async def test_async_client_export_limit(self):
+        await sync_to_async(Transaction.objects.create)(text='Salary', amount=500, user=self.user)
+        await sync_to_async(Transaction.objects.create)(text='Lunch', amount=-10, user=self.user)
+        await sync_to_async(self.async_client.force_login)(self.user)
+        with mock.patch('tracker.exporters.ASGI_MAX_ROWS', 1):
+            response = await self.async_client.get('/api/transactions/export')
+        self.assertFalse(response.streaming)
+        self.assertIn('error', json.loads(response.content))
+
+    async def test_async_client(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get('/api/balance')
+        self.assertJSONEqual(str(response.content, encoding='utf8'), {'balance': 0.0})
+        response = await self.async_client.post('/api/balance')
+        self.assertJSONEqual(str(response.content, encoding='utf8'), {'error': 'You are not authorized.'})
+        await sync_to_async(self.async_client.logout)()
+        response = await self.async_client.get('/api/balance')
+        self.assertJSONEqual(str(response.content, encoding='utf8'), {'error': 'You are not authenticated.'})
+
+
+class BatchApiTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        category = Category(title='Jobs', user=self.user)
+        category.save()
+        Transaction(text='income_1', amount=500,
+                    category=category, user=self.user).save()
+        Transaction(text='expense_1', amount=-200, user=self.user).save()
+
+    def batch(self, urls):
+        response = self.client.post(
+            '/api/batch', json.dumps({'requests': urls}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_batch(self):
+        urls = ['/api/reports', '/api/reports?source=income',
+                '/api/category', '/api/category?source=income', '/api/balance']
+        expected = [json.loads(self.client.get(url).content) for url in urls]
+        self.assertEqual(self.batch(urls), {'responses': expected})
+        # One session and user lookup for the whole batch, the results are
+        # cached
+        with self.assertNumQueries(2):
+            self.assertEqual(self.batch(urls + urls), {'responses': expected + expected})
+
+    def test_batch_errors(self):
+        self.assertEqual(self.batch(['/api/reports?granularity=decade', '/api/transactions/export',
+                                     '/api/transaction', '/unknown', 'http://']), {'responses': [
+            {'error': 'Invalid granularity.'}, {'error': 'Invalid request.'},
+            {'error': 'Invalid request.'}, {'error': 'Invalid request.'}, {'error': 'Invalid request.'}]})
+        # An exception of a part only fails that part
+        with self.assertLogs('tracker.api', 'ERROR') as logs:
+            self.assertEqual(self.batch(['/api/transactions?page=x', '/api/balance']), {'responses': [
+                {'error': 'The request failed.'}, {'balance': 300.0}]})
+        self.assertIn('Batched request failed: /api/transactions?page=x', logs.output[0])
+        self.assertEqual(self.batch(['/api/balance'] * 21),
+                         {'error': 'At most 20 requests can be batched.'})
+        self.assertEqual(self.batch('/api/balance'), {'error': 'Invalid batch.'})
+        response = self.client.post('/api/batch', 'nope', content_type='application/json')
+        self.assertJSONEqual(str(response.content, encoding='utf8'), {'error': 'Invalid batch.'})
+        response = self.client.get('/api/batch')
+        self.assertJSONEqual(str(response.content, encoding='utf8'), {'error': 'You are not authorized.'})
+        self.client.logout()
+        response = self.client.post('/api/batch', 'nope', content_type='application/json')
+        self.assertJSONEqual(str(response.content, encoding='utf8'), {'error': 'You are not authenticated.'})
+
+
+class DashboardApiTestCase(BaseTestCase):
+    def test_dashboard(self):
+        Transaction(text='income_1', amount=500, user=self.user).save()
+        Transaction(text='expense_1', amount=-200.5, user=self.user).save()
+        response = self.client.get('/api/dashboard?days=2')
+        today = datetime.date.today()
+        self.assertJSONEqual(str(response.content, encoding='utf8'), {
+            'balance': 299.5, 'income': 500.0, 'expense': -200.5, 'count': 2,
+            'daily': {'time': [str(today - datetime.timedelta(days=1)), str(today)],
+                      'income': [0.0, 500.0], 'expense': [0.0, -200.5]}})
+        for days in ('0', '32', 'week'):
+            response = self.client.get(f'/api/dashboard?days={days}')
+            self.assertJSONEqual(str(response.content, encoding='utf8'), {'error': 'Invalid days.'})
+        response = self.client.post('/api/dashboard')
+        self.assertJSONEqual(str(response.content, encoding='utf8'), {'error': 'You are not authorized.'})
+
+    def test_index_query_budget(self):
+        category = Category(title='Jobs', user=self.user)
+        category.save()
+        for i in range(6):
+            Transaction(text=f'income_{i}', amount=100, category=category, user=self.user).save()
+        # Session, user, dashboard aggregate, last transactions with their
+        # category and the categories of the form, whatever the number of
+        # transactions
+        with self.assertNumQueries(5):
+            response = self.client.get('/')
+        self.assertContains(response, '$600.00')
+        self.assertContains(response, 'More')
+
+
+class ETagApiTestCase(BaseTestCase):
+    def test_not_modified(self):
+        Transaction(text='income_1', amount=500, user=self.user).save()
+        response = self.client.get('/api/balance')
+        etag = response['ETag']
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        # Only the session and the user are read
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/balance', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+        for url in ('/api/reports', '/api/category?source=income', '/api/dashboard', '/api/insights'):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304, url)
+
+        # Any write of the user changes the ETag
+        Transaction(text='income_2', amount=100, user=self.user).save()
+        response = self.client.get('/api/balance', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONEqual(str(response.content, encoding='utf8'), {'balance': 600.0})
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+        Category(title='Jobs', user=self.user).save()
+        self.assertEqual(self.client.get('/api/category', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        # But not the writes of the other users
+        etag = self.client.get('/api/balance')['ETag']
+        Transaction(text='income_1', amount=500, user=self.user2).save()
+        self.assertEqual(self.client.get('/api/balance', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_etag_of_another_process(self):
+        etag = self.client.get('/api/balance')['ETag']
+        # A write of another server process, whose cache is not this one,
+        # changes the ETag, and the ETag outlives the cache
+        with mock.patch('tracker.cache.invalidate'):
+            Transaction(text='income_1', amount=500, user=self.user).save()
+        # The body is not the one cached before the write
+        response = self.client.get('/api/balance', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertJSONEqual(str(response.content, encoding='utf8'), {'balance': 500.0})
+        self.assertNotEqual(response['ETag'], etag)
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/api/balance', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        django_cache.clear()
+        self.assertEqual(self.client.get('/api/balance', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        response = self.client.get('/api/balance')
+        self.assertEqual((response['ETag'], json.loads(response.content)), (etag, {'balance': 500.0}))
+
+    def test_etag_only_on_read_views(self):
+        etag = self.client.get('/api/balance')['ETag']
+        self.assertFalse(self.client.get('/api/transactions').has_header('ETag'))
+        self.assertFalse(self.client.get('/api/avatar').has_header('ETag'))
+        response = self.client.post('/api/batch', json.dumps({'requests': ['/api/balance']}),
+                                    content_type='application/json', HTTP_IF_NONE_MATCH=etag)
+        self.assertJSONEqual(str(response.content, encoding='utf8'), {'responses': [{'balance': 0.0}]})
+        self.client.logout()
+        response = self.client.get('/api/balance', HTTP_IF_NONE_MATCH=etag)
+        self.assertJSONEqual(str(response.content, encoding='utf8'), {'error': 'You are not authenticated.'})
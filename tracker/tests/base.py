@@ -1,5 +1,10 @@
-from django.test import TestCase
+import os
+import tempfile
+from urllib.parse import urlsplit
+from django.test import TestCase, override_settings
+from django.urls import resolve
 from tracker.models import User
+from tracker.queries import capture_queries, get_budget
 
 
 class BaseTestCase(TestCase):
@@ -12,3 +17,40 @@ class BaseTestCase(TestCase):
         user2 = User.objects.create_user(
             'red', 'dangtruong@gmail.com', '123456')
         self.user2 = user2
+
+    def use_metrics_db(self):
+        '''Turn the metrics on for the test, in a temporary SQLite file'''
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(METRICS_DB=os.path.join(directory.name, 'metrics.sqlite3'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def use_temporary_media(self):
+        '''Write the uploads and avatars of the test in a temporary
+        MEDIA_ROOT'''
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(MEDIA_ROOT=directory.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def assertQueryBudget(self, path, method='get', *args, **kwargs):
+        '''Request the path with the test client and fail if the view runs
+        more queries than its query_budget, or repeats a query shape more
+        than allowed (N+1 queries). Return the response.'''
+        view = resolve(urlsplit(path).path).func
+        self.assertIsNotNone(get_budget(view)[0], f'{view.__name__} does not declare a query budget.')
+        with capture_queries() as log:
+            response = getattr(self.client, method)(path, *args, **kwargs)
+            if response.streaming:
+                content = b''.join(response.streaming_content)
+                response.streaming_content = [content]
+        queries, repeats = get_budget(view, log.chunks)
+        listing = '\n'.join(log)
+        self.assertLessEqual(
+            len(log), queries, f'{method.upper()} {path} ran {len(log)} queries, over its budget of {queries}:\n{listing}')
+        repeated = log.repeated(repeats)
+        self.assertFalse(repeated, f'N+1 queries on {method.upper()} {path}:\n' + '\n'.join(
+            f'{count} times {sql}' for sql, count in repeated.items()))
+        return response
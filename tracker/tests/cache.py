@@ -0,0 +1,77 @@
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from tracker import cache, importers
+from tracker.models import Category, Transaction, User
+from tracker.tests.base import BaseTestCase
+
+
+class CacheTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.reset_stats()
+
+    def test_balance_and_stats(self):
+        Transaction(text='income', amount=500, user=self.user).save()
+        self.assertEqual(self.user.get_balance(), 500)
+        self.assertEqual(self.user.get_total_transactions(), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.user.get_balance(), 500)
+            self.assertEqual(self.user.get_total_transactions(), 1)
+            self.assertEqual(self.user.get_total_income(), 500)
+        transaction = Transaction(text='expense', amount=-200, user=self.user)
+        transaction.save()
+        self.assertEqual(self.user.get_balance(), 300)
+        self.assertEqual(self.user.get_total_expense(), -200)
+        transaction.delete()
+        self.assertEqual(self.user.get_balance(), 500)
+        # The other users are not invalidated
+        self.assertEqual(self.user2.get_balance(), 0)
+        Transaction(text='income', amount=100, user=self.user).save()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.user2.get_balance(), 0)
+        self.assertEqual(cache.stats()['balance'], {'hits': 2, 'misses': 4})
+
+    def test_category_report(self):
+        category = Category(title='Utilities', source='expense', user=self.user)
+        category.save()
+        self.assertEqual(self.user.get_report_amount_from_category('expense'),
+                         {'titles': ['Utilities'], 'amounts': [0]})
+        category.title = 'Bills'
+        category.save()
+        Transaction(text='income', amount=500, user=self.user).save()
+        importers.import_transactions(self.user, [
+            {'text': 'Gas', 'amount': -50, 'category': 'Bills', 'created': None}])
+        self.assertEqual(self.user.get_report_amount_from_category('expense'),
+                         {'titles': ['Bills'], 'amounts': [-50]})
+        category.delete()
+        self.assertEqual(self.user.get_report_amount_from_category('expense'),
+                         {'titles': [], 'amounts': []})
+        self.assertEqual(self.user.get_balance(), 500)
+
+    def test_write_of_another_process(self):
+        self.assertEqual(User.objects.select_related('stats').get(pk=self.user.id).get_balance(), 0)
+        # The write of a process which does not share this cache bumps the
+        # data version in the database only
+        with mock.patch('tracker.cache.invalidate'):
+            Transaction(text='income', amount=500, user=self.user).save()
+        self.assertEqual(User.objects.select_related('stats').get(pk=self.user.id).get_balance(), 500)
+
+    def test_invalidate_on_commit(self):
+        version = cache.get_version(self.user.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.invalidate(self.user.id)
+            self.assertEqual(cache.get_version(self.user.id), version + 1)
+        self.assertEqual(cache.get_version(self.user.id), version + 2)
+
+    def test_cache_stats_command(self):
+        # The balance is already cached by the index page of setUp
+        cache.invalidate(self.user.id)
+        self.user.get_balance()
+        self.user.get_balance()
+        out, err = StringIO(), StringIO()
+        call_command('cache_stats', reset=True, stdout=out, stderr=err)
+        self.assertIn('local memory of each process', err.getvalue())
+        self.assertIn('balance: 1 hits, 1 misses (hit rate 50%)', out.getvalue())
+        self.assertIn('insights: 0 hits, 0 misses (hit rate -)', out.getvalue())
+        self.assertEqual(cache.stats()['balance'], {'hits': 0, 'misses': 0})
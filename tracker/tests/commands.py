@@ -0,0 +1,234 @@
+import asyncio
+import json
+import os
+import random
+import tempfile
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import LiveServerTestCase
+from django.utils import timezone
+from tracker.management.commands import bench, loadtest, seed_bench
+from tracker.management.commands.seed_bench import seeded_users
+from tracker.models import Transaction, User, UserStats, DailySummary
+from tracker.money import backfill_cents, to_cents
+from tracker.tests.base import BaseTestCase
+
+
+class CommandsTestCase(BaseTestCase):
+    def test_rebuild_stats(self):
+        Transaction(text='income', amount=500, user=self.user).save()
+        Transaction(text='expense', amount=-200, user=self.user).save()
+        UserStats.objects.filter(user=self.user).update(
+            income=0, expense=0, count=0)
+        out = StringIO()
+        call_command('rebuild_stats', stdout=out)
+        self.assertIn('Rebuilt stats for 2 user(s).', out.getvalue())
+        self.assertEqual(self.user.get_total_income(), 500)
+        self.assertEqual(self.user.get_total_expense(), -200)
+        self.assertEqual(self.user.get_total_transactions(), 2)
+
+    def test_rebuild_stats_is_atomic(self):
+        Transaction(text='income', amount=500, user=self.user).save()
+        UserStats.objects.filter(user=self.user).update(income=0, count=0)
+        with mock.patch.object(DailySummary, 'rebuild', side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            call_command('rebuild_stats', 'blue', stdout=StringIO())
+        # The stats are not rebuilt without the summaries
+        stats = UserStats.objects.get(user=self.user)
+        self.assertEqual((stats.income, stats.count), (0, 0))
+
+    def test_rebuild_daily_summaries(self):
+        Transaction(text='income', amount=500, user=self.user).save()
+        DailySummary.objects.filter(user=self.user).delete()
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_stats', '--verify', stdout=out)
+        self.assertIn('blue: daily summaries differ from the ledger', out.getvalue())
+        call_command('rebuild_stats', 'blue', stdout=out)
+        self.assertEqual(DailySummary.objects.get(user=self.user).amount, 500)
+        call_command('rebuild_stats', '--verify', stdout=out)
+
+    def test_verify_stats(self):
+        Transaction(text='income', amount=500, user=self.user).save()
+        transaction = Transaction(text='expense', amount=-200, user=self.user)
+        transaction.save()
+        transaction.delete()
+        out = StringIO()
+        call_command('rebuild_stats', '--verify', stdout=out)
+        self.assertIn('All stats are consistent.', out.getvalue())
+
+        UserStats.objects.filter(user=self.user).update(count=10)
+        out = StringIO()
+        with self.assertRaisesRegex(CommandError, '1 user\(s\) with inconsistent stats.'):
+            call_command('rebuild_stats', 'blue', '--verify', stdout=out)
+        self.assertIn('blue: stored', out.getvalue())
+
+    def test_bench_indexes(self):
+        out = StringIO()
+        call_command('bench_indexes', rows=500, users=5, repeat=2, stdout=out)
+        output = out.getvalue()
+        self.assertIn('Generated 500 transactions for 5 users.', output)
+        self.assertIn('USING INDEX transaction_user_created_idx', output)
+        self.assertIn('latest transactions:', output)
+
+    def test_bench_analytics(self):
+        out = StringIO()
+        call_command('bench_analytics', rows=500, repeat=1, stdout=out)
+        output = out.getvalue()
+        self.assertIn('Generated 500 transactions for 1 users.', output)
+        self.assertIn('faster than the ORM aggregates', output)
+
+    def test_bench_serializers(self):
+        out = StringIO()
+        call_command('bench_serializers', rows=300,
+                     page_sizes='5,100', repeat=1, stdout=out)
+        output = out.getvalue()
+        self.assertIn('5 rows: models', output)
+        self.assertIn('100 rows: models', output)
+        with self.assertRaisesMessage(CommandError, 'The page sizes should be integers.'):
+            call_command('bench_serializers', rows=10, page_sizes='all', stdout=out)
+
+    def test_bench_avatars(self):
+        out = StringIO()
+        call_command('bench_avatars', repeat=1, stdout=out)
+        output = out.getvalue()
+        self.assertIn('large.jpg (4000x3000): legacy', output)
+        self.assertNotIn('notalllowed.pdf', output)
+
+    def test_backfill_money(self):
+        # The test database is already migrated to integer cents
+        out = StringIO()
+        call_command('backfill_money', stdout=out)
+        self.assertIn('Nothing to backfill', out.getvalue())
+
+    def test_loadtest_fetch(self):
+        async def fetch(response):
+            reader = asyncio.StreamReader()
+            reader.feed_data(response)
+            # Without the end of the stream, as on a keep-alive connection
+            return await asyncio.wait_for(loadtest.fetch(reader, mock.Mock(), b''), 5)
+        self.assertEqual(asyncio.run(fetch(
+            b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+            b'5\r\nhello\r\n6;name=value\r\n world\r\n0\r\nExpires: 0\r\n\r\n')), (200, b'hello world', True))
+        self.assertEqual(asyncio.run(fetch(b'HTTP/1.1 304 Not Modified\r\nETag: "1"\r\n\r\n')), (304, b'', True))
+        self.assertEqual(asyncio.run(fetch(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\n{}')),
+                         (200, b'{}', False))
+
+    def test_backfill_half_cents(self):
+        # The amounts of a float column before the migrations 0010 and 0011
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE backfill_amounts (id INTEGER PRIMARY KEY, amount REAL, amount_cents INTEGER)')
+            cursor.executemany('INSERT INTO backfill_amounts VALUES (%s, %s, %s)', [
+                (1, 10.005, None), (2, -0.015, None), (3, 2.675, None), (4, 1.005, None), (5, 0.125, None),
+                (6, 0.1, None), (7, 10.005, 1000)])
+            self.assertEqual(backfill_cents(connection, 'backfill_amounts', 'amount', 'amount_cents', batch_size=4), 6)
+            cursor.execute('SELECT amount_cents FROM backfill_amounts ORDER BY id')
+            # Rounded half up like the amounts written by the application,
+            # the rows already backfilled are kept
+            self.assertEqual([row[0] for row in cursor.fetchall()], [1001, -2, 268, 101, 13, 10, 1000])
+            cursor.execute('DROP TABLE backfill_amounts')
+        self.assertEqual([to_cents(amount) for amount in (10.005, -0.015, 2.675, 1.005, 0.125, 0.1)],
+                         [1001, -2, 268, 101, 13, 10])
+
+    def test_seed_bench(self):
+        out = StringIO()
+        call_command('seed_bench', users=2, categories=4, transactions=50, seed=1, stdout=out)
+        self.assertIn('Seeded 2 users with 4 categories and 50 transactions each.', out.getvalue())
+        user = User.objects.get(username='bench2')
+        self.assertEqual(user.transactions.count(), 50)
+        self.assertEqual(user.categories.count(), 4)
+        self.assertTrue(self.client.login(username='bench2', password='bench'))
+        # The balance, stats and daily summaries are maintained
+        call_command('rebuild_stats', 'bench1', 'bench2', '--verify', stdout=out)
+        self.assertIn('All stats are consistent.', out.getvalue())
+        with self.assertRaisesMessage(CommandError, 'Users named bench* are already seeded.'):
+            call_command('seed_bench', users=1, stdout=out)
+
+    def test_seed_bench_opening_balance(self):
+        class Expenses(random.Random):
+            # Never an income
+            def random(self):
+                return 0.5
+        rows = seed_bench.Command.generate(Expenses(1), {'income': ['Jobs'], 'expense': ['Food']}, 20,
+                                           timezone.now(), 1)
+        self.assertEqual(sum(row['amount'] for row in rows), seed_bench.OPENING_MARGIN)
+
+    def test_bench(self):
+        with self.assertRaisesMessage(CommandError, 'There is no seeded user, run manage.py seed_bench first.'):
+            call_command('bench', stdout=StringIO())
+        call_command('seed_bench', users=2, categories=4, transactions=20, seed=1, stdout=StringIO())
+        # Even without any income, the expenses of the bench are accepted
+        for user in seeded_users():
+            self.assertGreaterEqual(user.get_balance(), seed_bench.OPENING_MARGIN)
+        count = Transaction.objects.count()
+        out = StringIO()
+        call_command('bench', repeat=3, stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertEqual(results['users'], 2)
+        self.assertEqual(set(results['benchmarks']), set(bench.BENCHMARKS))
+        self.assertEqual(results['benchmarks']['get_balance']['queries'], 1)
+        self.assertLessEqual(results['benchmarks']['get_balance']['p50_ms'],
+                             results['benchmarks']['get_balance']['p95_ms'])
+        # The writes are rolled back
+        self.assertEqual(Transaction.objects.count(), count)
+
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            f.write(out.getvalue())
+        self.addCleanup(os.remove, f.name)
+        out, err = StringIO(), StringIO()
+        call_command('bench', repeat=1, only=['get_balance'], compare=f.name, stdout=out, stderr=err)
+        self.assertEqual(list(json.loads(out.getvalue())['benchmarks']), ['get_balance'])
+        self.assertIn('get_balance: p50', err.getvalue())
+
+    def test_loadtest_arguments(self):
+        with self.assertRaisesMessage(CommandError, 'There is no seeded user, run manage.py seed_bench first.'):
+            call_command('loadtest', url='http://127.0.0.1:8000', stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, 'Invalid URL: ftp://example.com, only http:// URLs'):
+            call_command('loadtest', url='ftp://example.com', stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, 'The concurrency and the number of requests should be positive.'):
+            call_command('loadtest', requests=0, stdout=StringIO())
+
+    def test_loadtest_report(self):
+        out = StringIO()
+        command = loadtest.Command(stdout=out)
+        command.report('WSGI', {}, 1.5)
+        self.assertEqual(out.getvalue(), 'WSGI: no request completed in 1.5s.\n')
+        out.truncate(0)
+        out.seek(0)
+        command.report('ASGI', {'GET index': {'latencies': [0.01, 0.02, 0.03, 0.04], 'errors': 1}}, 2)
+        self.assertEqual(out.getvalue().splitlines(), [
+            'ASGI: 4 requests in 2.0s, 2 requests/s, 1 errors (25.0%)',
+            '    GET index: 4 requests, 2 requests/s, p50 20.0 ms, p95 40.0 ms, p99 40.0 ms, 1 errors',
+            '    all: 4 requests, 2 requests/s, p50 20.0 ms, p95 40.0 ms, p99 40.0 ms, 1 errors',
+        ])
+
+    def test_import_transactions(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('text,amount\nSalary,1000\nCoffee,-3\n')
+        self.addCleanup(os.remove, f.name)
+        out = StringIO()
+        call_command('import_transactions', 'blue',
+                     f.name, chunk_size=1, stdout=out)
+        self.assertIn('2 transactions are imported.', out.getvalue())
+        self.assertEqual(self.user.get_balance(), 997)
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+            f.write('text,amount\nCar,-5000\n')
+        self.addCleanup(os.remove, f.name)
+        with self.assertRaisesRegex(CommandError, 'Your balance is insufficient.'):
+            call_command('import_transactions', 'red', f.name, format='csv')
+        with self.assertRaisesRegex(CommandError, 'Unknown user: green.'):
+            call_command('import_transactions', 'green', f.name)
+
+
+class LoadTestCommandTestCase(LiveServerTestCase):
+    def test_loadtest_url(self):
+        call_command('seed_bench', users=2, categories=2, transactions=30, seed=1, stdout=StringIO())
+        out = StringIO()
+        call_command('loadtest', url=self.live_server_url, requests=30, concurrency=2, warmup=0, stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith(f'{self.live_server_url}: 30 requests'), lines[0])
+        self.assertIn('GET api-transactions: ', out.getvalue())
+        self.assertTrue(lines[-1].endswith(', 0 errors'), lines[-1])
@@ -1,13 +1,29 @@
 import os
+import shutil
+import struct
+import tempfile
+import zlib
+from io import StringIO
+from unittest import mock
 from PIL import Image
 from django.conf import settings
-from tracker.models import User
-from django.test import override_settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from tracker.models import AvatarJob, User, validate_image_size
+from tracker.uploads import SizeLimitUploadHandler
+from tracker.utils import decode_image, render_avatar
+from django.test import Client, override_settings
 from tracker.tests.base import BaseTestCase
 
 
-# Override MEDIA_ROOT so that there is no conflict with the current media folder
-@override_settings(MEDIA_ROOT=f'{os.path.dirname(os.path.dirname(os.path.abspath(__file__)))}/tests/fixtures/media')
+FIXTURES = f'{os.path.dirname(os.path.abspath(__file__))}/fixtures/media'
+
+
+# Override MEDIA_ROOT so that there is no conflict with the current media
+# folder, the tests writing files use a temporary one
+@override_settings(MEDIA_ROOT=FIXTURES)
 class FormsTestCase(BaseTestCase):
     def setUp(self):
         super().setUp()
@@ -35,15 +51,132 @@ class FormsTestCase(BaseTestCase):
         self.assertEqual(user.username, 'blue')
 
     def test_form_upload_avatar(self):
-        with open(f'{settings.MEDIA_ROOT}/test/valid.png', 'rb')as fp:
+        self.use_temporary_media()
+        with open(f'{FIXTURES}/test/valid.png', 'rb')as fp:
             self.client.post(
                 '/account', data={'first_name': 'Truong', 'last_name': 'Phan', 'avatar': fp})
+        # The previous avatar is kept until a worker processes the upload
+        user = User.objects.get(pk=1)
+        self.assertEqual(user.avatar.name, 'avatar.jpg')
+        self.assertEqual(user.first_name, 'Truong')
+        self.assertEqual(self.client.get('/api/avatar').json(),
+                         {'status': 'pending', 'error': '', 'avatar': '/media/avatar.jpg'})
+        self.assertContains(self.client.get('/account'), 'id="avatar-status"')
+        call_command('run_workers', processes=1, once=True, stdout=StringIO())
+        self.assertEqual(self.client.get('/api/avatar').json(),
+                         {'status': 'done', 'error': '', 'avatar': '/media/user_1/avatar/md.png'})
+        self.assertNotContains(self.client.get('/account'), 'id="avatar-status"')
         user = User.objects.get(pk=1)
         img = Image.open(f'{settings.MEDIA_ROOT}/{user.avatar.name}')
         fw, fh = img.size
         self.assertEqual(fw, 128)
         self.assertEqual(fh, 128)
         self.assertEqual(user.avatar.name, 'user_1/avatar/md.png')
+        for name, size in (('sm', 64), ('lg', 256)):
+            with Image.open(f'{settings.MEDIA_ROOT}/user_1/avatar/{name}.png') as img:
+                self.assertEqual(img.size, (size, size))
+
+    def test_render_avatar(self):
+        # 4000x3000 JPEG decoded at 1/8 scale, still larger than 256x256
+        self.assertEqual(decode_image(
+            f'{settings.MEDIA_ROOT}/test/large.jpg', (256, 256)).size, (500, 375))
+        with tempfile.TemporaryDirectory() as directory:
+            written = render_avatar(f'{settings.MEDIA_ROOT}/test/large.jpg', {
+                f'{directory}/sm.jpg': (64, 64), f'{directory}/lg.jpg': (256, 256)})
+            self.assertEqual(written, [f'{directory}/lg.jpg', f'{directory}/sm.jpg'])
+            with Image.open(f'{directory}/sm.jpg') as img:
+                self.assertEqual(img.size, (64, 64))
+
+    def test_avatar_jobs(self):
+        job = AvatarJob.objects.create(user=self.user, upload='test/notrgb.jpeg')
+        self.assertEqual(AvatarJob.claim(), job)
+        # A running job is only claimed again once abandoned
+        self.assertIsNone(AvatarJob.claim())
+        AvatarJob.objects.filter(pk=job.pk).update(
+            started=job.created - AvatarJob.TIMEOUT)
+        self.assertEqual(AvatarJob.claim(), job)
+
+        self.use_temporary_media()
+        with open(f'{FIXTURES}/test/notalllowed.pdf', 'rb') as fp:
+            job = AvatarJob.objects.create(
+                user=self.user2, upload=File(fp, name='avatar.png'))
+        job.run()
+        job.refresh_from_db()
+        self.assertEqual(job.status, AvatarJob.FAILED)
+        self.assertIn('cannot identify image file', job.error)
+        self.assertFalse(os.path.exists(job.upload.path))
+        self.assertEqual(User.objects.get(pk=self.user2.pk).avatar.name, 'avatar.jpg')
+
+    def test_avatar_jobs_of_a_user(self):
+        # Uploads which do not exist, the superseded ones are deleted
+        first = AvatarJob.objects.create(user=self.user, upload='first.png')
+        self.assertEqual(AvatarJob.claim(), first)
+        # The next upload waits for the running job of the user
+        second = AvatarJob.objects.create(user=self.user, upload='second.png')
+        other = AvatarJob.objects.create(user=self.user2, upload='other.png')
+        self.assertEqual(AvatarJob.claim(), other)
+        self.assertIsNone(AvatarJob.claim())
+        # Only the latest upload is run once the first job is abandoned
+        AvatarJob.objects.filter(pk=first.pk).update(started=first.created - AvatarJob.TIMEOUT)
+        self.assertEqual(AvatarJob.claim(), second)
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.error), (AvatarJob.FAILED, 'Superseded by a newer upload.'))
+
+    def test_avatar_job_failing_swap(self):
+        self.use_temporary_media()
+        directory = f'{settings.MEDIA_ROOT}/user_{self.user.id}/avatar'
+        os.makedirs(directory)
+        for name in ('sm', 'md', 'lg', 'full'):
+            with open(f'{directory}/{name}.png', 'wb') as fp:
+                fp.write(name.encode())
+        shutil.copy(f'{FIXTURES}/test/valid.png', f'{settings.MEDIA_ROOT}/upload.png')
+        job = AvatarJob.objects.create(user=self.user, upload='upload.png')
+        replace = os.replace
+
+        def failing_replace(source, target):
+            if target.endswith('sm.png'):
+                raise OSError('No space left on device')
+            replace(source, target)
+        with mock.patch('tracker.models.os.replace', failing_replace):
+            job.run()
+        self.assertEqual(job.status, AvatarJob.FAILED)
+        # The renditions already swapped in are put back, nothing is left
+        for name in ('sm', 'md', 'lg', 'full'):
+            with open(f'{directory}/{name}.png', 'rb') as fp:
+                self.assertEqual(fp.read(), name.encode())
+        self.assertEqual(sorted(os.listdir(directory)), ['full.png', 'lg.png', 'md.png', 'sm.png'])
+
+    def test_upload_size_limit(self):
+        handler = SizeLimitUploadHandler(max_size=10)
+        handler.new_file('avatar', 'avatar.jpg', 'image/jpeg', None)
+        self.assertEqual(handler.receive_data_chunk(b'x' * 8, 0), b'x' * 8)
+        self.assertIsNone(handler.receive_data_chunk(b'x' * 8, 8))
+        self.assertIsNone(handler.receive_data_chunk(b'x' * 8, 16))
+        upload = handler.file_complete(24)
+        self.assertEqual((upload.name, upload.size, upload.read()), ('avatar.jpg', 24, b''))
+
+        with open(f'{settings.MEDIA_ROOT}/test/oversize.jpg', 'rb') as fp:
+            response = self.client.post(
+                '/account', data={'first_name': 'Albert', 'last_name': 'Phan', 'avatar': fp})
+        self.assertContains(
+            response, 'Image size is larger than what is allowed (2048 KBs)', html=True)
+        self.assertFalse(AvatarJob.objects.exists())
+
+        # The CSRF token is still checked
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        response = client.post(
+            '/account', data={'first_name': 'Albert'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_decompression_bomb(self):
+        # A valid PNG header announcing 60000x60000 pixels, without any pixel
+        def chunk(kind, data):
+            return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+        png = b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', 60000, 60000, 8, 2, 0, 0, 0)) + \
+            chunk(b'IDAT', b'') + chunk(b'IEND', b'')
+        with self.assertRaisesMessage(ValidationError, 'Height or Width is larger than what is allowed (1920x1920)'):
+            validate_image_size(SimpleUploadedFile('bomb.png', png))
 
     def test_form_register_new_user(self):
         self.client.post(
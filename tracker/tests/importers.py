@@ -0,0 +1,151 @@
+import io
+import datetime
+from decimal import Decimal
+from django.core.exceptions import ValidationError
+from django.test import override_settings
+from tracker import importers
+from tracker.models import Category, DailySummary, Transaction
+from tracker.tests.base import BaseTestCase
+
+OFX = '''OFXHEADER:100
+DATA:OFXSGML
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN>
+<TRNTYPE>CREDIT
+<DTPOSTED>20210503120000.000[-5:EST]
+<TRNAMT>1500.00
+<NAME>Salary
+</STMTTRN>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20210504<TRNAMT>-45.50<MEMO>Groceries</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+'''
+
+
+class ImportersTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cat_income = Category(title='Jobs', user=self.user)
+        self.cat_expense = Category(
+            title='Utilities', source='expense', user=self.user)
+        self.cat_income.save()
+        self.cat_expense.save()
+
+    def test_parse_csv(self):
+        rows = list(importers.parse_csv(io.StringIO(
+            'date,description,amount,category\n2021-05-03,Salary,1000,Jobs\n,Coffee,-3.5,\n')))
+        self.assertEqual(rows[0], {'text': 'Salary', 'amount': 1000.0, 'category': 'Jobs', 'source': None,
+                                   'created': datetime.datetime(2021, 5, 3, tzinfo=datetime.timezone.utc)})
+        self.assertEqual(rows[1]['category'], None)
+        self.assertEqual(rows[1]['created'], None)
+        with self.assertRaisesRegex(ValidationError, 'Invalid transaction on line 3.'):
+            list(importers.parse_csv(io.StringIO(
+                'text,amount\nSalary,1000\nCoffee,abc\n')))
+
+    def test_import_categories_by_source(self):
+        # The same title for an income and an expense category
+        refunds = Category.objects.create(title='Jobs', source='expense', user=self.user)
+        rows = list(importers.parse_csv(io.StringIO(
+            'date,text,amount,category,source\n2021-05-03,Salary,1000,Jobs,income\n'
+            '2021-05-04,Agency fee,-50,Jobs,expense\n2021-05-05,Gas,-20,Utilities,\n')))
+        # Without the source column, the sign of the amount decides
+        rows.append({'text': 'Bonus', 'amount': 200, 'category': 'Jobs', 'created': None})
+        importers.import_transactions(self.user, rows)
+        self.assertEqual(sorted(Transaction.objects.filter(category=self.cat_income).values_list('text', flat=True)),
+                         ['Bonus', 'Salary'])
+        self.assertEqual(Transaction.objects.get(category=refunds).text, 'Agency fee')
+        self.assertEqual(Transaction.objects.get(category=self.cat_expense).text, 'Gas')
+        with self.assertRaisesRegex(ValidationError, 'Invalid transaction on line 2.'):
+            list(importers.parse_csv(io.StringIO('text,amount,category,source\nSalary,1000,Jobs,gift\n')))
+
+    def test_parse_amounts(self):
+        rows = list(importers.parse_csv(io.StringIO('text,amount\nLunch,10.005\nTip,-0.015\n')))
+        self.assertEqual([str(row['amount']) for row in rows], ['10.01', '-0.02'])
+        for amount in ('NaN', 'sNaN', '-Infinity', '1e999999'):
+            with self.assertRaisesRegex(ValidationError, 'Invalid transaction on line 3.'):
+                list(importers.parse_csv(io.StringIO(f'text,amount\nLunch,1\nTip,{amount}\n')))
+        with self.assertRaisesRegex(ValidationError, 'The amount on line 2 should be at least a cent.'):
+            list(importers.parse_csv(io.StringIO('text,amount\nTip,0.004\n')))
+        with self.assertRaisesRegex(ValidationError, 'Invalid transaction #1.'):
+            list(importers.parse_ofx(io.StringIO('<STMTTRN><TRNAMT>NaN</STMTTRN>')))
+        with self.assertRaisesRegex(ValidationError, 'The amount of transaction #1 should be at least a cent.'):
+            list(importers.parse_ofx(io.StringIO('<STMTTRN><TRNAMT>-0.001</STMTTRN>')))
+
+    def test_parse_ofx(self):
+        # A tiny block size checks records split across blocks
+        rows = list(importers.parse_ofx(io.StringIO(OFX), block_size=16))
+        self.assertEqual(rows, [
+            {'text': 'Salary', 'amount': 1500.0, 'category': None, 'source': None,
+             'created': datetime.datetime(2021, 5, 3, 12, tzinfo=datetime.timezone.utc)},
+            {'text': 'Groceries', 'amount': -45.5, 'category': None, 'source': None,
+             'created': datetime.datetime(2021, 5, 4, tzinfo=datetime.timezone.utc)},
+        ])
+        with self.assertRaisesRegex(ValidationError, 'Invalid transaction #1.'):
+            list(importers.parse_ofx(io.StringIO(
+                '<STMTTRN><NAME>x</STMTTRN>')))
+
+    def test_parse_unsupported_format(self):
+        self.assertEqual(importers.detect_format('statement.OFX'), 'ofx')
+        self.assertEqual(importers.detect_format('statement.pdf'), None)
+        with self.assertRaisesRegex(ValidationError, 'Unsupported format: None.'):
+            importers.parse(io.StringIO(''), None)
+
+    def test_import_transactions(self):
+        created = datetime.datetime(2021, 5, 3, tzinfo=datetime.timezone.utc)
+        rows = [{'text': 'Salary', 'amount': 1000, 'category': 'Jobs', 'created': created},
+                {'text': 'Gas', 'amount': 100, 'category': 'Utilities',
+                    'created': created},
+                {'text': 'Coffee', 'amount': -5, 'category': None, 'created': None}]
+        with self.assertNumQueries(9):
+            # Categories, savepoint and its release, the insert, the balance,
+            # 2 stats updates and the daily summaries read and insert
+            imported = importers.import_transactions(
+                self.user, rows, chunk_size=3)
+        self.assertEqual(imported, 3)
+        self.assertEqual(self.user.get_balance(), 895)
+        self.assertEqual(self.user.get_total_income(), 1000)
+        self.assertEqual(self.user.get_total_expense(), -105)
+        self.assertEqual(self.user.get_total_transactions(), 3)
+        gas = Transaction.objects.get(text='Gas')
+        self.assertEqual((gas.amount, gas.source, gas.created),
+                         (-100, 'expense', created))
+        self.assertEqual(DailySummary.objects.get(
+            user=self.user, category=self.cat_income).amount, 1000)
+        # Importing again the same day adds to the existing summaries
+        importers.import_transactions(self.user, rows[:1])
+        self.assertEqual(DailySummary.objects.get(
+            user=self.user, category=self.cat_income).count, 2)
+
+    def test_import_sub_cent_amounts(self):
+        # The balance and the stats are the sum of the stored amounts
+        rows = [{'text': 'Lunch', 'amount': Decimal('10.005'), 'category': None, 'created': None},
+                {'text': 'Dinner', 'amount': Decimal('10.005'), 'category': None, 'created': None}]
+        importers.import_transactions(self.user, rows)
+        self.assertEqual(sorted(t.amount for t in self.user.transactions.all()), [Decimal('10.01')] * 2)
+        self.assertEqual(self.user.get_balance(), Decimal('20.02'))
+        self.assertEqual(self.user.get_total_income(), Decimal('20.02'))
+
+    def test_import_transactions_rejects_whole_batch(self):
+        rows = [{'text': 'Salary', 'amount': 1000, 'category': None, 'created': None},
+                {'text': 'Car', 'amount': -5000, 'category': None, 'created': None}]
+        with self.assertRaisesRegex(ValidationError, 'Your balance is insufficient.'):
+            importers.import_transactions(self.user, rows, chunk_size=1)
+        self.assertEqual(self.user.get_balance(), 0)
+        self.assertFalse(self.user.transactions.exists())
+        self.assertEqual(self.user.get_total_transactions(), 0)
+        with self.assertRaisesRegex(ValidationError, 'Unknown category: Gifts.'):
+            importers.import_transactions(
+                self.user, [{'text': 'Gift', 'amount': 10, 'category': 'Gifts', 'created': None}])
+        with self.assertRaisesRegex(ValidationError, 'The ammount should be different from 0.'):
+            importers.import_transactions(
+                self.user, [{'text': 'Nothing', 'amount': 0, 'category': None, 'created': None}])
+
+    def test_import_many_transactions(self):
+        start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        rows = ({'text': f'income{i}', 'amount': i % 100 + 1, 'category': 'Jobs' if i % 2 else None,
+                 'created': start + datetime.timedelta(hours=i)} for i in range(5000))
+        self.assertEqual(importers.import_transactions(self.user, rows), 5000)
+        self.assertEqual(self.user.get_balance(), 50.5 * 5000)
+        self.assertEqual(self.user.get_total_transactions(), 5000)
+        def key(s): return (s['date'], s['source'], s['category_id'] or 0)
+        self.assertEqual(sorted(DailySummary.compute(self.user), key=key), sorted(DailySummary.objects.filter(
+            user=self.user).values('date', 'source', 'category_id', 'amount', 'count'), key=key))
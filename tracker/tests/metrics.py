@@ -0,0 +1,75 @@
+from unittest import mock
+from django.core.exceptions import ValidationError
+from django.test import Client, override_settings
+from tracker import cache, metrics
+from tracker.models import AvatarJob, Transaction
+from tracker.tests.base import BaseTestCase
+
+
+class MetricsTestCase(BaseTestCase):
+    def setUp(self):
+        self.use_metrics_db()
+        super().setUp()
+        metrics.REGISTRY.clear()
+
+    def scrape(self):
+        response = Client().get('/metrics')
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        return response.content.decode()
+
+    def test_requests(self):
+        client = Client()
+        client.force_login(self.user)
+        for _ in range(3):
+            client.get('/api/balance')
+        client.get('/')
+        output = self.scrape()
+        self.assertIn('# TYPE tracker_request_duration_seconds histogram', output)
+        self.assertIn(
+            'tracker_request_duration_seconds_bucket{method="GET",url_name="api-balance",le="+Inf"} 3', output)
+        self.assertIn('tracker_request_duration_seconds_count{method="GET",url_name="api-balance"} 3', output)
+        self.assertIn('tracker_request_duration_seconds_count{method="GET",url_name="index"} 1', output)
+        # Session, user and balance, then the balance is cached
+        self.assertIn('tracker_request_queries_total{method="GET",url_name="api-balance"} 7', output)
+        # The buckets are cumulative
+        buckets = [float(line.rsplit(' ', 1)[1]) for line in output.splitlines()
+                   if line.startswith('tracker_request_duration_seconds_bucket{method="GET",url_name="api-balance"')]
+        self.assertEqual(len(buckets), len(metrics.DEFAULT_BUCKETS) + 1)
+        self.assertEqual(buckets, sorted(buckets))
+
+    def test_allowed_ips(self):
+        self.assertEqual(Client(REMOTE_ADDR='203.0.113.7').get('/metrics').status_code, 403)
+        with override_settings(METRICS_ALLOWED_IPS=['203.0.113.7']):
+            self.assertEqual(Client(REMOTE_ADDR='203.0.113.7').get('/metrics').status_code, 200)
+            self.assertEqual(Client().get('/metrics').status_code, 403)
+
+    def test_one_write_per_request(self):
+        client = Client()
+        client.force_login(self.user)
+        with mock.patch.object(metrics.REGISTRY, 'add', wraps=metrics.REGISTRY.add) as add:
+            client.get('/api/balance')
+        add.assert_called_once()
+
+    def test_balance_refusals(self):
+        with self.assertRaises(ValidationError):
+            Transaction(text='Car', amount=-5000, user=self.user).save()
+        self.assertIn('tracker_balance_refusals_total 1\n', self.scrape())
+
+    def test_avatar_duration(self):
+        job = AvatarJob.objects.create(user=self.user, upload='missing.jpg')
+        job.run()
+        self.assertEqual(job.status, AvatarJob.FAILED)
+        self.assertIn('tracker_avatar_processing_seconds_count{status="failed"} 1', self.scrape())
+
+    def test_cache(self):
+        cache.reset_stats()
+        self.user.get_balance()
+        self.user.get_balance()
+        output = self.scrape()
+        self.assertIn('tracker_cache_requests_total{name="balance",outcome="hits"} 1', output)
+        self.assertIn('tracker_cache_hit_ratio{name="balance"} 0.5', output)
+
+    def test_labels(self):
+        with self.assertRaisesMessage(ValueError, 'tracker_request_queries_total has the labels method, url_name.'):
+            metrics.REQUEST_QUERIES.inc(url_name='index')
+        self.assertEqual(metrics.format_labels({'path': 'a"b\\'}), 'path="a\\"b\\\\"')
@@ -1,6 +1,13 @@
+import threading
+from datetime import date, timedelta
+from decimal import Decimal
+from django.db import connection, transaction
+from django.utils import timezone
 from django.db.utils import IntegrityError
+from django.test import TransactionTestCase
 from django.core.exceptions import ValidationError
-from tracker.models import User, Transaction, Category, Balance
+from tracker import cache
+from tracker.models import User, Transaction, Category, Balance, UserStats, DailySummary
 from tracker.tests.base import BaseTestCase
 
 
@@ -17,7 +24,7 @@ class ModelsTestCase(BaseTestCase):
             text='income1', amount=500, user=self.user)
         transaction.save()
         balance = Balance.objects.filter(user=self.user).first()
-        self.assertEqual(str(balance), '$ 500.0')
+        self.assertEqual(str(balance), '$ 500.00')
 
     def test_income_transactions(self):
         transaction1 = Transaction(
@@ -43,6 +50,51 @@ class ModelsTestCase(BaseTestCase):
         self.assertEqual(self.user.get_balance(), 200)
         self.assertEqual(self.user.get_total_expense(), -300)
 
+    def test_money_is_exact(self):
+        for amount in (0.1, 0.2, '0.29'):
+            Transaction(text='income', amount=amount, user=self.user).save()
+        Transaction(text='expense', amount=-0.49, user=self.user).save()
+        self.assertEqual(self.user.get_balance(), Decimal('0.10'))
+        self.assertEqual(self.user.get_total_income(), Decimal('0.59'))
+        transaction = Transaction.objects.get(text='expense')
+        self.assertEqual(transaction.amount, Decimal('-0.49'))
+        # Stored as integer cents
+        self.assertEqual(Transaction.objects.filter(
+            amount=Decimal('-0.49')).count(), 1)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT amount FROM tracker_transaction WHERE id = %s', [transaction.id])
+            self.assertEqual(cursor.fetchone(), (-49,))
+        self.assertEqual(Transaction(amount='1.005').amount, Decimal('1.01'))
+        with self.assertRaises(ValidationError):
+            Transaction(amount='abc')
+
+    def test_user_stats(self):
+        self.assertEqual(self.user.get_stats(), {
+            'income': 0, 'expense': 0, 'count': 0, 'last_activity': None})
+        transaction1 = Transaction(
+            text='income', amount=500, user=self.user)
+        transaction2 = Transaction(
+            text='expense', amount=-100, user=self.user)
+        transaction1.save()
+        transaction2.save()
+        self.assertEqual(self.user.get_total_income(), 500)
+        self.assertEqual(self.user.get_total_expense(), -100)
+        self.assertEqual(self.user.get_total_transactions(), 2)
+        self.assertIsNotNone(self.user.get_stats()['last_activity'])
+        transaction2.delete()
+        self.assertEqual(self.user.get_total_expense(), 0)
+        self.assertEqual(self.user.get_total_transactions(), 1)
+        self.assertEqual(str(UserStats.objects.get(user=self.user)), '1 transactions, + 500.00 / 0.00')
+
+    def test_user_stats_rolled_back_with_failed_transaction(self):
+        transaction = Transaction(
+            text='expense', amount=-100, user=self.user)
+        with self.assertRaises(ValidationError):
+            transaction.save()
+        self.assertEqual(self.user.get_total_transactions(), 0)
+        self.assertEqual(self.user.get_total_expense(), 0)
+
     def test_zero_transactions(self):
         transaction = Transaction(
             text='income', amount=0, user=self.user)
@@ -108,6 +160,121 @@ class ModelsTestCase(BaseTestCase):
         transaction2.save()
         self.assertEqual(self.user.get_balance(), 300)
 
+    def test_report_amount_from_category(self):
+        cat_1 = Category(title='Jobs', user=self.user)
+        cat_2 = Category(title='Interest', user=self.user)
+        cat_3 = Category(title='Gifts', user=self.user)
+        cat_4 = Category(title='Utilities', source='expense', user=self.user)
+        for c in (cat_1, cat_2, cat_3, cat_4):
+            c.save()
+        Transaction(text='income_1', amount=500,
+                    category=cat_1, user=self.user).save()
+        Transaction(text='income_2', amount=200,
+                    category=cat_1, user=self.user).save()
+        Transaction(text='income_3', amount=50,
+                    category=cat_2, user=self.user).save()
+        Transaction(text='expense_1', amount=100,
+                    category=cat_4, user=self.user).save()
+        with self.assertNumQueries(1):
+            report = self.user.get_report_amount_from_category('income')
+        self.assertEqual(report, {'titles': ['Gifts', 'Interest', 'Jobs'],
+                                  'amounts': [0.0, 50.0, 700.0]})
+        for c in (cat_1, cat_2, cat_3):
+            self.assertIn(c.get_balance_from_category(), report['amounts'])
+        self.assertEqual(self.user.get_report_amount_from_category('expense'),
+                         {'titles': ['Utilities'], 'amounts': [-100.0]})
+
+    def test_daily_summary(self):
+        cat_expense = Category(
+            title='Utilities', source='expense', user=self.user)
+        cat_expense.save()
+        transaction1 = Transaction(
+            text='income_1', amount=500, user=self.user)
+        transaction2 = Transaction(
+            text='income_2', amount=200, user=self.user)
+        transaction3 = Transaction(
+            text='expense_1', amount=100, category=cat_expense, user=self.user)
+        transaction1.save()
+        transaction2.save()
+        transaction3.save()
+        summaries = DailySummary.objects.filter(
+            user=self.user).order_by('source')
+        self.assertEqual([(s.source, s.category, s.amount, s.count) for s in summaries],
+                         [('expense', cat_expense, -100, 1), ('income', None, 700, 2)])
+        self.assertEqual(str(summaries[1]),
+                         f'{summaries[1].date} income: 700.00 (2)')
+        transaction2.delete()
+        self.assertEqual(DailySummary.objects.get(
+            user=self.user, source='income').amount, 500)
+        # The day is removed with its last transaction
+        transaction3.delete()
+        self.assertFalse(DailySummary.objects.filter(
+            user=self.user, source='expense').exists())
+
+    def test_daily_summary_unique_without_category(self):
+        day = date(2021, 1, 1)
+        DailySummary.objects.create(user=self.user, date=day, source='income', amount=100, count=1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            DailySummary.objects.create(user=self.user, date=day, source='income', amount=50, count=1)
+        # Another source, or a category, is another summary
+        DailySummary.objects.create(user=self.user, date=day, source='expense', amount=-50, count=1)
+        category = Category.objects.create(title='Jobs', user=self.user)
+        DailySummary.objects.create(user=self.user, date=day, source='income', category=category,
+                                    amount=50, count=1)
+
+    def test_report_by_granularity(self):
+        for i in range(1, 5):
+            Transaction(text=f'income{i}', amount=100 *
+                        i, user=self.user).save()
+        for i, created in enumerate(['2021-01-04', '2021-01-06', '2021-02-01', '2022-03-01'], start=1):
+            Transaction.objects.filter(text=f'income{i}').update(
+                created=f'{created}T10:00:00Z')
+        DailySummary.rebuild(self.user)
+        start, end = date(2021, 1, 1), date(2022, 12, 31)
+        self.assertEqual(self.user.get_report('income', start, end),
+                         {'amounts': [100, 200, 300, 400], 'time': [date(2021, 1, 4), date(2021, 1, 6), date(2021, 2, 1), date(2022, 3, 1)]})
+        self.assertEqual(self.user.get_report('income', start, end, 'week'),
+                         {'amounts': [300, 300, 400], 'time': [date(2021, 1, 4), date(2021, 2, 1), date(2022, 2, 28)]})
+        self.assertEqual(self.user.get_report('income', start, end, 'month'),
+                         {'amounts': [300, 300, 400], 'time': [date(2021, 1, 1), date(2021, 2, 1), date(2022, 3, 1)]})
+        self.assertEqual(self.user.get_report('income', start, end, 'year'),
+                         {'amounts': [600, 400], 'time': [date(2021, 1, 1), date(2022, 1, 1)]})
+        self.assertEqual(self.user.get_report('income', date(2021, 1, 5), date(2021, 1, 31)),
+                         {'amounts': [200], 'time': [date(2021, 1, 6)]})
+
+    def test_dashboard(self):
+        today = timezone.localdate()
+        for i, (amount, days) in enumerate([(500, 0), (300, 2), (-200, 0), (-50, 10)]):
+            Transaction(text=f'transaction{i}', amount=amount, user=self.user,
+                        created=timezone.now() - timedelta(days=days)).save()
+        cache.invalidate(self.user.id)
+        # Totals and series in a single query
+        with self.assertNumQueries(1):
+            dashboard = self.user.get_dashboard(days=3)
+        self.assertEqual(dashboard, {
+            'balance': 550, 'income': 800, 'expense': -250, 'count': 4,
+            'daily': {'time': [today - timedelta(days=2), today - timedelta(days=1), today],
+                      'income': [300, 0, 500], 'expense': [0, 0, -200]}})
+        with self.assertNumQueries(0):
+            self.user.get_dashboard(days=3)
+        self.assertEqual(self.user.get_dashboard()['daily']['income'], [0, 0, 0, 0, 300, 0, 500])
+        self.assertEqual(self.user2.get_dashboard(days=1), {
+            'balance': 0, 'income': 0, 'expense': 0, 'count': 0,
+            'daily': {'time': [today], 'income': [0], 'expense': [0]}})
+        # The balance is the one of /api/balance, even without any summary
+        Balance.objects.filter(user__in=[self.user, self.user2]).update(amount=Decimal(1000))
+        for user in (self.user, self.user2):
+            cache.invalidate(user.id)
+            self.assertEqual(user.get_dashboard(days=1)['balance'], 1000)
+
+    def test_transaction_indexes(self):
+        plan = self.user.transactions.all()[:5].explain()
+        self.assertIn('transaction_user_created_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        plan = self.user.get_categories_with_balance().filter(source='income').explain()
+        self.assertIn('category_user_source_idx', plan)
+        self.assertIn('transaction_category_user_idx', plan)
+
     def test_remove_transaction(self):
         transaction1 = Transaction(
             text='income_1', amount=500, user=self.user)
@@ -148,6 +315,11 @@ class ModelsTestCase(BaseTestCase):
         self.assertEqual(self.user.get_balance(), 200)
         cat_expense.delete()
         self.assertEqual(self.user.get_balance(), 500)
+        # The transactions and their summaries are deleted, accounted for once
+        self.assertEqual(list(Transaction.objects.filter(user=self.user)), [transaction1])
+        self.assertFalse(DailySummary.objects.filter(source='expense').exists())
+        stats = UserStats.objects.get(user=self.user)
+        self.assertEqual((stats.income, stats.expense, stats.count), (500, 0, 1))
 
     def test_create_user_with_duplicate_username(self):
         with self.assertRaisesRegexp(IntegrityError, 'UNIQUE constraint failed: tracker_user.username'):
@@ -158,3 +330,63 @@ class ModelsTestCase(BaseTestCase):
         with self.assertRaisesRegexp(IntegrityError, 'UNIQUE constraint failed: tracker_user.email'):
             user = User.objects.create_user(
                 'albert', 'truong.phan@outlook.com', '123456')
+
+
+class ConcurrentBalanceTestCase(TransactionTestCase):
+    THREADS = 8
+    TRANSACTIONS_PER_THREAD = 10
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            'blue', 'truong.phan@outlook.com', '123456')
+
+    def run_threads(self, target):
+        threads = [threading.Thread(target=target)
+                   for _ in range(self.THREADS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def test_concurrent_transactions_do_not_lose_updates(self):
+        errors = []
+
+        def worker():
+            try:
+                for _ in range(self.TRANSACTIONS_PER_THREAD):
+                    Transaction(text='income', amount=10,
+                                user_id=self.user.id).save()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        self.run_threads(worker)
+        self.assertEqual(errors, [])
+        self.assertEqual(self.user.get_balance(),
+                         10 * self.THREADS * self.TRANSACTIONS_PER_THREAD)
+        self.assertEqual(self.user.transactions.count(),
+                         self.THREADS * self.TRANSACTIONS_PER_THREAD)
+
+    def test_concurrent_expenses_never_overdraw(self):
+        Transaction(text='income', amount=100, user=self.user).save()
+        rejected = []
+
+        def worker():
+            try:
+                for _ in range(self.TRANSACTIONS_PER_THREAD):
+                    try:
+                        Transaction(text='expense', amount=-10,
+                                    user_id=self.user.id).save()
+                    except ValidationError:
+                        rejected.append(1)
+            finally:
+                connection.close()
+
+        self.run_threads(worker)
+        # The balance must stay positive, so only 9 expenses can go through
+        self.assertEqual(self.user.get_balance(), 10)
+        self.assertEqual(self.user.transactions.filter(
+            source='expense').count(), 9)
+        self.assertEqual(len(rejected), self.THREADS *
+                         self.TRANSACTIONS_PER_THREAD - 9)
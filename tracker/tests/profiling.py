@@ -0,0 +1,49 @@
+import json
+from unittest import mock
+from django.test import Client, override_settings
+from tracker.models import Transaction
+from tracker.tests.base import BaseTestCase
+
+
+class ProfilingTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        Transaction.objects.create(text='Salary', amount=100, user=self.user)
+
+    def get(self, path, rate=1):
+        # The middlewares are loaded by the first request of a client
+        with override_settings(PROFILING_SAMPLE_RATE=rate):
+            client = Client()
+            client.force_login(self.user)
+            return client.get(path)
+
+    def test_server_timing(self):
+        with self.assertLogs('tracker.profiling', 'INFO') as logs:
+            response = self.get('/')
+        self.assertEqual(response.status_code, 200)
+        timings = dict(metric.split(';', 1) for metric in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timings), {'db', 'tpl', 'view', 'total'})
+        self.assertRegex(timings['db'], r'^dur=[\d.]+;desc="\d+ queries"$')
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line['url_name'], 'index')
+        self.assertEqual(line['status'], 200)
+        self.assertGreater(line['queries'], 0)
+        self.assertGreater(line['template_ms'], 0)
+        self.assertLessEqual(line['db_ms'] + line['template_ms'] + line['view_ms'], line['total_ms'] + 0.01)
+
+    def test_api_view(self):
+        with self.assertLogs('tracker.profiling', 'INFO') as logs:
+            response = self.get('/api/balance')
+        self.assertIn('Server-Timing', response)
+        line = json.loads(logs.records[0].getMessage())
+        # Session, user and balance
+        self.assertEqual(line['queries'], 3)
+        self.assertEqual(line['template_ms'], 0)
+
+    def test_sampling(self):
+        self.assertNotIn('Server-Timing', self.get('/api/balance', rate=0))
+        with mock.patch('tracker.middleware.random.random', return_value=0.6):
+            self.assertNotIn('Server-Timing', self.get('/api/balance', rate=0.5))
+        with mock.patch('tracker.middleware.random.random', return_value=0.4), \
+                self.assertLogs('tracker.profiling', 'INFO'):
+            self.assertIn('Server-Timing', self.get('/api/balance', rate=0.5))
@@ -0,0 +1,141 @@
+import json
+from datetime import timedelta
+from unittest import mock
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.template.loader import render_to_string
+from django.test import Client, override_settings
+from django.urls import URLPattern
+from django.utils import timezone
+from tracker import api, urls, views
+from tracker.models import Category, DailySummary, Transaction, UserStats
+from tracker.queries import capture_queries, get_budget, shape
+from tracker.tests.base import BaseTestCase
+
+
+class QueryBudgetTestCase(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.categories = [Category.objects.create(title=f'Income {i}', user=self.user) for i in range(3)]
+        self.categories += [Category.objects.create(title=f'Expense {i}', source='expense', user=self.user)
+                            for i in range(3)]
+        now = timezone.now()
+        # Several rows of each category on the pages, as a query per row
+        # would show up as N+1 queries
+        for i in range(12):
+            Transaction.objects.create(text=f'Income {i}', amount=100, category=self.categories[i % 3],
+                                       user=self.user, created=now - timedelta(days=i))
+            Transaction.objects.create(text=f'Expense {i}', amount=-10, category=self.categories[3 + i % 3],
+                                       user=self.user, created=now - timedelta(days=i, hours=1))
+
+    def test_every_view_has_a_budget(self):
+        for pattern in urls.urlpatterns:
+            self.assertIsInstance(pattern, URLPattern)
+            queries, _ = get_budget(pattern.callback)
+            self.assertIsNotNone(
+                queries, f'{pattern.name} does not declare a query budget.')
+
+    def test_views(self):
+        category = self.categories[0]
+        for path in ('/', '/transactions', '/categories', f'/category/{category.id}', '/reports',
+                     '/account'):
+            # Computed then cached
+            for _ in range(2):
+                response = self.assertQueryBudget(path)
+                self.assertEqual(response.status_code, 200)
+        self.assertQueryBudget('/', 'post', {'amount': '-5', 'text': 'Coffee', 'category': category.id})
+        self.assertQueryBudget('/categories', 'post', {'title': 'Gifts', 'source': 'income'})
+        self.assertQueryBudget('/account', 'post', {'first_name': 'Blue', 'last_name': 'Sky', 'email': 'blue@example.com'})
+        self.assertQueryBudget('/logout')
+        self.assertQueryBudget('/login')
+        self.assertQueryBudget('/login', 'post', {'username': 'blue', 'password': '123456'})
+        self.client.logout()
+        self.assertQueryBudget('/register')
+        self.assertQueryBudget('/register', 'post', {'username': 'green', 'email': 'green@example.com',
+                                                     'password': '123456', 'confirmation': '123456'})
+
+    def test_category_view_is_bounded(self):
+        category = self.categories[0]
+        Transaction.objects.bulk_create([Transaction(text='Salary', amount=1, category=category, user=self.user)
+                                         for _ in range(views.CATEGORY_TRANSACTIONS)])
+        response = self.assertQueryBudget(f'/category/{category.id}')
+        self.assertEqual(len(response.context['transactions']), views.CATEGORY_TRANSACTIONS)
+        # The categories of other users are not shown
+        other = Category.objects.create(title='Other', user=self.user2)
+        self.assertEqual(self.client.get(f'/category/{other.id}').status_code, 404)
+
+    def test_api(self):
+        for path in ('/api/reports', '/api/insights', '/api/transactions', '/api/transactions?limit=20',
+                     '/api/transactions/export', '/api/transactions/export?format=jsonl', '/api/category',
+                     '/api/category?source=income', '/api/avatar', '/api/balance', '/api/dashboard'):
+            for _ in range(2):
+                response = self.assertQueryBudget(path)
+                self.assertEqual(response.status_code, 200)
+        self.assertQueryBudget('/api/transaction', 'delete', json.dumps(
+            {'transaction_id': self.user.transactions.filter(source='expense').first().id}))
+        self.assertQueryBudget('/api/category', 'delete', json.dumps(
+            {'category_id': self.categories[-1].id}))
+        # The second import adds to the existing daily summaries
+        for _ in range(2):
+            self.assertQueryBudget('/api/transactions/import', 'post', {'file': SimpleUploadedFile(
+                'statement.csv', b'date,text,amount,category\n2021-05-03,Salary,1000,Income 0\n'
+                b'2021-05-04,Coffee,-3.5,Expense 0\n2021-05-05,Tea,-2,Expense 0\n')})
+        self.assertEqual(self.user.get_balance(), 1080 + 10 + 40 + 2 * 994.5)
+        # The summaries and stats adjusted in bulk match the ledger
+        columns = ('date', 'source', 'category_id', 'amount', 'count')
+        self.assertEqual(sorted(tuple(s[c] for c in columns) for s in DailySummary.compute(self.user)),
+                         sorted(DailySummary.objects.filter(user=self.user).values_list(*columns)))
+        self.assertEqual(UserStats.compute(self.user)['count'], UserStats.objects.get(user=self.user).count)
+
+    def test_unbounded_writes(self):
+        # The queries grow with the chunks of the import, not with the rows
+        lines = [b'date,text,amount,category'] + [
+            f'{timezone.localdate() - timedelta(days=i)},Coffee,-1,Expense 0'.encode() for i in range(1500)]
+        Transaction.objects.create(text='Savings', amount=5000, user=self.user)
+        self.assertQueryBudget('/api/transactions/import', 'post', {'file': SimpleUploadedFile(
+            'statement.csv', b'\n'.join(lines))})
+        self.assertEqual(Transaction.objects.filter(category=self.categories[3]).count(), 1504)
+        # The transactions of a category are deleted at once
+        self.assertQueryBudget('/api/category', 'delete', json.dumps({'category_id': self.categories[3].id}))
+        self.assertFalse(Transaction.objects.filter(category=self.categories[3].id).exists())
+
+    def test_batch(self):
+        paths = ['/api/reports', '/api/insights', '/api/transactions?limit=20', '/api/avatar', '/api/balance',
+                 '/api/dashboard']
+        paths += [f'/api/category?source={source}&{i}' for i in range(7)
+                  for source in ('income', 'expense')]
+        self.assertEqual(len(paths), api.MAX_BATCH_SIZE)
+        response = self.assertQueryBudget(
+            '/api/batch', 'post', json.dumps({'requests': paths}), content_type='application/json')
+        self.assertEqual(len(response.json()['responses']), api.MAX_BATCH_SIZE)
+
+    def test_n_plus_one(self):
+        # The transactions widget reads the category of each row
+        with capture_queries() as log:
+            render_to_string('tracker/widgets/transactions.html',
+                             {'transactions': self.user.transactions.all()[:5]})
+        self.assertEqual(list(log.repeated().values()), [5])
+        with capture_queries() as log:
+            render_to_string('tracker/widgets/transactions.html',
+                             {'transactions': self.user.transactions.select_related('category')[:5]})
+        self.assertEqual(len(log), 1)
+        self.assertFalse(log.repeated())
+
+    def test_shape(self):
+        self.assertEqual(shape('SELECT * FROM t WHERE id IN (%s, %s, %s)'),
+                         shape('SELECT *  FROM t\nWHERE id IN (%s)'))
+        self.assertNotEqual(shape('SELECT * FROM t WHERE id = %s'),
+                            shape('SELECT * FROM t WHERE text = %s'))
+
+    def test_middleware(self):
+        # The middleware is only used in DEBUG (the tests run without)
+        self.assertNotIn('X-Query-Count', self.client.get('/api/balance'))
+        with override_settings(DEBUG=True):
+            client = Client()
+            client.force_login(self.user)
+            response = client.get('/api/balance')
+            self.assertTrue(int(response['X-Query-Count']) > 0)
+            with mock.patch.object(api.balance, 'query_budget', (1, 0)), \
+                    self.assertLogs('tracker.queries', 'WARNING') as logs:
+                client.get('/api/balance')
+        self.assertIn('N+1 queries on /api/balance', logs.output[0])
+        self.assertIn('/api/balance ran 2 queries, over its budget of 1', logs.output[-1])
@@ -0,0 +1,39 @@
+import json
+from datetime import datetime, timedelta, timezone
+from django.contrib.humanize.templatetags.humanize import naturaltime
+from django.core.serializers.json import DjangoJSONEncoder
+from tracker.models import Category, Transaction
+from tracker.serializers import human_times, json_datetime, serialize_transactions, transaction_values
+from tracker.tests.base import BaseTestCase
+
+
+class SerializersTestCase(BaseTestCase):
+    def test_serialize_transactions(self):
+        category = Category(title='Jobs', user=self.user)
+        category.save()
+        Transaction(text='income_1', amount=500.1, category=category, user=self.user,
+                    created=datetime(2021, 5, 3, 10, 0, 0, 123456, tzinfo=timezone.utc)).save()
+        Transaction(text='income_2', amount=100, user=self.user,
+                    created=datetime(2021, 5, 4, tzinfo=timezone.utc)).save()
+        with self.assertNumQueries(1):
+            rows = serialize_transactions(transaction_values(self.user.transactions.all()))
+        self.assertEqual(rows[1], {
+            'id': rows[1]['id'], 'text': 'income_1', 'source': 'income', 'category_id': category.id,
+            'amount': 500.1, 'user_id': self.user.id, 'created': '2021-05-03T10:00:00.123Z',
+            'category_title': 'Jobs', 'human_time': naturaltime(datetime(2021, 5, 3, 10, 0, 0, 123456, tzinfo=timezone.utc))})
+        self.assertEqual(rows[0]['created'], '2021-05-04T00:00:00Z')
+        self.assertIsNone(rows[0]['category_title'])
+
+    def test_json_datetime(self):
+        for value in (datetime(2021, 5, 3, 10, 0, 0, 123456, tzinfo=timezone.utc), datetime(2021, 5, 3),
+                      datetime(2021, 5, 3, tzinfo=timezone(timedelta(hours=7)))):
+            self.assertEqual(json.dumps(json_datetime(value)),
+                             json.dumps(value, cls=DjangoJSONEncoder))
+
+    def test_human_times(self):
+        human_time = human_times()
+        now = datetime.now(timezone.utc)
+        # Every 7 hours 13 minutes over 5 years, through the leap days
+        values = [now - timedelta(minutes=433 * i) for i in range(6000)]
+        self.assertEqual([human_time(value) for value in values],
+                         [naturaltime(value) for value in values])
@@ -0,0 +1,76 @@
+from io import StringIO
+from types import SimpleNamespace
+from django.core.management import call_command
+from django.test import override_settings
+from tracker import slow_queries
+from tracker.models import Balance, Category, Transaction
+from tracker.tests.base import BaseTestCase
+
+
+class SlowQueriesTestCase(BaseTestCase):
+    def setUp(self):
+        self.use_metrics_db()
+        super().setUp()
+        slow_queries.clear()
+        self.category = Category.objects.create(title='Food', source=Category.EXPENSE, user=self.user)
+        Transaction.objects.create(text='Salary', amount=100, user=self.user)
+        Transaction.objects.create(text='Lunch', amount=-10, category=self.category, user=self.user)
+
+    def test_slow_query(self):
+        with override_settings(SLOW_QUERY_MS=0), self.assertLogs('tracker.slow_queries', 'WARNING') as logs:
+            for _ in range(3):
+                self.category.get_balance_from_category()
+        # Logged and explained once, counted each time
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn('Category.get_balance_from_category', logs.output[0])
+        [query] = slow_queries.worst()
+        self.assertEqual(query['count'], 3)
+        self.assertRegex(query['caller'], r'^Category\.get_balance_from_category \(tracker/models\.py:\d+\)$')
+        self.assertIn('SUM', query['sql'])
+        self.assertIn(str(self.category.id), query['params'])
+        self.assertRegex(query['plan'], 'SEARCH|SCAN')
+        self.assertGreaterEqual(query['max_ms'], 0)
+
+    def test_caller_before_python_311(self):
+        # Code objects have no co_qualname before Python 3.11
+        def frame(function, **locals):
+            code = function.__code__
+            return SimpleNamespace(f_code=SimpleNamespace(
+                co_name=code.co_name, co_filename=code.co_filename, co_firstlineno=code.co_firstlineno),
+                f_locals=locals)
+        self.assertEqual(slow_queries.qualname(frame(Category.get_balance_from_category, self=self.category)),
+                         'Category.get_balance_from_category')
+        self.assertEqual(slow_queries.qualname(frame(Balance.adjust, cls=Balance)), 'Balance.adjust')
+        self.assertEqual(slow_queries.qualname(frame(slow_queries.find_caller)), 'find_caller')
+
+    def test_threshold(self):
+        with override_settings(SLOW_QUERY_MS=None):
+            self.category.get_balance_from_category()
+        with override_settings(SLOW_QUERY_MS=60000):
+            self.category.get_balance_from_category()
+        self.assertEqual(slow_queries.worst(), [])
+
+    def test_writes_are_not_run_twice(self):
+        with override_settings(SLOW_QUERY_MS=0), self.assertLogs('tracker.slow_queries', 'WARNING'):
+            Transaction.objects.filter(user=self.user).update(text='Explained')
+            self.assertEqual(Transaction.objects.filter(text='Explained').count(), 2)
+            Category.objects.filter(pk=self.category.pk).delete()
+        self.assertFalse(Category.objects.filter(pk=self.category.pk).exists())
+        self.assertTrue(all(query['plan'] for query in slow_queries.worst()))
+
+    def test_command(self):
+        out, err = StringIO(), StringIO()
+        call_command('slow_queries', stdout=out, stderr=err)
+        self.assertEqual(out.getvalue(), 'There is no slow query.\n')
+        self.assertIn('SLOW_QUERY_MS is not set', err.getvalue())
+        with override_settings(SLOW_QUERY_MS=0), self.assertLogs('tracker.slow_queries', 'WARNING'):
+            self.category.get_balance_from_category()
+            self.user.get_balance()
+        out = StringIO()
+        call_command('slow_queries', '--order', 'count', '--limit', '1', stdout=out)
+        output = out.getvalue()
+        self.assertTrue(output.startswith('1. '))
+        self.assertNotIn('\n2. ', output)
+        self.assertIn('    | ', output)
+        call_command('slow_queries', '--reset', stdout=StringIO())
+        self.assertEqual(slow_queries.worst(), [])
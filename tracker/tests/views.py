@@ -1,5 +1,6 @@
 import os
-from tracker.models import Category
+import json
+from tracker.models import Category, Transaction
 from django.test import override_settings
 from django.urls import reverse
 from tracker.tests.base import BaseTestCase
@@ -36,6 +37,16 @@ class ViewsTestCase(BaseTestCase):
         self.assertNotContains(response, 'BALANCE')
         self.assertNotContains(response, 'More')
 
+    def test_transactions_view_cursor(self):
+        for i in range(1, 7):
+            Transaction(text=f'income{i}', amount=50*i, user=self.user).save()
+        response = self.client.get(reverse('transactions'))
+        self.assertContains(response, 'More')
+        response = self.client.get(
+            '/api/transactions', {'cursor': response.context['next_cursor']})
+        self.assertEqual(json.loads(response.content)[
+                         'transactions'][0]['text'], 'income1')
+
     def test_account_view(self):
         response = self.client.get(reverse('account'))
         self.assertEqual(self.user.email, 'truong.phan@outlook.com')
@@ -66,3 +77,5 @@ class ViewsTestCase(BaseTestCase):
         response = self.client.get(reverse('reports'))
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'Reports')
+        # Needed by the POST to /api/batch
+        self.assertIn('csrftoken', response.cookies)
@@ -0,0 +1,49 @@
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+MAX_UPLOAD_SIZE = 2 * 1024 * 1024
+
+
+class TruncatedUpload(UploadedFile):
+    '''Stand-in for a file larger than the limit: it is empty but keeps the
+    size received so far so that the validators reject it.'''
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        super().__init__(None, name, content_type, size,
+                         charset, content_type_extra)
+
+    def open(self, mode=None):
+        return self
+
+    def read(self, *args, **kwargs):
+        return b''
+
+    def chunks(self, chunk_size=None):
+        return iter(())
+
+
+class SizeLimitUploadHandler(FileUploadHandler):
+    '''Stop buffering an uploaded file as soon as it crosses max_size, the
+    rest of the file is read from the request but not stored anywhere.
+    Must be the first upload handler.'''
+
+    def __init__(self, request=None, max_size=MAX_UPLOAD_SIZE):
+        super().__init__(request)
+        self.max_size = max_size
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            # Not passed to the next handlers (memory or temporary file)
+            return None
+        return raw_data
+
+    def file_complete(self, file_size):
+        if self.received > self.max_size:
+            return TruncatedUpload(self.file_name, self.content_type, self.received,
+                                   self.charset, self.content_type_extra)
+        return None
@@ -12,9 +12,18 @@ urlpatterns = [
     path("login", views.login_view, name="login"),
     path("logout", views.logout_view, name="logout"),
     path("register", views.register, name="register"),
+    path("metrics", views.metrics_view, name="metrics"),
     path("api/transaction", api.transaction, name="api-transaction"),
     path("api/reports", api.reports, name="api-reports"),
+    path("api/insights", api.insights, name="api-insights"),
     path("api/transactions", api.transactions, name="api-transactions"),
+    path("api/transactions/import", api.import_transactions,
+         name="api-import-transactions"),
+    path("api/transactions/export", api.export_transactions,
+         name="api-export-transactions"),
     path("api/category", api.category, name="api-category"),
     path("api/balance", api.balance, name="api-balance"),
+    path("api/avatar", api.avatar, name="api-avatar"),
+    path("api/dashboard", api.dashboard, name="api-dashboard"),
+    path("api/batch", api.batch, name="api-batch"),
 ]
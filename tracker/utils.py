@@ -1,12 +1,52 @@
-from PIL import Image
+import os
 import sys
-from django.http import JsonResponse
+from functools import wraps
+from PIL import Image, features
+import base64
+from datetime import datetime
+from django.http import HttpResponseNotModified, JsonResponse
+from django.utils import timezone
+from django.utils.http import parse_etags
 from smartcrop import SmartCrop
 
+# Shorter side of the image the saliency analysis runs on
+ANALYSIS_SIZE = 128
+# JPEG/WebP quality of the avatars, 100 makes files several times larger
+# without a visible difference at these sizes
+AVATAR_QUALITY = 85
+
+
+def data_etag(user):
+    '''ETag of the data of the user. It changes with the data version of the
+    stats, bumped in the database transaction of every write, so that it is
+    the same for every server process, and with the day as the default
+    periods of the reports end today. The stats are loaded with the user by
+    tracker.auth.ModelBackend, the cached values of the response are keyed
+    on the same data version (see cache.get_or_compute).'''
+    return f'"{user.id}-{user.stats.data_version}-{timezone.localdate():%Y%m%d}"'
 
-def login_required_ajax(view_func, *args, **kwargs):
-    from functools import wraps
 
+def etag_from_data_version(view_func):
+    '''Add the data ETag to the GET responses of a view, and answer 304
+    when it matches If-None-Match, before the queries of the view run.'''
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        if request.method != 'GET':
+            return view_func(request, *args, **kwargs)
+        etag = data_etag(request.user)
+        etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in etags or '*' in etags:
+            response = HttpResponseNotModified()
+        else:
+            response = view_func(request, *args, **kwargs)
+        response['ETag'] = etag
+        # Stored by the browser but always revalidated
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+    return _wrapped_view
+
+
+def login_required_ajax(view_func, *args, **kwargs):
     @wraps(view_func)
     def _wrapped_view(request, *args, **kwargs):
         if not request.user.is_authenticated:
@@ -15,26 +55,77 @@ def login_required_ajax(view_func, *args, **kwargs):
     return _wrapped_view
 
 
+def encode_cursor(transaction):
+    '''Opaque pagination cursor from the (created, id) of a transaction'''
+    value = f'{transaction.created.isoformat()}|{transaction.id}'
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor):
+    '''Return the (created, id) of an encoded cursor, raise ValueError if the
+    cursor is invalid.'''
+    try:
+        created, pk = base64.urlsafe_b64decode(
+            cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created), int(pk)
+    except ValueError as e:
+        raise ValueError('Invalid cursor.') from e
+
+
 def crop_smart(inputfile, outputfile, img_height, img_width):
+    return render_avatar(inputfile, {outputfile: (img_width, img_height)})
+
+
+def decode_image(inputfile, min_size):
+    '''Open and decode an image, JPEGs are decoded at the smallest scale
+    (1/2, 1/4 or 1/8) still covering min_size, which is much faster and
+    smaller than a full decode.'''
     image = Image.open(inputfile)
-    # if image.mode != 'RGB' and image.mode != 'RGBA':
-    #     sys.stderr.write("{1} convert from mode='{0}' to mode='RGB'\n".format(
-    #         image.mode, inputfile))
-    #     new_image = Image.new('RGB', image.size)
-    #     new_image.paste(image)
-    #     image = new_image
+    if image.format == 'JPEG':
+        image.draft('RGB', min_size)
+    image.load()
+    if image.mode not in ('RGB', 'RGBA', 'L'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    return image
 
-    cropper = SmartCrop()
-    result = cropper.crop(image, width=100, height=int(
-        img_height / img_width * 100))
 
+def render_avatar(inputfile, renditions, webp=False):
+    '''Crop the salient part of the image and write it at every size of
+    renditions {outputfile: (width, height)}, from a single decode. With
+    webp (if Pillow supports it) a .webp copy is written next to each
+    rendition. Return the written files.'''
+    width, height = max(renditions.values())
+    # Decode big enough for the largest rendition, the crop is as large as
+    # the shorter side of the image
+    image = decode_image(inputfile, (width, height))
+
+    # Saliency analysis on a small proxy, SmartCrop would otherwise
+    # downscale the full image itself
+    factor = max(1, min(image.size) / ANALYSIS_SIZE)
+    proxy = image.resize((round(image.width / factor), round(image.height / factor)),
+                         Image.BILINEAR, reducing_gap=2.0) if factor > 1 else image
+    if proxy.mode != 'RGB':
+        proxy = proxy.convert('RGB')
+    crop = SmartCrop().crop(proxy, width=100, height=int(
+        height / width * 100))['top_crop']
+    scale = image.width / proxy.width
     box = (
-        result['top_crop']['x'],
-        result['top_crop']['y'],
-        result['top_crop']['width'] + result['top_crop']['x'],
-        result['top_crop']['height'] + result['top_crop']['y']
+        max(0, round(crop['x'] * scale)),
+        max(0, round(crop['y'] * scale)),
+        min(image.width, round((crop['x'] + crop['width']) * scale)),
+        min(image.height, round((crop['y'] + crop['height']) * scale)),
     )
-    # it should be an option to convert image to greyscale
-    cropped_image = image.crop(box)
-    cropped_image.thumbnail((img_width, img_height), Image.ANTIALIAS)
-    cropped_image.save(outputfile, quality=100)
+    cropped = image.crop(box)
+
+    written = []
+    for outputfile, size in sorted(renditions.items(), key=lambda r: r[1], reverse=True):
+        rendition = cropped.resize(size, Image.LANCZOS, reducing_gap=3.0)
+        if rendition.mode == 'RGBA' and outputfile.lower().endswith(('.jpg', '.jpeg')):
+            rendition = rendition.convert('RGB')
+        rendition.save(outputfile, quality=AVATAR_QUALITY, optimize=True)
+        written.append(outputfile)
+        if webp and features.check('webp'):
+            webpfile = f'{os.path.splitext(outputfile)[0]}.webp'
+            rendition.save(webpfile, quality=AVATAR_QUALITY)
+            written.append(webpfile)
+    return written
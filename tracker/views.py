@@ -1,23 +1,30 @@
-import os
-import shutil
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError
-from django.http import HttpResponseRedirect
-from django.shortcuts import render
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseRedirect
+from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
-from .models import Category, User
-from django.shortcuts import render
+from django.views.decorators.csrf import csrf_exempt, csrf_protect, ensure_csrf_cookie
+from .models import AvatarJob, Category, User
+from . import metrics
 from .forms import NewTransactionForm, UserForm, CategoryForm
-from django.conf import settings
+from .queries import query_budget
+from .utils import encode_cursor
+from .uploads import SizeLimitUploadHandler
+
+# Latest transactions shown on the page of a category
+CATEGORY_TRANSACTIONS = 50
 
 
+@query_budget(8)
 @login_required(login_url='login')
 def index(request):
     context = {
-        'transactions': request.user.transactions.all()[:5],
+        'transactions': request.user.transactions.select_related('category')[:5],
+        'dashboard': request.user.get_dashboard(),
     }
 
     if request.method == 'GET':
@@ -40,15 +47,22 @@ def index(request):
     return render(request, 'tracker/index.html', context)
 
 
+@query_budget(5)
 @login_required(login_url='login')
 def transactions(request):
+    transactions = list(request.user.transactions.select_related(
+        'category').order_by('-created', '-id')[:5])
     context = {
-        'transactions': request.user.transactions.all()[:5],
+        'transactions': transactions,
         'form': NewTransactionForm(request.user)
     }
+    # Cursor for the infinite scroll to continue after the last transaction
+    if transactions:
+        context['next_cursor'] = encode_cursor(transactions[-1])
     return render(request, 'tracker/transactions.html', context)
 
 
+@query_budget(4)
 @login_required(login_url='login')
 def categories(request):
     form = CategoryForm()
@@ -62,61 +76,68 @@ def categories(request):
             messages.success(
                 request, 'Your new category has been created.')
             return HttpResponseRedirect(reverse('categories'))
-    categories = Category.objects.filter(user=request.user).all()
+    categories = request.user.get_categories_with_balance()
     context['categories'] = categories
     return render(request, 'tracker/categories.html', context)
 
 
+@query_budget(4)
 @login_required(login_url='login')
 def category(request, id):
-    cat = Category.objects.get(pk=id)
+    cat = get_object_or_404(Category, pk=id, user=request.user)
     context = {'transactions': request.user.transactions.filter(
-        category=cat)}
+        category=cat).select_related('category').order_by('-created', '-id')[:CATEGORY_TRANSACTIONS]}
     context['category'] = cat
     return render(request, 'tracker/category.html', context)
 
 
+@query_budget(2)
 @login_required(login_url='login')
+# The charts are fetched with a POST to /api/batch
+@ensure_csrf_cookie
 def reports(request):
     return render(request, 'tracker/reports.html')
 
 
+@query_budget(4)
 @login_required(login_url='login')
+@csrf_exempt
 def account(request):
+    # The upload handlers can only be changed before the body is read, which
+    # the CSRF middleware does, so the CSRF check is done by _account
+    request.upload_handlers.insert(0, SizeLimitUploadHandler(request))
+    return _account(request)
+
+
+@csrf_protect
+def _account(request):
     if request.method == 'POST':
         form = UserForm(request.POST, request.FILES, instance=request.user)
         if form.is_valid():
             changed_user = form.save(commit=False)
             if request.FILES:
-                # Handle uploading avatar
-                from .utils import crop_smart
-                _, ext = os.path.splitext(changed_user.avatar.name)
-                thumb_path = f'{settings.MEDIA_ROOT}/user_{request.user.id}/avatar/md{ext}'
-                old_path = f'{settings.MEDIA_ROOT}/user_{request.user.id}/avatar'
-                # Remove old avatar files
-                if os.path.exists(old_path):
-                    shutil.rmtree(old_path)
-                # Save to DB and upload file
+                # The avatar is cropped by a worker, keep serving the
+                # current one until then
+                AvatarJob.objects.create(
+                    user=changed_user, upload=form.cleaned_data['avatar'])
+                changed_user.avatar = form.initial['avatar']
                 changed_user.save()
-                # Keep the original one
-                shutil.copy(thumb_path,
-                            f'{settings.MEDIA_ROOT}/user_{request.user.id}/avatar/full{ext}')
-                # Crop and repalce the old file with new size
-                crop_smart(
-                    thumb_path, thumb_path, 128, 128)
+                messages.success(
+                    request, 'Your account is updated succesfully, your new avatar is being processed.')
             else:
                 changed_user.save()
-
-            messages.success(
-                request, 'Your account is updated succesfully.')
+                messages.success(
+                    request, 'Your account is updated succesfully.')
             return HttpResponseRedirect(reverse('account'))
 
     else:
         form = UserForm(instance=request.user)
-    context = {'form': form}
+    context = {'form': form, 'avatar_job': request.user.avatar_jobs.filter(
+        status__in=[AvatarJob.PENDING, AvatarJob.RUNNING]).first()}
     return render(request, 'tracker/account.html', context)
 
 
+@query_budget(5)
 def login_view(request):
     if request.method == 'POST':
         # Attempt to sign user in
@@ -136,11 +157,13 @@ def login_view(request):
         return render(request, 'tracker/login.html')
 
 
+@query_budget(4)
 def logout_view(request):
     logout(request)
     return HttpResponseRedirect(reverse('index'))
 
 
+@query_budget(8)
 def register(request):
     if request.method == 'POST':
         username = request.POST['username']
@@ -166,7 +189,15 @@ def register(request):
             return render(request, 'tracker/register.html', {
                 'message': msg
             })
-        login(request, user)
+        login(request, user, backend='tracker.auth.ModelBackend')
         return HttpResponseRedirect(reverse('index'))
     else:
         return render(request, 'tracker/register.html')
+
+
+@query_budget(0)
+def metrics_view(request):
+    # Prometheus text exposition format, for a scraper
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.expose(), content_type=metrics.CONTENT_TYPE)